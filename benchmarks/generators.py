@@ -0,0 +1,219 @@
+"""
+Deterministic generators of synthetic workloads for the benchmarks
+
+Every generator takes a seed, and the same seed always gives the same files,
+so timings from different checkouts are measured on identical inputs.
+
+- make_references: random reference sequences
+- make_clones: clones of those references, each with one kind of change
+  (CLONE_KINDS): none, point mutations, an insertion, a deletion, a
+  truncation or the reverse orientation
+- make_genome / write_2bit: a random genome with N runs and soft-masked
+  (lowercase) runs, written as a UCSC .2bit file
+- write_bed / write_macs: regions of that genome as a BED file and as a MACS
+  peaks file (.xls)
+- make_workload: all of the above in one directory, at a named scale
+"""
+import os
+import random
+import struct
+import numpy
+
+BASES = 'ACGT'
+CLONE_KINDS = ['perfect', 'mutations', 'insertion', 'deletion', 'truncation',
+               'reverse']
+_COMPLEMENT = dict(zip('ACGTN', 'TGCAN'))
+TWOBIT_SIGNATURE = 0x1A412743
+# .2bit base codes
+_TWOBIT_CODES = dict(zip('TCAG', range(4)))
+
+# (references, clones, reference length range, genome chromosomes, bases per
+#  chromosome, BED/MACS rows) for each scale
+SCALES = {'small': (5, 25, (300, 800), 3, 100000, 10000),
+          'medium': (20, 100, (300, 1500), 5, 1000000, 100000),
+          'large': (50, 400, (300, 2000), 10, 5000000, 1000000)}
+
+def random_dna(rng, length):
+    return ''.join(rng.choice(BASES) for i in xrange(length))
+
+def reverse_complement(seq):
+    return ''.join(_COMPLEMENT[base] for base in reversed(seq))
+
+def make_references(count, length_range=(300, 1500), seed=0):
+    """returns a list of (name, sequence) of random references"""
+    rng = random.Random(seed)
+    return [('ref%d' % i, random_dna(rng, rng.randint(*length_range)))
+            for i in xrange(count)]
+
+def mutate(rng, seq, kind):
+    """returns seq with one kind of change (see CLONE_KINDS)"""
+    if kind == 'perfect': return seq
+    if kind == 'mutations':
+        seq = list(seq)
+        for pos in rng.sample(xrange(len(seq)), rng.randint(1, 3)):
+            seq[pos] = rng.choice([base for base in BASES if base != seq[pos]])
+        return ''.join(seq)
+    if kind == 'insertion':
+        pos = rng.randrange(10, len(seq) - 10)
+        return seq[:pos] + random_dna(rng, rng.randint(1, 5)) + seq[pos:]
+    if kind == 'deletion':
+        pos = rng.randrange(10, len(seq) - 10)
+        return seq[:pos] + seq[pos + rng.randint(1, 5):]
+    if kind == 'truncation':
+        return seq[:rng.randrange(len(seq) // 2, len(seq) - 10)]
+    if kind == 'reverse':
+        return reverse_complement(seq)
+    raise ValueError('Unknown kind of clone %r' % kind)
+
+def make_clones(references, count, seed=0, flank=(0, 40)):
+    """
+    returns a list of (name, sequence, reference index, kind) of clones, each
+    a copy of a random reference with one kind of change (cycling through
+    CLONE_KINDS) and random flanking sequence (vector) on both sides
+    """
+    rng = random.Random(seed)
+    clones = []
+    for i in xrange(count):
+        ref_idx = rng.randrange(len(references))
+        kind = CLONE_KINDS[i % len(CLONE_KINDS)]
+        seq = mutate(rng, references[ref_idx][1], kind)
+        seq = random_dna(rng, rng.randint(*flank)) + seq + \
+              random_dna(rng, rng.randint(*flank))
+        clones.append(('clone%d_%s' % (i, kind), seq, ref_idx, kind))
+    return clones
+
+def write_fasta(filename, records, width=60):
+    """writes (name, sequence, ...) records to a FASTA file"""
+    fh = open(filename, 'w')
+    for record in records:
+        name, seq = record[0:2]
+        fh.write('>%s\n' % name)
+        for start in xrange(0, len(seq), width):
+            fh.write(seq[start:start + width] + '\n')
+    fh.close()
+
+def _random_runs(rng, length, count, max_run):
+    """returns sorted, non-overlapping (start, length) runs"""
+    runs = []
+    for start in sorted(rng.sample(xrange(0, length, max_run * 2), count)):
+        runs.append((start, rng.randint(1, max_run)))
+    return runs
+
+def make_genome(chroms=3, length=100000, seed=0):
+    """
+    returns a list of (chromosome name, sequence) of random chromosomes,
+    each with a few runs of N and of soft-masked (lowercase) bases
+    """
+    rng = random.Random(seed)
+    state = numpy.random.RandomState(seed)
+    letters = numpy.frombuffer(BASES, dtype=numpy.uint8)
+    genome = []
+    for i in xrange(chroms):
+        seq = letters[state.randint(0, 4, length)]
+        for start, run in _random_runs(rng, length, 5, 100):
+            seq[start:start + run] += ord('a') - ord('A')
+        for start, run in _random_runs(rng, length, 3, 50):
+            seq[start:start + run] = ord('N')
+        genome.append(('chr%d' % (i + 1), seq.tostring()))
+    return genome
+
+def _blocks(mask):
+    """returns (starts, lengths) of the runs of True in a boolean array"""
+    edges = numpy.diff(numpy.concatenate(([0], mask.view(numpy.int8), [0])))
+    starts = numpy.flatnonzero(edges == 1)
+    return starts, numpy.flatnonzero(edges == -1) - starts
+
+def _twobit_record(seq):
+    chars = numpy.frombuffer(seq, dtype=numpy.uint8)
+    n_starts, n_lengths = _blocks((chars == ord('N')) | (chars == ord('n')))
+    mask_starts, mask_lengths = _blocks(chars >= ord('a'))
+    table = numpy.zeros(256, dtype=numpy.uint8)
+    for base, code in _TWOBIT_CODES.items():
+        table[ord(base)] = table[ord(base.lower())] = code
+    codes = numpy.zeros((len(chars) + 3) // 4 * 4, dtype=numpy.uint8)
+    codes[:len(chars)] = table[chars]
+    quads = codes.reshape(-1, 4)
+    packed = (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | \
+             quads[:, 3]
+    uint32 = lambda values: numpy.asarray(values, dtype='<u4').tostring()
+    return ''.join([uint32([len(chars), len(n_starts)]), uint32(n_starts),
+                    uint32(n_lengths), uint32([len(mask_starts)]),
+                    uint32(mask_starts), uint32(mask_lengths), uint32([0]),
+                    packed.tostring()])
+
+def write_2bit(filename, genome):
+    """writes (chromosome name, sequence) records as a .2bit file"""
+    records = [_twobit_record(seq) for name, seq in genome]
+    offset = 16 + sum(1 + len(name) + 4 for name, seq in genome)
+    fh = open(filename, 'wb')
+    fh.write(struct.pack('<IIII', TWOBIT_SIGNATURE, 0, len(genome), 0))
+    for (name, seq), record in zip(genome, records):
+        fh.write(chr(len(name)) + name + struct.pack('<I', offset))
+        offset += len(record)
+    for record in records: fh.write(record)
+    fh.close()
+
+def _regions(genome, rows, seed, length_range):
+    """yields rows random (chrom, start, end), unsorted"""
+    rng = random.Random(seed)
+    for i in xrange(rows):
+        chrom, seq = genome[rng.randrange(len(genome))]
+        length = rng.randint(*length_range)
+        start = rng.randrange(0, len(seq) - length)
+        yield chrom, start, start + length
+
+def write_bed(filename, genome, rows, seed=0, length_range=(100, 1000)):
+    """writes rows random regions of genome as an unsorted BED file"""
+    rng = random.Random(seed + 1)
+    fh = open(filename, 'w')
+    fh.write('track name=benchmark\n')
+    for i, (chrom, start, end) in enumerate(_regions(genome, rows, seed,
+                                                     length_range)):
+        fh.write('%s\t%d\t%d\tregion%d\t%d\t%s\n' % (chrom, start, end, i,
+                 rng.randrange(0, 1000), rng.choice('+-')))
+    fh.close()
+
+def write_macs(filename, genome, rows, seed=0, length_range=(200, 2000)):
+    """writes rows random peaks of genome as a MACS peaks file (.xls)"""
+    rng = random.Random(seed + 1)
+    fh = open(filename, 'w')
+    fh.write('# This file is generated by benchmarks/generators.py\n')
+    fh.write('# tag size = 36\n\n')
+    fh.write('chr\tstart\tend\tlength\tsummit\ttags\t-10*log10(pvalue)\t'
+             'fold_enrichment\tFDR(%)\n')
+    for chrom, start, end in _regions(genome, rows, seed, length_range):
+        fh.write('%s\t%d\t%d\t%d\t%d\t%d\t%.2f\t%.2f\t%.2f\n' % (chrom,
+                 start + 1, end, end - start, rng.randrange(end - start),
+                 rng.randint(5, 500), rng.uniform(50, 3000),
+                 rng.uniform(2, 60), rng.uniform(0, 20)))
+    fh.close()
+
+def make_workload(directory, scale='small', seed=0):
+    """
+    writes the workload for a scale (see SCALES) to directory:
+    references.fa, clones.fa, genome.2bit, regions.bed and peaks.xls
+
+    returns a dict of their paths and of the numbers of references, clones,
+    clone/reference pairs and BED/MACS rows
+    """
+    num_refs, num_clones, length_range, chroms, chrom_length, rows = \
+        SCALES[scale]
+    references = make_references(num_refs, length_range, seed)
+    clones = make_clones(references, num_clones, seed + 1)
+    genome = make_genome(chroms, chrom_length, seed + 2)
+    workload = dict((name, os.path.join(directory, filename)) for
+                    name, filename in (('references', 'references.fa'),
+                                       ('clones', 'clones.fa'),
+                                       ('genome', 'genome.2bit'),
+                                       ('bed', 'regions.bed'),
+                                       ('macs', 'peaks.xls')))
+    write_fasta(workload['references'], references)
+    write_fasta(workload['clones'], clones)
+    write_2bit(workload['genome'], genome)
+    write_bed(workload['bed'], genome, rows, seed + 3)
+    write_macs(workload['macs'], genome, rows, seed + 4)
+    workload.update({'num_references': num_refs, 'num_clones': num_clones,
+                     'num_pairs': num_refs * num_clones, 'num_rows': rows,
+                     'clone_sources': [(ref_idx, kind) for
+                                       name, seq, ref_idx, kind in clones]})
+    return workload
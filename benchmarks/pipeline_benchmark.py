@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Benchmarks each stage of checkmyclones, and the whole pipeline, on synthetic data
+
+The workloads are made by benchmarks/generators.py from a fixed seed, so every
+run measures the same inputs. The stages are:
+
+  load      load_seq_files on the clones and references (sequences/s)
+  align     align_clone_to_ref of each clone to its own reference (pairs/s)
+  bed       read_bed_file of the BED regions from the .2bit genome (rows/s)
+  tabfile   reading every row of the BED and MACS files with TabFile (rows/s)
+  pipeline  main() of scripts/checkmyclones.py on the clones and references
+            (clone/reference pairs/s)
+
+Each measurement runs in a fresh process (--repeat times, keeping the fastest)
+and reports wall time, throughput and peak RSS (of that process and its
+worker processes). Imports are not timed. With --save-baseline the
+results are written to a JSON file; with --baseline they are compared to one,
+and the exit status is 1 if any measurement is more than --tolerance slower.
+
+usage: python benchmarks/pipeline_benchmark.py [--scales small medium]
+           [--stages load align ...] [--baseline old.json]
+           [--save-baseline new.json]
+"""
+import argparse
+import imp
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from generators import make_workload, SCALES
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                      'scripts', 'checkmyclones.py')
+STAGES = ['load', 'align', 'bed', 'tabfile', 'pipeline']
+UNITS = {'load': 'seqs', 'align': 'pairs', 'bed': 'rows', 'tabfile': 'rows',
+         'pipeline': 'pairs'}
+
+def load_stage(workload, options):
+    from clonechecker.filetools import load_seq_files
+    seqs, stats = load_seq_files([workload['clones'], workload['references']],
+                                 processes=options.processes, packed=True)
+    return len(seqs)
+
+def align_stage(workload, options):
+    from clonechecker.filetools import load_seq_files
+    from clonechecker.align import align_clone_to_ref, AlignmentError
+    from clonechecker.quality import reverse_complement
+    clones = load_seq_files([workload['clones']], packed=True)[0]
+    references = load_seq_files([workload['references']], packed=True)[0]
+    for clone, (ref_idx, kind) in zip(clones, workload['clone_sources']):
+        if kind == 'reverse': clone = reverse_complement(clone)
+        try:
+            align_clone_to_ref(clone, references[ref_idx],
+                               aligner=options.aligner)
+        except AlignmentError: pass
+    return len(clones)
+
+def bed_stage(workload, options):
+    from clonechecker.filetools import read_bed_file
+    return len(read_bed_file(workload['bed'], genome=workload['genome'],
+                             write_fasta=False, packed=True))
+
+def tabfile_stage(workload, options):
+    from clonechecker.TabFile import BedFile, MacsFile
+    rows = 0
+    for tab_file in (BedFile(workload['bed']), MacsFile(workload['macs'])):
+        for row in tab_file: rows += 1
+    return rows
+
+def pipeline_stage(workload, options):
+    script = imp.load_source('checkmyclones', SCRIPT)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    sys.argv = [SCRIPT, '--clones', workload['clones'], '--references',
+                workload['references'], '--aligner', options.aligner,
+                '--num-cpus', str(options.processes)]
+    script.main()
+    sys.stdout.flush()
+    return workload['num_pairs']
+
+STAGE_FUNCTIONS = {'load': load_stage, 'align': align_stage,
+                   'bed': bed_stage, 'tabfile': tabfile_stage,
+                   'pipeline': pipeline_stage}
+
+def _run(queue, stage, workload, options):
+    # import time is measured by startup_benchmark.py, not here
+    import clonechecker.align, clonechecker.filetools, clonechecker.TabFile
+    start = time.time()
+    try:
+        count = STAGE_FUNCTIONS[stage](workload, options)
+    except Exception:
+        queue.put(traceback.format_exc())
+        return
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    queue.put((elapsed, count, peak_rss))
+
+def measure(stage, workload, options):
+    """
+    runs a stage in a new process, returns (seconds, items processed,
+    peak RSS in kb)
+    """
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_run,
+                                args=(queue, stage, workload, options))
+    p.start()
+    result = queue.get()
+    p.join()
+    if isinstance(result, str):
+        raise RuntimeError('The %s stage failed:\n%s' % (stage, result))
+    return result
+
+def compare(key, result, baseline, tolerance):
+    """
+    returns a note comparing result to baseline[key], and whether it is a
+    regression (more than tolerance slower)
+    """
+    if baseline is None or key not in baseline: return '', False
+    ratio = result['seconds'] / baseline[key]['seconds']
+    regression = ratio > 1 + tolerance
+    note = '  %5.2fx baseline time' % ratio
+    if regression: note += '  REGRESSION'
+    return note, regression
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--scales', nargs='+', choices=sorted(SCALES),
+                        default=['small', 'medium'])
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='run each measurement this many times and keep the fastest')
+    parser.add_argument('--aligner', choices=['cogent', 'numpy'],
+                        default='numpy')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='worker processes for the load and pipeline stages')
+    parser.add_argument('--baseline',
+                        help='JSON file of earlier results to compare to')
+    parser.add_argument('--save-baseline',
+                        help='write the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction slower than the baseline that counts as a regression')
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline is not None:
+        baseline = json.load(open(args.baseline))
+        settings = baseline.pop('settings', {})
+        for name in ('seed', 'aligner', 'processes'):
+            if name in settings and settings[name] != getattr(args, name):
+                print 'WARNING: the baseline was run with --%s %s' % (
+                        name, settings[name])
+    results = {}
+    regressions = 0
+    for scale in args.scales:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            workload = make_workload(tmpdir, scale, args.seed)
+            print '%s: %d references, %d clones, %d BED/MACS rows' % (scale,
+                workload['num_references'], workload['num_clones'],
+                workload['num_rows'])
+            for stage in args.stages:
+                elapsed, count, peak_rss = min(measure(stage, workload, args)
+                                               for i in xrange(args.repeat))
+                key = '%s/%s' % (stage, scale)
+                results[key] = {'seconds': elapsed, 'count': count,
+                                'rate': count / elapsed,
+                                'peak_rss_mb': peak_rss / 1024.0}
+                note, regression = compare(key, results[key], baseline,
+                                           args.tolerance)
+                regressions += regression
+                print '  %-9s %8.2f s %10.0f %s/s  peak RSS %7.1f MB%s' % (
+                        stage, elapsed, count / elapsed, UNITS[stage],
+                        peak_rss / 1024.0, note)
+        finally:
+            shutil.rmtree(tmpdir)
+    if args.save_baseline is not None:
+        results['settings'] = {'seed': args.seed, 'aligner': args.aligner,
+                               'processes': args.processes}
+        fh = open(args.save_baseline, 'w')
+        json.dump(results, fh, indent=1, sort_keys=True)
+        fh.close()
+    if regressions > 0:
+        print '%d measurements are more than %d%% slower than the baseline' % (
+                regressions, args.tolerance * 100)
+        sys.exit(1)
+
+if __name__ == '__main__': main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Compares TabFile.mergesort (out of core) with sorting the whole file in memory
+
+Each sort runs in a fresh process, so the peak RSS that is reported belongs to
+that sort alone.
+
+usage: python benchmarks/sort_benchmark.py [--rows 2000000] [--memory 64]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+from clonechecker.TabFile import BedFile
+
+def make_bed(filename, rows, seed=0):
+    """writes a random, unsorted BED file with a track line"""
+    rng = random.Random(seed)
+    fh = open(filename, 'w')
+    fh.write('track name=benchmark\n')
+    for i in xrange(rows):
+        start = rng.randrange(0, 250000000)
+        fh.write('chr%d\t%d\t%d\tpeak%d\t%d\t+\n' % (rng.randrange(1, 23),
+                 start, start + rng.randrange(50, 2000), i,
+                 rng.randrange(0, 1000)))
+    fh.close()
+
+def in_memory_sort(filename, output_filename):
+    bf = BedFile(filename, streaming=True)
+    lines = [line for line in bf.__rawiter__() if
+             not bf._is_comment(bf.previous_line(), line)]
+    lines.sort(key=lambda line: (line.split('\t', 1)[0],
+                                 float(line.split('\t', 2)[1])))
+    fh = open(output_filename, 'w')
+    fh.writelines(bf.comment_line_contents())
+    fh.writelines(lines)
+    fh.close()
+
+def external_sort(filename, output_filename, memory):
+    bf = BedFile(filename, streaming=True)
+    bf.mergesort(output_filename, [0, 1], [False, True], memory=memory)
+
+def _run(queue, method, args):
+    start = time.time()
+    method(*args)
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+def measure(method, *args):
+    """runs method(*args) in a new process, returns (seconds, peak RSS in kb)"""
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_run, args=(queue, method, args))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--memory', type=int, default=64,
+                        help='memory budget for mergesort in MB')
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bed = os.path.join(tmpdir, 'unsorted.bed')
+        make_bed(bed, args.rows)
+        size = os.path.getsize(bed)
+        print 'Sorting %d rows (%.1f MB) by chrom, start' % (args.rows,
+                                                            size / 1e6)
+        results = {}
+        for name, method, extra in (
+                ('in memory', in_memory_sort, ()),
+                ('mergesort', external_sort, (args.memory * 1024 * 1024,))):
+            output = os.path.join(tmpdir, name.replace(' ', '_') + '.bed')
+            elapsed, peak_rss = measure(method, bed, output, *extra)
+            results[name] = output
+            print '%-10s %7.2f s %10.0f rows/s %7.1f MB/s  peak RSS %7.1f MB' % \
+                (name, elapsed, args.rows / elapsed, size / 1e6 / elapsed,
+                 peak_rss / 1024.0)
+        same = open(results['in memory']).read() == \
+               open(results['mergesort']).read()
+        print 'Outputs match' if same else 'OUTPUTS DIFFER'
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__': main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Measures the cold-start time of checkmyclones.py
+
+Each run is a fresh interpreter, so nothing is shared between runs except the
+operating system's file cache. Two commands are timed: --help, which should
+not import cogent or numpy, and a run with one clone and one reference, which
+is mostly import and startup cost. The heavy modules that --help imports are
+also listed.
+
+usage: python benchmarks/startup_benchmark.py [--repeat 5] [--help-budget 500]
+                                              [--run-budget 2000]
+exits with status 1 if the median time of a command is over its budget (ms)
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                      'scripts', 'checkmyclones.py')
+# modules that --help should not need
+HEAVY_MODULES = ['cogent', 'numpy', 'clonechecker.align',
+                 'clonechecker.filetools']
+REFERENCE = 'GATTACAGATTACACCGGTTAACCGGTTAAGCTAGCTAGCTTTAAACCCGGGTTTAAACCC'
+
+def write_fasta(filename, name, seq):
+    fh = open(filename, 'w')
+    fh.write('>%s\n%s\n' % (name, seq))
+    fh.close()
+
+def time_command(args, repeat):
+    """runs args repeat times, returns the wall-clock times in ms"""
+    times = []
+    devnull = open(os.devnull, 'w')
+    for i in xrange(repeat):
+        start = time.time()
+        subprocess.check_call(args, stdout=devnull, stderr=devnull)
+        times.append((time.time() - start) * 1000)
+    devnull.close()
+    return times
+
+def imported_modules(args):
+    """returns the HEAVY_MODULES that running the script with args imports"""
+    code = ('import sys, runpy\n'
+            'sys.argv = %r\n'
+            'try: runpy.run_path(sys.argv[0], run_name="__main__")\n'
+            'except SystemExit: pass\n'
+            'sys.stderr.write(" ".join(m for m in %r if m in sys.modules))\n'
+            % ([SCRIPT] + args, HEAVY_MODULES))
+    p = subprocess.Popen([sys.executable, '-c', code],
+                         stdout=open(os.devnull, 'w'), stderr=subprocess.PIPE)
+    err = p.communicate()[1].strip().split('\n')
+    return err[-1].split() if err else []
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1: return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--help-budget', type=float,
+                        help='maximum median time for --help in ms')
+    parser.add_argument('--run-budget', type=float,
+                        help='maximum median time for a one clone, one reference run in ms')
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        clone = os.path.join(tmpdir, 'clone.fa')
+        ref = os.path.join(tmpdir, 'ref.fa')
+        write_fasta(clone, 'clone', 'TT' + REFERENCE + 'AA')
+        write_fasta(ref, 'ref', REFERENCE)
+        commands = (
+            ('--help', ['--help'], args.help_budget),
+            ('one pair', ['--clones', clone, '--references', ref],
+             args.run_budget))
+        # warm the file cache (and compile .pyc files) before timing
+        time_command([sys.executable, SCRIPT] + commands[1][1], 1)
+        over_budget = False
+        for name, script_args, budget in commands:
+            times = time_command([sys.executable, SCRIPT] + script_args,
+                                 args.repeat)
+            line = '%-9s min %7.1f ms  median %7.1f ms' % (name, min(times),
+                                                          median(times))
+            if budget is not None:
+                if median(times) > budget:
+                    over_budget = True
+                    line += '  OVER BUDGET (%.0f ms)' % budget
+                else:
+                    line += '  within budget (%.0f ms)' % budget
+            print line
+        heavy = imported_modules(['--help'])
+        if heavy: print '--help imports %s' % ', '.join(heavy)
+        else: print '--help imports none of %s' % ', '.join(HEAVY_MODULES)
+    finally:
+        shutil.rmtree(tmpdir)
+    if over_budget: sys.exit(1)
+
+if __name__ == '__main__': main()
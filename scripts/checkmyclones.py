@@ -1,58 +1,71 @@
 #!/usr/bin/env python
-from glob import glob
-import os.path
-import cogent
-from cogent import LoadSeqs, DNA
-import argparse
-from twobitreader import TwoBitFile
-import scripter
-from scripter import Usage, get_logger, debug
-from pkg_resources import get_distribution
-import platform
+# only what the argument parser needs is imported at startup, so that --help
+# and --version are quick. cogent, numpy and the rest of clonechecker are
+# imported by the functions that use them
+import os
+import sys
+import time
 import signal
 from logging import WARNING
-from pprint import pprint
 from itertools import groupby
-import multiprocessing
-from clonechecker.align import align_clone_to_ref, AlignmentError
-from clonechecker.filetools import load_seqs, read_bed_file, find_2bit_file
-from operator import itemgetter, attrgetter
+from operator import attrgetter
+import scripter
+from scripter import Usage, get_logger, debug, info
+from clonechecker import __version__
+from clonechecker.defaults import ALIGNERS, DEFAULT_ALIGNER, \
+                                  DEFAULT_MAX_SIZE, DEFAULT_TRIM_CUTOFF, \
+                                  DEFAULT_MASK_QUALITY
+from clonechecker.kmers import DEFAULT_K, DEFAULT_MIN_SEED_HITS
 try:
-    from cPickle import dumps, loads
+    from cPickle import dumps, loads, HIGHEST_PROTOCOL
 except ImportError:
-    from pickle import dumps, loads
-__version__ = get_distribution('checkmyclones').version
+    from pickle import dumps, loads, HIGHEST_PROTOCOL
 VERSION = __version__
 
-def load_all_seqs(glob_path, moltype=DNA, recursive=True):
+def load_all_seqs(glob_path, moltype=None, recursive=True, processes=None):
     """
-    loads all available sequences that match a path
+    loads all available sequences that match a path (or list of paths)
     wildcards are allowed
     all sequences are assumed to be DNA
     
     if the path is a directory, then we will search recursively
+    files are read by processes worker processes (see load_seq_files)
+    sequences are loaded as PackedSequences, which are converted to cogent
+    Sequences only for output (in alignments)
     """
-    seqs = []
-    if type(glob_path) is list:
-        for p in glob_path:
-            seqs.extend(load_all_seqs(p, moltype=DNA, recursive=True))
-        return seqs
-    for foo in glob(glob_path):
-        print 'Trying to import sequences from %s' % foo
-        if os.path.isfile(foo):
-            try:
-                myseqs = load_seqs(foo, moltype=moltype)
-            except:
-                print 'ERROR: Loading %s failed' % foo
-                continue
-            for seq in myseqs:
-                seq.Name = '%s (%s)' % (seq.Name, foo)
-            seqs.extend(myseqs)
-        elif recursive and os.path.isdir(foo):
-            for boo in glob(os.path.join(foo,'*')):
-                seqs.extend(load_all_seqs(boo, moltype=moltype, recursive=True))
+    from clonechecker.filetools import load_seq_files
+    if moltype is None:
+        from cogent import DNA
+        moltype = DNA
+    seqs, stats = load_seq_files(glob_path, moltype=moltype,
+                                 recursive=recursive, processes=processes,
+                                 packed=True)
+    for foo in stats.failed:
+        print 'ERROR: Loading %s failed' % foo
+    print 'Loaded %d sequences from %s' % (len(seqs), stats)
     return seqs
 
+def trim_clones(clones, cutoff=DEFAULT_TRIM_CUTOFF):
+    """
+    trims the low-quality ends of clones that have base qualities (see
+    clonechecker.quality.trim_seqs) and reports how many bases were trimmed
+    """
+    from clonechecker.quality import trim_seqs
+    clones, trims = trim_seqs(clones, cutoff)
+    total_start = total_end = 0
+    for name, start, end, length in trims:
+        if length == 0:
+            print 'Discarded %s: no bases pass the quality cutoff' % name
+        else:
+            debug('Trimmed %d bases from the start and %d from the end of %s',
+                  start, end, name)
+        total_start += start
+        total_end += end
+    if len(trims) > 0:
+        print 'Trimmed %d low-quality bases from %d clones (%d from the starts, %d from the ends)' % (
+                total_start + total_end, len(trims), total_start, total_end)
+    return clones
+
 def real_name(name):
     """
     strip coordinates from a name so that we can compare to original 
@@ -90,76 +103,368 @@ help='Location of "gdbdb" or 2bit files. If gbdb is not in /gbdb or C:\gbdb, spe
                         help='Use the regions listed in the bed file as reference sequences')
     parser.add_argument('--only-use-references', nargs='*',
                         help='Use the only regions with the following names')
+    parser.add_argument('--only-overlapping',
+                        help='Use only the --bed-reference regions that overlap a region in this BED file')
+    parser.add_argument('--kmer-size', type=int, default=DEFAULT_K,
+                        help='Length of the k-mer seeds used to pick which references to align to each clone')
+    parser.add_argument('--min-seed-hits', type=int,
+                        default=DEFAULT_MIN_SEED_HITS,
+                        help='Only align a clone to references that share at least this many k-mer seeds with it (0 aligns every pair)')
+    parser.add_argument('--aligner', choices=ALIGNERS, default=DEFAULT_ALIGNER,
+                        help='Smith-Waterman implementation to use (numpy is much faster than cogent and gives the same alignments)')
+    parser.add_argument('--band', type=int,
+                        help='Only align within this many bases of the diagonal suggested by the k-mer seeds (requires --aligner numpy)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Report each clone as soon as all of its alignments are done, instead of grouping matches by reference at the end')
+    parser.add_argument('--cache-dir',
+                        help='Keep alignment results (and the regions fetched for --bed-reference) in this directory and reuse them in later runs')
+    parser.add_argument('--cache-size', type=int,
+                        default=DEFAULT_MAX_SIZE / (1024 * 1024),
+                        help='Maximum size of the alignment cache in MB (least recently used results are removed first)')
+    parser.add_argument('--best-hit', action='store_true',
+                        help='Only report the best-scoring alignments of each clone, and skip the references whose upper bound on the score (from their length, base composition and shared k-mer seeds) shows that they cannot match or beat it')
+    parser.add_argument('--no-exact', action='store_true',
+                        help='Align every clone, even if it contains an exact copy of a reference')
+    parser.add_argument('--trim-cutoff', type=float,
+                        default=DEFAULT_TRIM_CUTOFF,
+                        help='Trim the low-quality ends of clones with base qualities (FASTQ, or a .qual file next to the sequence) with Mott\'s algorithm, keeping bases better than this error probability')
+    parser.add_argument('--no-trim', action='store_true',
+                        help='Do not trim the ends of clones with base qualities')
+    parser.add_argument('--mask-quality', type=int,
+                        default=DEFAULT_MASK_QUALITY,
+                        help='Ignore mismatches at clone bases with a Phred quality below this (0 counts every mismatch)')
+    parser.add_argument('--vcf',
+                        help='Write the SNVs and indels of clones that align to a whole reference to this VCF file')
+    parser.add_argument('--variants-tsv',
+                        help='Write a tab-delimited summary of the variants in each clone that aligns to a whole reference to this file')
+    parser.add_argument('--stats-json',
+                        help='Write the time spent in each stage, the time taken by each kind of task, the bytes sent to and from workers and worker utilization to this JSON file')
+    parser.add_argument('--profile',
+                        help='Profile the run with cProfile and write one profile for the main process (main.prof) and each worker (worker-PID.prof) to this directory')
     parser.set_defaults(**{'genome': 'hg19', 'logging_level': WARNING})
     args = parser.parse_args()
     context = vars(args)
+    # scripter's --num-cpus has no type, so a number given on the command line
+    # arrives as a string, and -p without a number gives None (one worker per
+    # CPU, as multiprocessing.Pool does for processes=None)
+    if context['num_cpus'] is not None:
+        context['num_cpus'] = int(context['num_cpus'])
+    if context['band'] is not None and context['aligner'] != 'numpy':
+        raise Usage('--band requires --aligner numpy')
     scripter.LOGGER.setLevel(context['logging_level'])
-    clones = load_all_seqs(context['clones'], recursive=context['recursive'])
+    from clonechecker.stats import RunStats, profile_path
+    stats = RunStats(num_workers=context['num_cpus'])
+    if context['profile'] is not None:
+        import cProfile
+        if not os.path.isdir(context['profile']): os.makedirs(context['profile'])
+        profiler = cProfile.Profile()
+        profiler.runcall(check_clones, context, stats)
+        profiler.dump_stats(profile_path(context['profile'], 'main'))
+    else:
+        check_clones(context, stats)
+    if context['stats_json'] is not None:
+        stats.write_json(context['stats_json'], version=VERSION,
+                         arguments=sys.argv[1:])
+    return
+
+def check_clones(context, stats):
+    """
+    loads the clones and references and checks every clone against the
+    references, with the options in context (see main)
+
+    the time spent in each stage, and the time, result size and worker of
+    each task, are recorded in stats (a clonechecker.stats.RunStats)
+    """
+    with stats.stage('import modules'):
+        import multiprocessing
+        from clonechecker.cache import AlignmentCache
+        from clonechecker.exact import ExactMatcher
+        from clonechecker.filetools import read_bed_file, find_2bit_file
+        from clonechecker.intervals import IntervalIndex
+        from clonechecker.kmers import KmerIndex
+        from clonechecker.variants import VcfWriter, VariantSummary
+    with stats.stage('load clones'):
+        clones = load_all_seqs(context['clones'],
+                               recursive=context['recursive'],
+                               processes=context['num_cpus'])
+    if not context['no_trim']:
+        with stats.stage('trim clones'):
+            clones = trim_clones(clones, context['trim_cutoff'])
     ref_seqs = []
     if len(clones) == 0:
         raise Usage('Could not find any clone sequences')
     if context['references'] is None and context['bed_reference'] is None:
         raise Usage('No reference sequences specified')
     else:
+        specified_references = context['only_use_references']
+        if specified_references is not None:
+            select = lambda name: real_name(name) in specified_references
+        else:
+            select = None
         if context['bed_reference'] is not None:
             genome = find_2bit_file(context['genome'], context['path_to_gbdb'])
             print 'Fetching sequences from %s using %s' % (context['bed_reference'],
                                                            genome)
-            ref_seqs.extend(read_bed_file(context['bed_reference'],
-                                          genome=genome))
+            with stats.stage('fetch BED references'):
+                if context['only_overlapping'] is not None:
+                    overlapping = IntervalIndex.for_file(
+                                                context['only_overlapping'])
+                else:
+                    overlapping = None
+                ref_seqs.extend(read_bed_file(context['bed_reference'],
+                                              genome=genome,
+                                              cache_dir=context['cache_dir'],
+                                              select=select,
+                                              overlapping=overlapping,
+                                              packed=True))
         if context['references'] is not None:
-            ref_seqs.extend(load_all_seqs(context['references'],
-                                          recursive=context['recursive']))
-        specified_references = context['only_use_references']
+            with stats.stage('load references'):
+                ref_seqs.extend(load_all_seqs(context['references'],
+                                              recursive=context['recursive'],
+                                              processes=context['num_cpus']))
         if specified_references is not None:
             good_name = lambda ref: real_name(ref.Name) in specified_references
             ref_seqs = filter(good_name, ref_seqs)
         if len(ref_seqs) == 0:
             raise Usage('Could not find any reference sequences')
-    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
-    debug('multiprocessing enabled')
-    p = multiprocessing.Pool(processes=context['num_cpus'])
-    debug('Initialized pool of %d workers', context['num_cpus'])
-    results = []
+    if context['cache_dir'] is not None:
+        cache = AlignmentCache(context['cache_dir'],
+                               max_size=context['cache_size'] * 1024 * 1024)
+    else:
+        cache = None
+    # the pool's wall time, for worker utilization, includes starting it
+    pool_start = time.time()
+    with stats.stage('start workers'):
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        debug('multiprocessing enabled')
+        p = multiprocessing.Pool(processes=context['num_cpus'],
+                                 initializer=init_worker,
+                                 initargs=(clones, ref_seqs, context))
+        debug('Initialized pool of %d workers',
+              context['num_cpus'] or multiprocessing.cpu_count())
     forward = not context['reverse_orientation']
     rc = context['reverse_orientation'] or context['both_orientations'] or False
     for ref in ref_seqs:
         print 'Loaded reference %s' % ref.Name
-    for clone in clones:
-        p.apply_async(announce_first, (clone,), context)
-        for ref in ref_seqs:
-            if forward:
-                r = p.apply_async(compare_clone_to_ref,
-                                  (clone, ref), context)
-                results.append(r)
-            if rc:
-                r = p.apply_async(compare_clone_to_ref,
-                                  (clone.rc(), ref), context)
-                results.append(r)
-    p.close()
-    p.join()
-    result_values = []
-    for r in results:
-        current_pickle = r.get()
-        current_result = loads(current_pickle)
-        if current_result is None: continue
-        else: result_values.append(current_result)
-    all_matches = []
-    for clone_name, group in groupby(result_values, key=itemgetter(0)):
-        alns = map(itemgetter(1), list(group))
-        is_matched = lambda aln: not aln.is_truncated and not aln.has_gaps
-        matches = filter(is_matched, alns)
-        if len(matches) > 0:
-            all_matches.extend(alns)
-            continue
-        elif len(alns) == 0:
-            print 'No match for %s' % clone_name
-            continue
+    min_seed_hits = context['min_seed_hits']
+    with stats.stage('index references'):
+        if min_seed_hits > 0:
+            kmer_index = KmerIndex(ref_seqs, k=context['kmer_size'])
+            debug('Indexed %d references with k=%d', len(kmer_index),
+                  context['kmer_size'])
+            for ref_idx in kmer_index.unseedable(min_seed_hits):
+                info('%s has fewer than %d %d-mers, so it bypasses the k-mer prefilter and is aligned to every clone',
+                     ref_seqs[ref_idx].Name, min_seed_hits,
+                     context['kmer_size'])
         else:
-            print_good_alns(alns)
-    print_matched_alns(all_matches)
+            kmer_index = None
+        if not context['no_exact']: exact_matcher = ExactMatcher(ref_seqs)
+        else: exact_matcher = None
+    pending = {}
+    orientation_votes = {}
+    counts = {'pairs': 0, 'pruned': 0, 'cached': 0, 'cached_new': 0,
+              'exact': 0, 'skipped': 0}
+    tasks = plan_tasks(clones, ref_seqs, pending, counts, forward=forward,
+                       rc=rc, kmer_index=kmer_index,
+                       min_seed_hits=min_seed_hits,
+                       exact_matcher=exact_matcher,
+                       orientation_votes=orientation_votes,
+                       best_hit=context['best_hit'])
+    # results arrive in whatever order the workers finish them. each clone's
+    # alignments are held only until all of its tasks are done
+    clone_alns = {}
+    if context['stream']: all_matches = None
+    else: all_matches = []
+    variant_writers = []
+    if context['vcf'] is not None:
+        variant_writers.append(VcfWriter(context['vcf']))
+    if context['variants_tsv'] is not None:
+        variant_writers.append(VariantSummary(context['variants_tsv']))
+    results = p.imap_unordered(run_task, tasks)
+    while True:
+        with stats.stage('wait for workers'):
+            result = next(results, None)
+        if result is None: break
+        clone_idx, pickles, num_cached, cache_entries, num_skipped, timing = \
+            result
+        stats.add_task(*timing)
+        counts['cached'] += num_cached
+        counts['skipped'] += num_skipped
+        for key, record in cache_entries:
+            counts['cached_new'] += 1
+            with stats.stage('cache results'):
+                cache[key] = record
+        alns = clone_alns.setdefault(clone_idx, [])
+        for current_pickle in pickles:
+            with stats.stage('unpickle results'):
+                alns.append(loads(current_pickle)[1])
+        pending[clone_idx] -= 1
+        if pending[clone_idx] == 0:
+            del pending[clone_idx]
+            del clone_alns[clone_idx]
+            with stats.stage('report clones'):
+                if clone_idx in orientation_votes:
+                    print_orientation(clones[clone_idx].Name,
+                                      *orientation_votes.pop(clone_idx))
+                report_clone(clones[clone_idx].Name, alns, all_matches,
+                             variant_writers)
+    with stats.stage('stop workers'):
+        p.close()
+        p.join()
+    stats.pool_seconds = time.time() - pool_start
+    with stats.stage('report clones'):
+        for writer in variant_writers: writer.close()
+    if exact_matcher is not None:
+        print 'Matched %d clone/reference pairs exactly without alignment' % (
+                counts['exact'])
+    if min_seed_hits > 0:
+        print 'Pruned %d of %d clone/reference pairs with fewer than %d shared %d-mers' % (
+                counts['pruned'], counts['pairs'], min_seed_hits,
+                context['kmer_size'])
+    if context['best_hit']:
+        print 'Skipped %d clone/reference pairs that could not beat the best hit' % (
+                counts['skipped'])
+    if cache is not None:
+        print 'Reused %d cached alignments and cached %d new ones' % (
+                counts['cached'], counts['cached_new'])
+        with stats.stage('evict cache'):
+            num_evicted = cache.evict()
+        if num_evicted > 0:
+            debug('Removed %d old alignments from the cache', num_evicted)
+    if all_matches is not None:
+        with stats.stage('report matches'):
+            print_matched_alns(all_matches)
+    stats.counts.update(counts)
     return
 
+def plan_tasks(clones, ref_seqs, pending, counts, forward=True, rc=False,
+               kmer_index=None, min_seed_hits=0, exact_matcher=None,
+               orientation_votes=None, best_hit=False):
+    """
+    yields the tasks for run_task, (clone_idx, reverse, ref_idx, diagonal,
+    exact_pos): for each clone, one announcement task followed by one task
+    for each clone/reference pair worth aligning
+    (all pairs, or only those with at least min_seed_hits seeds in kmer_index)
+
+    if exact_matcher finds references that occur exactly in a clone, the
+    clone gets one task for each of those references (with the position in
+    exact_pos) instead of aligning it to them. It is still aligned to the
+    other references, and to the same references on the other strand
+
+    if both orientations are wanted and there is a kmer_index, the strand to
+    align to each reference is chosen with KmerIndex.oriented_candidates, and
+    the candidates and confidence are saved in orientation_votes[clone_idx]
+
+    if best_hit is True, the pairs of a clone are not given one task each:
+    the clone gets a single task whose ref_idx is the list of its candidates,
+    (reverse, ref_idx, diagonal, hits, exact_pos), for best_hit_task. exact
+    matches are among those candidates, so that they compete with the rest
+
+    pending[clone_idx] is set to the number of tasks for that clone before
+    the first of them is yielded, so it is complete by the time any result
+    for that clone comes back. counts['pairs'], counts['pruned'] and
+    counts['exact'] (the number of exactly matched pairs) are incremented as
+    we go
+    """
+    for clone_idx, clone in enumerate(clones):
+        clone_tasks = [(clone_idx, None, None, None, None)]
+        orientations = []
+        if forward: orientations.append((False, clone))
+        if rc: orientations.append((True, clone.rc()))
+        exact = {}
+        if exact_matcher is not None:
+            for reverse, query in orientations:
+                for ref_idx, pos in exact_matcher.find(query).iteritems():
+                    exact[(reverse, ref_idx)] = pos
+            counts['exact'] += len(exact)
+        candidates = []
+        if len(orientations) == 2 and kmer_index is not None:
+            # vote on the strand for each reference instead of aligning both
+            counts['pairs'] += 2 * len(ref_seqs)
+            oriented, confidence = kmer_index.oriented_candidates(
+                                                    clone, min_seed_hits)
+            counts['pruned'] += 2 * len(ref_seqs) - len(oriented)
+            if orientation_votes is not None:
+                orientation_votes[clone_idx] = (oriented, confidence)
+            for ref_idx, reverse, hits, diagonal in oriented:
+                candidates.append((reverse, ref_idx, diagonal, hits))
+            orientations = []
+        for reverse, query in orientations:
+            counts['pairs'] += len(ref_seqs)
+            if kmer_index is not None:
+                hits = kmer_index.candidates(query, min_seed_hits)
+                counts['pruned'] += len(ref_seqs) - len(hits)
+                for ref_idx, num_hits, diagonal in hits:
+                    candidates.append((reverse, ref_idx, diagonal, num_hits))
+            else:
+                for ref_idx in xrange(len(ref_seqs)):
+                    candidates.append((reverse, ref_idx, None, None))
+        # exactly matched pairs take the place of their candidate (if the
+        # pair is one), so that the order is the same as without exact_matcher
+        candidates = [candidate + (exact.pop(candidate[0:2], None),) for
+                      candidate in candidates]
+        candidates.extend((reverse, ref_idx, None, None, pos) for
+                          (reverse, ref_idx), pos in sorted(exact.items()))
+        if best_hit and len(candidates) > 0:
+            clone_tasks.append((clone_idx, None, candidates, None, None))
+        else:
+            for reverse, ref_idx, diagonal, hits, pos in candidates:
+                if pos is not None: diagonal = None
+                clone_tasks.append((clone_idx, reverse, ref_idx, diagonal,
+                                    pos))
+        pending[clone_idx] = len(clone_tasks)
+        for task in clone_tasks: yield task
+
+def print_orientation(clone_name, candidates, confidence):
+    """
+    prints the orientation chosen for a clone by KmerIndex.oriented_candidates
+    and how confident the vote was
+    """
+    if confidence is None: return
+    strands = set(reverse for ref_idx, reverse, hits, diagonal in candidates)
+    if strands == set([False]): orientation = 'forward'
+    elif strands == set([True]): orientation = 'reverse'
+    else: orientation = 'ambiguous (aligned both)'
+    print 'Orientation of %s: %s, confidence %.2f' % (clone_name, orientation,
+                                                      confidence)
+
+def report_clone(clone_name, alns, all_matches=None, variant_writers=()):
+    """
+    prints the verdict for one clone once all of its alignments are done
+
+    clones that matched a reference are printed right away with
+    print_matched_alns, or, if all_matches is a list, added to it so that
+    they can be printed together, grouped by reference, at the end of the run.
+    the variants (SNVs and indels) in each alignment that covers its whole
+    reference, gapped or not, are written to each of variant_writers
+    (see clonechecker.variants) right away
+    """
+    for aln in alns:
+        if aln.is_truncated: continue
+        variants = alignment_variants(aln)
+        for writer in variant_writers:
+            writer.write_alignment(aln, variants)
+    is_matched = lambda aln: not aln.is_truncated and not aln.has_gaps
+    matches = filter(is_matched, alns)
+    if len(matches) > 0:
+        if all_matches is None: print_matched_alns(alns)
+        else: all_matches.extend(alns)
+    elif len(alns) == 0:
+        print 'No match for %s' % clone_name
+    else:
+        print_good_alns(alns)
+
+def alignment_variants(aln):
+    """
+    returns the variants in a CloneAlignment (see
+    clonechecker.variants.find_variants), which are found once and kept with
+    the alignment for the next time they are needed
+    """
+    if getattr(aln, 'variants', None) is None:
+        from clonechecker.variants import find_variants
+        aln.variants = find_variants(aln)
+    return aln.variants
+
 def print_good_alns(alns):
     """
     takes a list of CloneAlignments and prints any alignment of length
@@ -192,8 +497,7 @@ def print_matched_alns(matched_alns):
     """
     print matched alignments to stdout
     """
-    clones = []
-    references = []
+    from clonechecker.variants import reference_location
     print '='*60
     for ref, group in groupby(matched_alns, key=attrgetter('Reference')):
         ref_name = ref.Name
@@ -203,22 +507,20 @@ def print_matched_alns(matched_alns):
             if aln.has_mismatches:
                 msg = '\t%s with mismatches (%s / %s)'
                 print msg % (aln.Clone.Name, len(aln),
-                             len(aln.degap().Seqs[1]))
-                mismatches = [(i, x) for i, x in
-                              enumerate(aln.iterPositions()) if not x[0]==x[1]]
-                try:
-                    coords = ref_name[ref_name.find('(') + 1:-1]
-                    chr = coords[0:coords.find(':')]
-                    start = coords[coords.find(':')+1:coords.find('-')]
-                    for m in mismatches:
+                             aln.last_ref_pos - aln.first_ref_pos)
+                chr, start = reference_location(ref_name)
+                for ref_pos, ref_allele, alt_allele, kind in \
+                        alignment_variants(aln):
+                    if chr is not None:
                         msg = '\t\t%s %d (1-based position %d) %s->%s'
-                        print msg % (chr, int(start) + m[0] + 1, m[0] + 1,
-                                     m[1][1], m[1][0])
-                except ValueError, TypeError:
-                    for m in mismatches:
+                        print msg % (chr, start + ref_pos + 1, ref_pos + 1,
+                                     ref_allele, alt_allele)
+                    else:
                         msg = '\t\t1-based position %d %s->%s'
-                        print msg % (m[0] + 1, m[1][0],
-                                     m[1][1])
+                        print msg % (ref_pos + 1, ref_allele, alt_allele)
+            elif len(aln.masked_positions) > 0:
+                print '%s perfectly (ignoring %d low-quality mismatches)' % (
+                        aln.Clone.Name, len(aln.masked_positions))
             else:
                 print '%s perfectly' % aln.Clone.Name
         fasta_print(ref, name=ref_name)
@@ -240,24 +542,242 @@ def fasta_print(a, name='', width=60):
         j += 1
     if len(line) > 0: print ''.join(line)
 
-def announce_first(clone, logging_level=20, **kwargs):
+# per-worker copies of the clones, references and options, set by init_worker
+_WORKER = {}
+
+def init_worker(clones, references, context):
+    """
+    Pool initializer: keeps the clones, references and command-line options in
+    the worker, so that they are transferred once per worker (or simply
+    inherited, where workers are forked) instead of being pickled into every
+    task. Tasks then refer to clones and references by index
+    """
+    _WORKER['clones'] = clones
+    _WORKER['rc_clones'] = {}
+    _WORKER['references'] = references
+    _WORKER['context'] = context
+    _WORKER['score_bound'] = None
+    if context.get('cache_dir') is not None:
+        from clonechecker.cache import AlignmentCache
+        _WORKER['cache'] = AlignmentCache(context['cache_dir'])
+        _WORKER['digests'] = {}
+    else:
+        _WORKER['cache'] = None
+    if context.get('profile') is not None:
+        import cProfile
+        from multiprocessing.util import Finalize
+        from clonechecker.stats import profile_path
+        profiler = cProfile.Profile()
+        _WORKER['profiler'] = profiler
+        Finalize(None, profiler.dump_stats, exitpriority=10,
+                 args=(profile_path(context['profile'],
+                                    'worker-%d' % os.getpid()),))
+    else:
+        _WORKER['profiler'] = None
+
+def worker_clone(clone_idx, reverse=False):
+    """
+    returns a clone held by this worker, reverse-complemented if reverse=True
+    (reverse complements are computed once per worker and then reused)
+    """
+    if not reverse: return _WORKER['clones'][clone_idx]
+    rc_clones = _WORKER['rc_clones']
+    if clone_idx not in rc_clones:
+        from clonechecker.quality import reverse_complement
+        rc_clones[clone_idx] = reverse_complement(_WORKER['clones'][clone_idx])
+    return rc_clones[clone_idx]
+
+def announce_first(clone_idx):
     """
     Announce to stderr that we are about to start comparing a clone to
     all available references
     """
-    logger = get_logger(logging_level)
-    logger.info('Comparing %s to references', clone.Name)
+    logger = get_logger(_WORKER['context']['logging_level'])
+    logger.info('Comparing %s to references', worker_clone(clone_idx).Name)
+
+def run_task(task):
+    """
+    runs one task from plan_tasks,
+    (clone_idx, reverse, ref_idx, diagonal, exact_pos), with do_task
+    returns the result of do_task + (timing,), where timing is
+    (worker pid, kind of task, seconds taken, bytes of the pickled result or
+    None, bytes of the pickled task or None) for RunStats.add_task. tasks
+    and results are only measured with --stats-json. tasks are measured
+    here, as they arrive, because the pool hands them out from a thread of
+    its own in the main process
+    """
+    start = time.time()
+    profiler = _WORKER['profiler']
+    if profiler is not None: profiler.enable()
+    try:
+        kind, result = do_task(task)
+    finally:
+        if profiler is not None: profiler.disable()
+    seconds = time.time() - start
+    result_bytes = None
+    task_bytes = None
+    if _WORKER['context'].get('stats_json') is not None:
+        result_bytes = len(dumps(result, HIGHEST_PROTOCOL))
+        task_bytes = len(dumps(task, HIGHEST_PROTOCOL))
+    return result + ((os.getpid(), kind, seconds, result_bytes, task_bytes),)
+
+def do_task(task):
+    """
+    does the work of one task from plan_tasks
+    returns (kind, result), where kind is 'announce', 'exact', 'cached',
+    'aligned' or 'best hit' and result is
+    (clone_idx, list of pickled tuples (clone name, Alignment),
+     number of results that came from the cache,
+     list of (key, record) to add to the cache,
+     number of pairs skipped by best_hit_task)
+    """
+    clone_idx, reverse, ref_idx, diagonal, exact_pos = task
+    if ref_idx is None:
+        announce_first(clone_idx)
+        return 'announce', (clone_idx, [], 0, [], 0)
+    if isinstance(ref_idx, list):
+        return 'best hit', (clone_idx,) + best_hit_task(clone_idx, ref_idx)
+    if exact_pos is not None:
+        from clonechecker.align import exact_alignment
+        clone = worker_clone(clone_idx, reverse)
+        ref = _WORKER['references'][ref_idx]
+        aln = exact_alignment(clone, ref, exact_pos)
+        get_logger(_WORKER['context']['logging_level']).info(
+                'exact match found %s, %s', clone.Name, ref.Name)
+        return 'exact', (clone_idx, [dumps((aln.Clone.Name, aln))], 0, [], 0)
+    aln, from_cache, cache_entry = align_pair(clone_idx, reverse, ref_idx,
+                                              diagonal)
+    if from_cache: kind = 'cached'
+    else: kind = 'aligned'
+    pickles = []
+    if aln is not None: pickles.append(dumps((aln.Clone.Name, aln)))
+    cache_entries = []
+    if cache_entry is not None: cache_entries.append(cache_entry)
+    return kind, (clone_idx, pickles, int(from_cache), cache_entries, 0)
+
+def worker_score_bound():
+    """
+    returns the clonechecker.besthit.ScoreBound of the references held by
+    this worker (built the first time it is needed)
+    """
+    if _WORKER.get('score_bound') is None:
+        from clonechecker.besthit import ScoreBound
+        context = _WORKER['context']
+        if context['min_seed_hits'] > 0: k = context['kmer_size']
+        else: k = None
+        _WORKER['score_bound'] = ScoreBound(_WORKER['references'], k=k)
+    return _WORKER['score_bound']
+
+def best_hit_task(clone_idx, candidates):
+    """
+    for --best-hit: aligns a clone to its candidates, a list of
+    (reverse, ref_idx, diagonal, hits, exact_pos), highest upper bound on the
+    score first (see clonechecker.besthit), and stops as soon as no
+    remaining candidate can beat or tie the best score found so far.
+    candidates with an exact_pos occur exactly in the clone there, and get
+    their alignment from exact_alignment instead
+
+    returns (list of pickled tuples (clone name, Alignment) for the
+             alignments with the best score,
+             number of results that came from the cache,
+             list of (key, record) to add to the cache,
+             number of candidates that were skipped)
+    """
+    from clonechecker.besthit import search_best_hits
+    score_bound = worker_score_bound()
+    bounds = [None] * len(candidates)
+    for reverse in (False, True):
+        positions = [i for i, candidate in enumerate(candidates) if
+                     candidate[0] == reverse]
+        if len(positions) == 0: continue
+        strand_bounds = score_bound.upper_bounds(
+                                worker_clone(clone_idx, reverse),
+                                [(candidates[i][1], candidates[i][3]) for
+                                 i in positions])
+        for i, bound in zip(positions, strand_bounds): bounds[i] = bound
+    num_cached = [0]
+    cache_entries = []
+    def align(candidate):
+        reverse, ref_idx, diagonal, exact_pos = candidate
+        if exact_pos is not None:
+            from clonechecker.align import exact_alignment
+            aln = exact_alignment(worker_clone(clone_idx, reverse),
+                                  _WORKER['references'][ref_idx], exact_pos)
+            return aln.score(), aln
+        aln, from_cache, cache_entry = align_pair(clone_idx, reverse, ref_idx,
+                                                  diagonal)
+        if from_cache: num_cached[0] += 1
+        if cache_entry is not None: cache_entries.append(cache_entry)
+        if aln is None: return None
+        return aln.score(), aln
+    alns, num_aligned, num_skipped = search_best_hits(
+            [(candidate[0:3] + candidate[4:5], candidate[3]) for
+             candidate in candidates],
+            bounds, align)
+    return ([dumps((aln.Clone.Name, aln)) for aln in alns], num_cached[0],
+            cache_entries, num_skipped)
+
+def worker_digest(kind, idx):
+    """
+    returns the sequence_digest of a clone (kind='clones', forward orientation)
+    or reference (kind='references') held by this worker
+    """
+    digests = _WORKER['digests']
+    if (kind, idx) not in digests:
+        from clonechecker.cache import sequence_digest
+        digests[(kind, idx)] = sequence_digest(_WORKER[kind][idx])
+    return digests[(kind, idx)]
+
+def align_pair(clone_idx, reverse, ref_idx, diagonal=None):
+    """
+    aligns a clone to a reference, both given by their index in the worker's
+    copies (see init_worker), using check_clone_to_ref
+
+    if there is an alignment cache, the result is taken from it when possible
+
+    returns (Alignment or None,
+             whether the result came from the cache,
+             (key, record) to add to the cache or None)
+    """
+    clone = worker_clone(clone_idx, reverse)
+    ref = _WORKER['references'][ref_idx]
+    context = _WORKER['context']
+    cache = _WORKER['cache']
+    if cache is None:
+        return check_clone_to_ref(clone, ref, diagonal, **context), False, None
+    from clonechecker.align import alignment_from_record
+    from clonechecker.cache import alignment_key
+    from clonechecker.quality import get_quality
+    params = [context['aligner']]
+    if context['band'] is not None and diagonal is not None:
+        params.extend([context['band'], diagonal])
+    if context['mask_quality'] and get_quality(clone) is not None:
+        params.append('mask%d' % context['mask_quality'])
+    key = alignment_key(worker_digest('clones', clone_idx),
+                        worker_digest('references', ref_idx), reverse, *params)
+    try:
+        record = cache[key]
+    except KeyError:
+        aln = check_clone_to_ref(clone, ref, diagonal, **context)
+        if aln is None: return None, False, (key, None)
+        return aln, False, (key, aln.to_record())
+    if record is None: return None, True, None
+    return alignment_from_record(clone, ref, record), True, None
 
-def compare_clone_to_ref(clone, ref, logging_level=20, **kwargs):
+def check_clone_to_ref(clone, ref, diagonal=None, logging_level=20,
+                       aligner=DEFAULT_ALIGNER, band=None, mask_quality=None,
+                       **kwargs):
     """
-    process-safe comparison of a clone Sequence to reference Sequence
-    aligns using clonechecker.align.align_clone_to_ref
-    returns the pickled tuple (clone, Alignment)
-            or None (if AlignmentError is raised)
+    aligns a clone Sequence to a reference Sequence with
+    clonechecker.align.align_clone_to_ref and logs what kind of match it is
+    returns the CloneAlignment or None (if AlignmentError is raised)
     """
+    from clonechecker.align import align_clone_to_ref, AlignmentError
     logger = get_logger(logging_level)
+    if diagonal is None: band = None
     try:
-        aln = align_clone_to_ref(clone, ref)
+        aln = align_clone_to_ref(clone, ref, aligner=aligner, band=band,
+                                 diagonal=diagonal, mask_quality=mask_quality)
     except AlignmentError: return
     if aln.is_match():
         logger.info('match found %s, %s', clone.Name, ref.Name)
@@ -271,6 +791,6 @@ def compare_clone_to_ref(clone, ref, logging_level=20, **kwargs):
         logger.debug('alignment has mismatches (%s, %s)', clone.Name, ref.Name)
         if not aln.is_truncated and not aln.has_gaps:
             logger.info('mutated match found %s, %s', clone.Name, ref.Name)
-    return dumps((aln.Clone.Name, aln))
+    return aln
 
 if __name__=='__main__': main()
\ No newline at end of file
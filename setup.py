@@ -14,18 +14,27 @@ except ImportError: pass
 try: import py2app
 except ImportError: pass
 
+def get_version():
+	"""reads __version__ from src/clonechecker/__init__.py without importing it"""
+	init_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	                         'src', 'clonechecker', '__init__.py')
+	for line in open(init_file):
+		if line.startswith('__version__'):
+			return line.split('=')[1].strip().strip('\'"')
+	raise RuntimeError('No __version__ in %s' % init_file)
+
 def main():
 	if not float(sys.version[:3])>=2.7:
 		sys.stderr.write("CRITICAL: Python version must greater than or equal to 2.7! python 2.7.2 is recommended!\n")
 		sys.exit(1)
 	setup(name='checkmyclones',
-	      version='0.0.10',
+	      version=get_version(),
 	      description="""Provides tools to check Sanger sequencing results
 	      (or any plain-text or FASTQ files) against a set of reference
 	      sequences, provided in any reasonable format (including coordinates)""",
 	      author='Benjamin Schiller',
 	      author_email='benjamin.schiller@ucsf.edu',
-	      requires = ['cogent (>=1.5.0)', 'scripter (>2.9.1, <3.0)'],
+	      requires = ['cogent (>=1.5.0)', 'numpy', 'scripter (>2.9.1, <3.0)'],
 	      url='http://github.com/benjschiller/checkmyclones',
 	      scripts = ['scripts/checkmyclones.py'],
 	      packages = ['clonechecker'],
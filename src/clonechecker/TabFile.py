@@ -7,10 +7,118 @@ Taken from seriesoftubes with permission
 @author: ben
 '''
 import os
+import sys
 import itertools
 import re
 import gzip
 import bz2
+import heapq
+import tempfile
+import multiprocessing
+import numpy
+from clonechecker.bgzf import GZIP_MAGIC, BgzfReader, BgzfWriter, is_bgzf, \
+                             RegionIndex
+
+COMPRESSIONS = ['gzip', 'bgzf', 'bzip2']
+BZIP2_MAGIC = 'BZh'
+
+def detect_compression(filename):
+    '''
+    returns 'bgzf', 'gzip' or 'bzip2' if the file starts with the magic bytes
+    of that format, or None
+    '''
+    fh = open(filename, 'rb')
+    try: magic = fh.read(3)
+    finally: fh.close()
+    if magic.startswith(GZIP_MAGIC):
+        if is_bgzf(filename): return 'bgzf'
+        return 'gzip'
+    if magic == BZIP2_MAGIC: return 'bzip2'
+    return None
+
+# lines are read about this many bytes at a time by _iter_data_chunks
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+_BLANK_LINE = re.compile(r'\n[ \t\r\f\v]*\n')
+
+JOIN_TYPES = ['inner', 'left', 'outer']
+# join_tab_files writes this in the columns of a row that has no match
+MISSING_VALUE = '.'
+# mergesort keeps about this many bytes of rows in memory at once
+DEFAULT_SORT_MEMORY = 256 * 1024 * 1024
+# rough cost in bytes of holding a row and its sort key in memory, on top of
+# the length of the row itself
+_LINE_OVERHEAD = 200
+# mergesort merges at most this many runs (open files) at a time
+MAX_MERGE_RUNS = 128
+
+def _row_key(columns, numerical=False):
+    '''
+    returns a function that gives the key of a parsed row: the values of the
+    columns, as floats where numerical is True and as strings otherwise
+    '''
+    if isinstance(columns, (int, long)): columns = [columns]
+    if isinstance(numerical, bool): numerical = [numerical] * len(columns)
+    if len(numerical) != len(columns):
+        raise ValueError('numerical must be given for every key column')
+    key_types = zip(columns, [float if x else str for x in numerical])
+    def key(fields):
+        return tuple([key_type(fields[column]) for
+                      column, key_type in key_types])
+    return key
+
+def _sort_key(parse_line, columns, numerical=False):
+    '''returns a function that gives the sort key of a line (see _row_key)'''
+    row_key = _row_key(columns, numerical)
+    return lambda line: row_key(parse_line(line))
+
+def _write_run(lines, key, tmpdir=None):
+    '''sorts lines and writes them to a temporary file, returns its path'''
+    lines.sort(key=key)
+    fd, path = tempfile.mkstemp(suffix='.run', dir=tmpdir)
+    fh = os.fdopen(fd, 'w')
+    try:
+        fh.writelines(lines)
+    finally:
+        fh.close()
+    return path
+
+def _read_run(path, key, run_number):
+    '''
+    yields (sort key, run_number, line number, line) for each line of a run,
+    so that merging runs keeps rows with equal keys in their original order
+    '''
+    fh = open(path, 'r')
+    try:
+        for line_number, line in enumerate(fh):
+            yield key(line), run_number, line_number, line
+    finally:
+        fh.close()
+
+def _merge_runs(paths, key):
+    '''yields the lines of the sorted runs in paths in order'''
+    runs = [_read_run(path, key, i) for i, path in enumerate(paths)]
+    for merged in heapq.merge(*runs): yield merged[3]
+
+def _merge_some_runs(paths, key, tmpdir=None):
+    '''
+    merges consecutive groups of MAX_MERGE_RUNS runs into new runs, deletes
+    the old runs and returns the paths of the new ones
+    '''
+    merged_paths = []
+    try:
+        for i in xrange(0, len(paths), MAX_MERGE_RUNS):
+            fd, merged_path = tempfile.mkstemp(suffix='.run', dir=tmpdir)
+            merged_paths.append(merged_path)
+            fh = os.fdopen(fd, 'w')
+            try:
+                fh.writelines(_merge_runs(paths[i:i + MAX_MERGE_RUNS], key))
+            finally:
+                fh.close()
+    except:
+        for path in merged_paths: os.remove(path)
+        raise
+    for path in paths: os.remove(path)
+    return merged_paths
 
 def merge_files(left, right, output, comments='left'):
     '''
@@ -42,22 +150,198 @@ def merge_tab_files(file1, file2, output_filename, comments='left'):
             beginning of output, although they may previously have been
             contained within the data in left or right.
 
-    See also merge_files
-    '''
-    if comments == 'all':
-        file1.process_table(file1, lambda x: x + file2.read_row())
-    elif comments == 'right':
-        file2.process_table(file2, lambda x: x + file1.read_row())
-    elif comments == 'none':
-        outfile = TabFile(output_filename, write=True)
-        for x in file1: outfile.write_row(x + file2.read_row())
-    elif comments == 'all':
-        # write comments first
-        for x in file1.comment_line_contents(): outfile.write_row(x)
-        for x in file2.comment_line_contents(): outfile.write_row(x)
-        for x in file1: outfile.write_row( x+ file2.read_row())
-    else:
+    See also merge_files and join_tab_files, which matches rows by key
+    rather than by position
+    '''
+    if not comments in ['left', 'right', 'none', 'all']:
         raise ValueError("comments must be one of 'left', 'right', 'none', 'all'")
+    outfile = TabFile(output_filename, 'w')
+    try:
+        if comments == 'left' or comments == 'right':
+            # rows of the other file are read from one generator, in step
+            if comments == 'left': commented, other = file1, iter(file2)
+            else: commented, other = file2, iter(file1)
+            for line in commented.__rawiter__():
+                if commented._is_comment(commented.previous_line(), line):
+                    outfile.write(line)
+                    continue
+                row = commented._parse_line(line)
+                if comments == 'left': outfile.write_row(row + other.next())
+                else: outfile.write_row(other.next() + row)
+        else:
+            if comments == 'all':
+                # write comments first
+                for x in file1.comment_line_contents(): outfile.write(x)
+                for x in file2.comment_line_contents(): outfile.write(x)
+            right_rows = iter(file2)
+            for x in file1: outfile.write_row(x + right_rows.next())
+    finally:
+        outfile.close()
+
+def _write_joined(output_filename, joined, left, right, widths):
+    '''
+    writes (left row, right row) pairs from a join, filling in MISSING_VALUE
+    for the widths[0] (or widths[1]) columns of a missing left (or right)
+    row, with the column names of left and right first if either has them
+    '''
+    outfile = TabFile(output_filename, 'w')
+    try:
+        names = [left.get_column_names(), right.get_column_names()]
+        if names[0] is not None or names[1] is not None:
+            outfile.write_row((names[0] or [MISSING_VALUE] * widths[0]) +
+                              (names[1] or [MISSING_VALUE] * widths[1]))
+        for left_row, right_row in joined:
+            outfile.write_row((left_row or [MISSING_VALUE] * widths[0]) +
+                              (right_row or [MISSING_VALUE] * widths[1]))
+    finally:
+        outfile.close()
+
+def _peek_width(tab_file):
+    '''
+    reads the first row of tab_file, and returns (rows, width), where rows
+    iterates over all of its rows (that first one included) and width is its
+    number of columns: the number of column names if it has them, or else
+    of the first row (0 if it has no rows)
+    '''
+    rows = iter(tab_file)
+    first = next(rows, None)
+    if first is None: return iter([]), len(tab_file.get_column_names() or [])
+    names = tab_file.get_column_names()
+    if names is not None: width = len(names)
+    else: width = len(first)
+    return itertools.chain([first], rows), width
+
+def _key_groups(tab_file, key, side):
+    '''
+    yields (key, rows) for each run of rows with the same key, and raises
+    TabFileError if the keys are not sorted
+    '''
+    previous = None
+    for k, rows in itertools.groupby(tab_file, key):
+        if previous is not None and k < previous:
+            raise TabFileError('The', side, 'file is not sorted by the join key:',
+                               repr(k), 'comes after', repr(previous))
+        previous = k
+        yield k, rows
+
+def _merge_join(left, right, left_key, right_key, how):
+    '''
+    yields (left row, right row) pairs for a sort-merge join. only the rows
+    of the right file that share one key are held in memory at a time
+    '''
+    left_groups = _key_groups(left, left_key, 'left')
+    right_groups = _key_groups(right, right_key, 'right')
+    left_group = next(left_groups, None)
+    right_group = next(right_groups, None)
+    while left_group is not None or right_group is not None:
+        if how == 'inner' and (left_group is None or right_group is None): break
+        if how == 'left' and left_group is None: break
+        if right_group is None or \
+                (left_group is not None and left_group[0] < right_group[0]):
+            if how != 'inner':
+                for row in left_group[1]: yield row, None
+            left_group = next(left_groups, None)
+        elif left_group is None or right_group[0] < left_group[0]:
+            if how == 'outer':
+                for row in right_group[1]: yield None, row
+            right_group = next(right_groups, None)
+        else:
+            right_rows = list(right_group[1])
+            for row in left_group[1]:
+                for right_row in right_rows: yield row, right_row
+            left_group = next(left_groups, None)
+            right_group = next(right_groups, None)
+
+def _hash_join(left, right, left_key, right_key, how):
+    '''
+    yields (left row, right row) pairs for a hash join. the whole right file
+    is held in memory, and the left file is read once
+    '''
+    right_rows = []
+    lookup = {}
+    for row in right:
+        k = right_key(row)
+        right_rows.append((k, row))
+        lookup.setdefault(k, []).append(row)
+    matched = set()
+    for row in left:
+        k = left_key(row)
+        matches = lookup.get(k)
+        if matches is None:
+            if how != 'inner': yield row, None
+            continue
+        matched.add(k)
+        for right_row in matches: yield row, right_row
+    if how == 'outer':
+        for k, row in right_rows:
+            if k not in matched: yield None, row
+
+def join_tab_files(left, right, output_filename, left_key, right_key=None,
+                   how='inner', numerical=False, method='merge'):
+    '''
+    join_tab_files writes the rows of the TabFile objects left and right that
+    have the same key, side by side, to the file named output_filename.
+
+    The key of a row is the value of column left_key (or right_key, for the
+    right file), or of each column in the list left_key. right_key defaults
+    to left_key. As in mergesort, numerical chooses whether columns are
+    compared as numbers or as strings.
+
+    how is one of
+        'inner' -- only rows with a match in the other file
+        'left'  -- every row of left, with MISSING_VALUE in the right columns
+                   if it has no match
+        'outer' -- every row of both files
+    Every matching pair of rows is written, so keys that appear several
+    times in both files give every combination.
+
+    method='merge' streams through both files, which must already be sorted
+    by the key (see mergesort), holding only the right rows for the current
+    key in memory. method='hash' reads the whole right file into memory and
+    streams through left in any order, which is best when right is small.
+    Rows come out in the order of left, followed (for 'outer') by the
+    unmatched rows of right.
+
+    Column names, if either file has them, are written first. Comments are
+    not copied.
+    '''
+    if not how in JOIN_TYPES:
+        raise ValueError('how must be one of %s' % ', '.join(JOIN_TYPES))
+    if right_key is None: right_key = left_key
+    if not method in ('merge', 'hash'):
+        raise ValueError("method must be 'merge' or 'hash'")
+    left_row_key = _row_key(left_key, numerical)
+    right_row_key = _row_key(right_key, numerical)
+    # the widths are needed to fill in missing rows, which may come before
+    # any row of that side has been read
+    left_rows, left_width = _peek_width(left)
+    right_rows, right_width = _peek_width(right)
+    if method == 'merge':
+        joined = _merge_join(left_rows, right_rows, left_row_key,
+                             right_row_key, how)
+    else:
+        joined = _hash_join(left_rows, right_rows, left_row_key,
+                            right_row_key, how)
+    _write_joined(output_filename, joined, left, right,
+                  (left_width, right_width))
+
+def _process_byte_range(args):
+    '''
+    process_table worker: applies fnc to each row of the bytes [start, end)
+    of a file and returns the output lines, with comments copied unchanged
+    '''
+    filename, start, end, comments, fnc = args
+    tab_file = TabFile(filename, comments=comments, streaming=True)
+    try:
+        tab_file._file_pointer.seek(start)
+        lines = tab_file._file_pointer.read(end - start).splitlines(True)
+    finally:
+        tab_file.close()
+    output = []
+    for line in lines:
+        if tab_file._classify(line): output.append(line)
+        else: output.append(tab_file._make_line(fnc(tab_file._parse_line(line))))
+    return ''.join(output)
 
 class TabFileError(Exception):
     def __init__(self, *args):
@@ -93,20 +377,59 @@ class TabFile(object):
 ['(?i)track','(?i)browser']
        if column_names = True, the first properly formatted row will be treated as
        column names (i.e. ignored as a comment)
+
+       filename may also be '-' (stdin or stdout) or an open file object.
+       With streaming=True, comments are recognized as the file is read,
+       instead of reading the whole file once beforehand, so pipes and other
+       inputs that can only be read once are supported. Until the file has
+       been read, comment_line_contents, comment_line_numbers and
+       get_column_names only know about the lines read so far.
+       streaming defaults to True for anything that is not a regular file.
+
+       compression may be 'gzip', 'bgzf' (blocked gzip, as written by bgzip)
+       or 'bzip2'. When reading a file, compression is detected from its first
+       few bytes unless it is given, and compressed files are read in
+       streaming mode by default. BGZF files are decompressed by processes
+       worker processes if processes > 1, and can be read by region (see
+       BedFile.fetch)
     '''
 
     def __init__(self, filename, mode='r', convert_spaces=True,
-                 compression=None, comments=[], column_names=False):
+                 compression=None, comments=[], column_names=False,
+                 streaming=None, processes=None):
+        if hasattr(filename, 'readline') or hasattr(filename, 'write'):
+            self._stream = filename
+            filename = getattr(filename, 'name', '<stream>')
+        elif filename == '-':
+            if 'r' in mode: self._stream = sys.stdin
+            else: self._stream = sys.stdout
+            filename = self._stream.name
+        else:
+            self._stream = None
         self._filename = filename
         self._file_extension = os.path.splitext(filename)[1].lstrip(os.extsep)
         self.mode = mode
+        if compression is None and self._stream is None and 'r' in mode and \
+                os.path.isfile(filename):
+            compression = detect_compression(filename)
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError('compression must be one of %s' %
+                             ', '.join(COMPRESSIONS))
+        self.compression = compression
+        self.processes = processes
         self.open(mode)
         self._previous_line = 0
-        # _detect_comments sets _comment_line_numbers,
-        #                       _comment_line_contents
-        if 'r' in mode :
+        # _is_comment fills in _comment_line_numbers, _comment_line_contents
+        # and _column_names as lines are read
+        self._set_comments(comments, column_names)
+        if streaming is None:
+            streaming = self._stream is not None or \
+                        self.compression is not None or \
+                        not os.path.isfile(self._filename)
+        self.streaming = streaming
+        if 'r' in mode and not streaming:
             try:
-                self._detect_comments(comments, column_names)
+                self._detect_comments()
             except:
                 raise DetectCommentsError("Failed with comments=", *comments)
             
@@ -114,53 +437,84 @@ class TabFile(object):
         '''returns the line number of the last line read'''
         return self._previous_line
 
-    def _detect_comments(self, comments, column_names=False):
-        self.close()
-        self.open()
-        if not os.path.isfile(self._filename):
-            self._column_names = None
-            self._comment_line_numbers = []
-            self._comment_line_contents = []
-            return
-
-        number_keywords = len(comments)
-        if number_keywords is not 0:
-            searchables = [re.compile(keyword) for keyword in comments]
-
-        if column_names:
-            first_valid_line = True
-        else:
-            first_valid_line = False
-            self._column_names = None
+    def _set_comments(self, comments, column_names=False):
+        '''sets up the rules that _is_comment uses to recognize comments'''
+        self._searchables = [re.compile(keyword) for keyword in comments]
+        self._expect_column_names = column_names
+        self._column_names = None
+        self._column_names_line = None
+        self._comment_line_numbers = set()
+        self._comment_line_contents = []
+        self._lines_classified = 0
+
+    def _classify(self, line):
+        '''returns True if line is a comment (or the column names)'''
+        stripped = line.lstrip()
+        # blank lines and lines starting with # are comments
+        if stripped == '' or stripped[0] == '#': return True
+        for searchable in self._searchables:
+            if searchable.search(line) is not None: return True
+        if self._expect_column_names:
+            self._expect_column_names = False
+            self._column_names = self._parse_line(line)
+            return True
+        return False
+
+    def _is_comment(self, line_number, line):
+        '''
+        returns True if line (which is line number line_number) is a comment.
+        each line is classified the first time it is read
+        '''
+        if line_number > self._lines_classified:
+            self._lines_classified = line_number
+            if self._classify(line):
+                if self._column_names is not None and \
+                        self._column_names_line is None:
+                    self._column_names_line = line_number
+                self._comment_line_numbers.add(line_number)
+                self._comment_line_contents.append(line)
+                return True
+            return False
+        return line_number in self._comment_line_numbers
+
+    def _may_have_comments(self, lines, text):
+        '''
+        returns False only if none of lines (joined together as text) can be a
+        comment, which is cheap to check for a whole chunk of lines at once
+        '''
+        if self._expect_column_names or '#' in text: return True
+        if _BLANK_LINE.search(text) is not None: return True
+        if lines[0].strip() == '' or lines[-1].strip() == '': return True
+        for searchable in self._searchables:
+            if searchable.search(text) is not None: return True
+        return False
+
+    def _iter_data_chunks(self, size_hint=DEFAULT_CHUNK_SIZE):
+        '''
+        yields lists of the lines that are not comments, reading about
+        size_hint bytes at a time. lines are only classified one at a time in
+        chunks that may have comments in them
+        '''
+        if self._file_pointer is None: self.open()
+        while True:
+            lines = self._file_pointer.readlines(size_hint)
+            if len(lines) == 0:
+                self.close()
+                return
+            first = self._previous_line + 1
+            self._previous_line += len(lines)
+            if first > self._lines_classified and \
+                    not self._may_have_comments(lines, ''.join(lines)):
+                self._lines_classified = self._previous_line
+                yield lines
+            else:
+                yield [line for n, line in enumerate(lines, first) if
+                       not self._is_comment(n, line)]
 
-        line_number = 0
-        comment_line_numbers = []
-        comment_line_contents = []
+    def _detect_comments(self):
+        '''reads the whole file once to find the comments'''
         for line in self.__rawiter__():
-            line_number += 1
-            # blank lines are comments
-            if line.lstrip() == '':
-                comment_line_numbers.append(line_number)
-                comment_line_contents.append(line)
-            # lines starting with # are comments
-            elif line.lstrip()[0] == '#':
-                comment_line_numbers.append(line_number)
-                comment_line_contents.append(line)
-            elif number_keywords is not 0:
-                for searchable in searchables:
-                    if searchable.search(line) is not None:
-                        comment_line_numbers.append(line_number)
-                        comment_line_contents.append(line)
-                        break
-            elif first_valid_line:
-                first_valid_line = False
-                self._column_names = self._parse_line(line)
-                comment_line_numbers.append(line_number)
-                comment_line_contents.append(line)
-
-        self._comment_line_numbers = comment_line_numbers
-        self._comment_line_contents = comment_line_contents
-        self.close()
+            self._is_comment(self.previous_line(), line)
         self.open()
 
     def _parse_line(self, input_string, convert_spaces=True):
@@ -182,7 +536,7 @@ class TabFile(object):
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._file_pointer.close()
+        if self._stream is None: self._file_pointer.close()
 
     def open(self, mode=None):
         '''
@@ -193,7 +547,24 @@ class TabFile(object):
         mode
         '''
         if mode is None: mode = self.mode
-        self._file_pointer = open(self._filename, mode)
+        if self._stream is not None: self._file_pointer = self._stream
+        else: self._open(mode)
+
+    def _open(self, mode):
+        '''opens the file, with decompression (or compression) if needed'''
+        if self.compression is None:
+            self._file_pointer = open(self._filename, mode)
+        elif self.compression == 'bgzf':
+            if 'r' in mode:
+                self._file_pointer = BgzfReader(self._filename,
+                                                processes=self.processes)
+            else: self._file_pointer = BgzfWriter(self._filename)
+        else:
+            mode = mode.replace('U', '')
+            if not 'b' in mode: mode += 'b'
+            if self.compression == 'gzip':
+                self._file_pointer = gzip.open(self._filename, mode)
+            else: self._file_pointer = bz2.BZ2File(self._filename, mode)
 
     def zap(self):
         '''forces status to not open. use with caution. this may destroy data'''
@@ -204,7 +575,8 @@ class TabFile(object):
         '''works just like the built-in close method in the file class'''
         if self._file_pointer is None:
             raise IOError('{!s} not open'.format(self._filename))
-        else:
+        # streams belong to the caller (or are stdin/stdout), so leave them open
+        elif self._stream is None:
             self._file_pointer.close()
         self._previous_line = 0
 
@@ -281,7 +653,7 @@ re-open to read all rows of the column')
     def __iter__(self):
         '''returns the next (or first) line that is not a comment, parsed'''
         for line in self.__rawiter__():
-            if not self.previous_line() in self.comment_line_numbers():
+            if not self._is_comment(self.previous_line(), line):
                 yield self._parse_line( line )
 
     def comment_line_contents(self):
@@ -289,8 +661,8 @@ re-open to read all rows of the column')
         return self._comment_line_contents
 
     def comment_line_numbers(self):
-        '''returns the list of lines that are comments'''
-        return self._comment_line_numbers
+        '''returns the sorted list of the numbers of lines that are comments'''
+        return sorted(self._comment_line_numbers)
 
     def read_row(self):
         '''returns the next (or first) line that is not a comment, parsed. uses __iter__ as a generator, and simply returns the next value
@@ -345,53 +717,96 @@ override=True to the method')")
         finally:
             self.close()
 
-    def process_table(self, output_filename, fnc, column_names=None):
+    def process_table(self, output_filename, fnc, column_names=None,
+                      processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
         '''
-        process_tables2 writes a new file (name is specified with new_file), 
-        which applies a user-defined function fnc to each row of data in the 
-        original file. fnc should yield a row (i.e. a list, array, or something 
-        else finitely iterable).
-
-        process_tables2 preserves all commented lines and also the line which 
-        column names, if applicable. The user may specify new column names 
-        using column_names (a list or other finite iterable), or we will use 
-        the old column_names, which might not preserve the column labels if 
-        columns were inserted in the middle of the table
+        process_table writes a new file (named output_filename), which
+        applies a user-defined function fnc to each row of data in the
+        original file. fnc should return a row (i.e. a list, array, or
+        something else finitely iterable).
+
+        process_table preserves all commented lines, in place, and also the
+        line with the column names, if applicable. The user may specify new
+        column names using column_names (a list or other finite iterable),
+        which replace the old column names, or are written before the first
+        row if the file has none.
+
+        With processes > 1, the rest of the file after the first row is split
+        into chunks of about chunk_size bytes (ending at line breaks), and
+        each chunk is processed by one of processes worker processes. The
+        output is written in the original order. fnc must then be picklable
+        (e.g. a function defined at the top level of a module), and only
+        regular, uncompressed files are split; anything else is processed
+        one row at a time. Comments in the part of the file handled by the
+        workers are copied to the output but not recorded in this TabFile.
         '''
         if self._file_pointer is None: self.open()
+        parallel = processes is not None and processes > 1 and \
+                   self._stream is None and self.compression is None
         output_file = TabFile(output_filename, 'w')
-
-        if not column_names == None:
-            first_valid_line = True
-            output_file.set_column_names(column_names)
-        elif not self._column_names==None:
-            first_valid_line = True
-            output_file.set_column_names(column_names)
-        else: first_valid_line = False
-
-        # treat rawiter as a generator
-        # we're going to thread it
-        lines = self.__rawiter__()
-
-        # make sure we set column_names correctly
-        if first_valid_line:
-            while True:
-                line = lines.next()
-                if self.previous_line() in self.comment_line_numbers():
-                    output_file.write(line)
-                else:
-                    first_valid_line = False
+        try:
+            wrote_column_names = False
+            offset = None
+            for line in self.__rawiter__():
+                line_number = self.previous_line()
+                if self._is_comment(line_number, line):
+                    if column_names is not None and \
+                            line_number == self._column_names_line:
+                        output_file.write_row(column_names)
+                        wrote_column_names = True
+                    else:
+                        output_file.write(line)
+                    continue
+                if column_names is not None and not wrote_column_names:
                     output_file.write_row(column_names)
+                    wrote_column_names = True
+                output_file.write_row(fnc(self._parse_line(line)))
+                if parallel:
+                    # the workers take over from the end of the first row
+                    offset = self._file_pointer.tell()
+                    self.close()
                     break
+            if offset is not None:
+                self._process_in_parallel(output_file, fnc, offset,
+                                          processes, chunk_size)
+        finally:
+            output_file.close()
 
-        # proceed with the remainder
-        while True:
-            line = lines.next()
-            if self.previous_line() in self.comment_line_numbers():
-                output_file.write(line)
-            else:
-                output_file.write_row(fnc(self._parse_line(line)))
-        output_file.close()
+    def _byte_ranges(self, offset, chunk_size):
+        '''
+        yields (start, end) byte ranges of about chunk_size bytes that cover
+        the file from offset to the end, each ending at a line break
+        '''
+        size = os.path.getsize(self._filename)
+        fh = open(self._filename, 'rb')
+        try:
+            start = offset
+            while start < size:
+                fh.seek(start + max(chunk_size, 1) - 1)
+                fh.readline()
+                end = min(fh.tell(), size)
+                yield start, end
+                start = end
+        finally:
+            fh.close()
+
+    def _process_in_parallel(self, output_file, fnc, offset, processes,
+                             chunk_size):
+        '''writes fnc of each row after offset, processed by a pool'''
+        comments = [searchable.pattern for searchable in self._searchables]
+        tasks = ((self._filename, start, end, comments, fnc) for
+                 start, end in self._byte_ranges(offset, chunk_size))
+        pool = multiprocessing.Pool(processes=processes)
+        try:
+            # imap keeps the chunks in file order
+            for text in pool.imap(_process_byte_range, tasks):
+                output_file.write(text)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
 
     def get_column_names(self):
         '''returns the column names'''
@@ -411,14 +826,55 @@ override=True to the method')")
         '''writes the stored column names'''
         self.write_row(self._column_names)
 
-    def mergesort(self,f, n,numerical=False):
-        raise NotImplementedError
-#        if self._file_pointer is None:
-#            raise UserWarning('File already opened and must be closed and re-opened to mergesort the file. This behavior may not be overridden.')
-#        fcontents = self.read_table(f)
-#        if numerical==True: fcontents = self._numerize(fcontents,n)
-##        newcontents = merge.mergesort(fcontents,n)
-##        writeFile(newcontents,f)
+    def mergesort(self, f, n, numerical=False, memory=DEFAULT_SORT_MEMORY,
+                  tmpdir=None):
+        '''
+        sorts the rows by column n (numbering starts at 0), or by each of the
+        columns in the list n in turn, and writes them to the file named f.
+        Comments and column names are written first, in their original order.
+
+        Columns are compared as numbers if numerical is True, or as strings
+        if it is False. Give a list of True/False to choose for each column.
+        The sort is stable.
+
+        Files larger than memory (in bytes) are sorted out of core: the rows
+        are read in runs that fit in memory, each run is sorted and written to
+        a temporary file (in tmpdir, by default the system's temporary
+        directory), and the runs are merged with a heap.
+        '''
+        if self._file_pointer is not None: self.close()
+        self.open()
+        key = _sort_key(self._parse_line, n, numerical)
+        runs = []
+        try:
+            run = []
+            run_size = 0
+            for lines in self._iter_data_chunks():
+                for line in lines:
+                    if not line.endswith('\n'): line += '\n'
+                    run.append(line)
+                    run_size += len(line) + _LINE_OVERHEAD
+                    if run_size >= memory:
+                        runs.append(_write_run(run, key, tmpdir))
+                        run = []
+                        run_size = 0
+            if len(runs) == 0:
+                run.sort(key=key)
+                sorted_lines = run
+            else:
+                if len(run) > 0: runs.append(_write_run(run, key, tmpdir))
+                del run
+                while len(runs) > MAX_MERGE_RUNS:
+                    runs = _merge_some_runs(runs, key, tmpdir)
+                sorted_lines = _merge_runs(runs, key)
+            output_file = TabFile(f, 'w')
+            try:
+                for line in self.comment_line_contents(): output_file.write(line)
+                for line in sorted_lines: output_file.write(line)
+            finally:
+                output_file.close()
+        finally:
+            for path in runs: os.remove(path)
 
 class BedRow(list):
     '''BEDrows are list, but you can access their chromStart(), chromEnd(), etc. use help for a full list. Uses the same conventions as http://genome.ucsc.edu/FAQ/FAQformat#format1. Note that only the first three entries (chrom, chromStart, chromEnd) are required, so the others may not be defined.'''
@@ -488,19 +944,8 @@ class GzipTabFile(TabFile):
     See Tabfile for usage info
     '''
     def __init__(self, *args, **kwargs):
-        super(TabFile, self).__init__(*args, **kwargs)
-        
-    def _open(self, mode=None):
-        '''
-        mode can be overriden here but defaults to TabFile.mode
-        
-        acts just like the built-in open method in the file class. use
-        write=True to write to a file, otherwise it will be opened in read-only
-        mode
-        '''
-        if mode is None: mode = self.mode
-        if not 'b' in mode: mode += 'b'
-        self._file_pointer = gzip.open(self._filename, mode)
+        kwargs['compression'] = 'gzip'
+        super(GzipTabFile, self).__init__(*args, **kwargs)
     
 class Bzip2TabFile(TabFile):
     '''
@@ -509,19 +954,8 @@ class Bzip2TabFile(TabFile):
     See Tabfile for usage info
     '''
     def __init__(self, *args, **kwargs):
-        super(TabFile, self).__init__(*args, **kwargs)
-        
-    def _open(self, mode=None):
-        '''
-        mode can be overriden here but defaults to TabFile.mode
-        
-        acts just like the built-in open method in the file class. use
-        write=True to write to a file, otherwise it will be opened in read-only
-        mode
-        '''
-        if mode is None: mode = self.mode
-        if not 'b' in mode: mode += 'b'
-        self._file_pointer = bz2.BZ2File(self._filename, mode)
+        kwargs['compression'] = 'bzip2'
+        super(Bzip2TabFile, self).__init__(*args, **kwargs)
                 
 class BedFile(TabFile):
     '''
@@ -541,24 +975,38 @@ class BedFile(TabFile):
         comments = self.DEFAULT_BED_COMMENTS + additional_comments
         TabFile.__init__(self, f, comments=comments,
                          **kwargs)
-        self._track_line = None
-        # check again for track line, and save it #
-        for x in self._comment_line_contents:
-            expr = re.compile('(?i)track')
-            if expr.search(x) is not None:
-                self._track_line = x
-                break
+        self._region_index = None
 
     def get_track_line(self):
-        '''returns the current track line, if any'''
-        return self._track_line
+        '''
+        returns the current track line, if any (when streaming, only if it has
+        been read)
+        '''
+        expr = re.compile('(?i)track')
+        for x in self._comment_line_contents:
+            if expr.search(x) is not None: return x
+        return None
 
     def __iter__(self):
         '''returns the next (or first) line that is not a comment, parsed'''
         for line in self.__rawiter__():
-            if not self.previous_line() in self.comment_line_numbers():
+            if not self._is_comment(self.previous_line(), line):
                 yield BedRow(self._parse_line( line ))
 
+    def fetch(self, chrom, start, end):
+        '''
+        yields the rows that overlap [start, end) on chrom, decompressing only
+        the blocks they are in. the file must be BGZF-compressed (see
+        RegionIndex, which builds and saves an index the first time)
+        '''
+        if self.compression != 'bgzf':
+            raise TabFileError('Reading by region needs a BGZF-compressed file,',
+                               self._filename, 'is not')
+        if self._region_index is None:
+            self._region_index = RegionIndex(self._filename)
+        for line in self._region_index.fetch(chrom, start, end):
+            yield BedRow(self._parse_line(line))
+
 class MacsRow(list):
     '''MACSrows are list, but you can access their features as follows:        
 
@@ -632,12 +1080,13 @@ class MacsFile(TabFile):
     '''A MACS file is a type of TabFile, but also defines a method for working with rows. rows are given as instances of MACSRow, instead of lists. MACSrows inerhit all list methods and therefore are compatible with write_row. MacsRow has additional methods for chrom, chromStart, chromEnd, etc. For more info, see MacsRow'''
 
     def __init__(self, f, convert_spaces=True, **kwargs):
-        super(MacsFile, self).__init__(self, f, column_names=True, **kwargs)
+        super(MacsFile, self).__init__(f, convert_spaces=convert_spaces,
+                                       column_names=True, **kwargs)
 
     def __iter__(self):
         '''returns the next (or first) line that is not a comment, parsed'''
         for line in self.__rawiter__():
-            if not self.previous_line() in self.comment_line_numbers():
+            if not self._is_comment(self.previous_line(), line):
                 yield MacsRow(self._parse_line(line))
 
 def shift_peaks(f, peak_lengths=2):
@@ -647,20 +1096,29 @@ def shift_peaks(f, peak_lengths=2):
     with all the sequences shifted (left) by peak_lengths times their length.
     If peak_lengths, is negative they are shifted to the right.
     comments are stripped
+
+    the shifts are computed for a chunk of rows at a time. Every row is
+    shifted on its own and keeps all of its columns, so this needs neither
+    an IntervalIndex nor a BedTable (which only keeps the first four)
     '''
-    x = BedFile(f)
+    x = BedFile(f, streaming=True)
     # CHANGE TO USE FILENAME CORRECTION SCHEME
-    y = BedFile(f[0:-4]+'_shifted.bed')
-    y.open(write=True)
-    for peak in x:
-        peak_start, peak_end = int(peak[1]), int(peak[2])
-        new_peak = peak.copy()
-        peak_shift = peak_lengths * (peak_end - peak_start)
+    y = BedFile(f[0:-4]+'_shifted.bed', mode='w')
+    for lines in x._iter_data_chunks():
+        if len(lines) == 0: continue
+        peaks = [x._parse_line(line) for line in lines]
+        peak_starts = numpy.array([peak[1] for peak in peaks]).astype(numpy.int64)
+        peak_ends = numpy.array([peak[2] for peak in peaks]).astype(numpy.int64)
+        peak_shifts = peak_lengths * (peak_ends - peak_starts)
         # update start, end
-        new_peak[1] = peak_start - peak_shift
-        new_peak[2] = peak_end - peak_shift
-        if int(new_peak[1])<0: new_peak[1] = 0
-        y.write_row(new_peak)
+        new_starts = numpy.maximum(peak_starts - peak_shifts, 0)
+        new_ends = peak_ends - peak_shifts
+        for peak, start, end in zip(peaks, new_starts.tolist(),
+                                    new_ends.tolist()):
+            peak[1] = start
+            peak[2] = end
+        y.write_rows(peaks)
+    y.close()
     return
 
 def _quote(s):
@@ -1,4 +1,30 @@
-import align
-import filetools
-import TabFile
-__all__ = ["align", "filetools", "TabFile"]
\ No newline at end of file
+import sys
+import types
+# the version is kept here so that it can be read without pkg_resources
+# (setup.py reads it too)
+__version__ = '0.0.10'
+__all__ = ["align", "bedtable", "besthit", "bgzf", "cache", "defaults", "exact", "fasta", "filetools", "intervals", "kmers", "packed", "quality", "smithwaterman", "stats", "TabFile", "twobit", "variants"]
+
+class _LazyPackage(types.ModuleType):
+    '''
+    the clonechecker package, which imports a submodule the first time it is
+    used as an attribute (e.g. clonechecker.align), so that importing the
+    package (or just the version) does not import cogent and numpy
+    '''
+
+    def __getattr__(self, name):
+        if name not in self.__all__:
+            raise AttributeError("'module' object has no attribute '%s'" % name)
+        __import__('%s.%s' % (self.__name__, name))
+        # importing a submodule sets it as an attribute of the package
+        return self.__dict__[name]
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(self.__all__))
+
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(globals())
+# keep the original module alive: python 2 clears the globals of a module
+# when it is deleted
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
@@ -3,39 +3,186 @@ Created on Aug 11, 2011
 
 @author: ben
 '''
-from cogent.align.algorithm import sw_align
+from cogent.align.algorithm import SmithWatermanMatrix
 from cogent import Alignment
 from cogent.core.sequence import SequenceI
+from clonechecker import smithwaterman
+from clonechecker.quality import masked_mismatches
+from clonechecker.packed import PackedSequence, sequence_class
+from clonechecker.defaults import ALIGNERS, DEFAULT_ALIGNER
+import re
 #from cogent.parse.record import FileFormatError
 
-def align_clone_to_ref(clone, reference):
-    '''Aligns two pycogent Sequence objects with Smith-Waterman algorithm'''
-    if not isinstance(clone, SequenceI):
+def align_clone_to_ref(clone, reference, aligner=DEFAULT_ALIGNER, band=None,
+                       diagonal=None, mask_quality=None):
+    '''
+    Aligns two pycogent Sequence (or PackedSequence) objects with
+    Smith-Waterman algorithm
+
+    aligner selects the implementation, either 'cogent' (cogent's sw_align)
+    or 'numpy' (clonechecker.smithwaterman.local_align). Both give the same
+    alignment. The positions of the alignment in the clone and reference
+    and its edit script (ops, see edit_ops) are taken from the aligner.
+    The numpy aligner can also be restricted to a band of width
+    band around a diagonal (clone position - reference position), usually
+    the best diagonal found by KmerIndex.vote
+
+    If the clone has base qualities (see clonechecker.quality), mismatches
+    at clone bases with a Phred score below mask_quality do not count
+    towards has_mismatches (their clone positions are kept in
+    masked_positions)
+    '''
+    if not isinstance(clone, (SequenceI, PackedSequence)):
         raise ValueError('clone must be a cogent.SequenceI object')
-    if not isinstance(reference, SequenceI):
+    if not isinstance(reference, (SequenceI, PackedSequence)):
         raise ValueError('reference must be a cogent.SequenceI object')
-    aligned = sw_align(clone, reference)
+    if aligner == 'cogent':
+        if band is not None:
+            raise ValueError('band is only supported by the numpy aligner')
+        # same as cogent's sw_align, but keep the matrix for the coordinates
+        matrix = SmithWatermanMatrix(_as_cogent(clone), _as_cogent(reference))
+        aligned = matrix.alignment()
+        max_score, last_ref_pos, last_clone_pos = matrix.MaxScore
+        aligned_clone = str(aligned[0])
+        aligned_ref = str(aligned[1])
+        first_clone_pos = last_clone_pos - len(aligned_clone) + \
+                          aligned_clone.count('-')
+        first_ref_pos = last_ref_pos - len(aligned_ref) + aligned_ref.count('-')
+        coords = (first_clone_pos, last_clone_pos, first_ref_pos, last_ref_pos)
+        ops = edit_ops(aligned_clone, aligned_ref)
+    elif aligner == 'numpy':
+        aligned, max_score, coords, ops = smithwaterman.local_align(clone,
+                                    reference, band=band, diagonal=diagonal)
+    else:
+        raise ValueError('aligner must be one of %s' % ', '.join(ALIGNERS))
+    return _make_clone_alignment(clone, reference, aligned, coords, ops,
+                                 mask_quality)
+
+def _as_cogent(seq):
+    '''returns seq as a cogent Sequence'''
+    if isinstance(seq, PackedSequence): return seq.to_cogent()
+    return seq
+
+def _make_clone_alignment(clone, reference, aligned, coords, ops,
+                          mask_quality=None):
+    '''
+    builds a CloneAlignment from the aligned clone and reference, the
+    coordinates reported by the aligner
+    (first_clone_pos, last_clone_pos, first_ref_pos, last_ref_pos)
+    and the edit script (see edit_ops), ignoring mismatches at clone bases
+    with qualities below mask_quality
+    '''
+    first_clone_pos, last_clone_pos, first_ref_pos, last_ref_pos = coords
+    match_len = last_ref_pos - first_ref_pos
+    if match_len == 0: raise AlignmentError('No alignment')
     ref_len = len(reference)
-    clone_matched = str(aligned[0].parseOutGaps()[1])
-    ref_matched = str(aligned[1].parseOutGaps()[1])
-    if ref_matched == '': raise AlignmentError('No alignment')
-    
+
     aln = CloneAlignment(aligned)
-    # find where we are in the reference
-    aln.first_ref_pos = str(reference).index(ref_matched)
-    aln.first_clone_pos = str(clone).index(clone_matched)
-    aln.last_ref_pos = aln.first_ref_pos + len(ref_matched)
-    aln.last_clone_pos = aln.first_clone_pos + len(clone_matched)
-    match_len = len(ref_matched)
+    aln.first_ref_pos = first_ref_pos
+    aln.first_clone_pos = first_clone_pos
+    aln.last_ref_pos = last_ref_pos
+    aln.last_clone_pos = last_clone_pos
     aln.reference_len = ref_len
+    aln.ops = ops
     aln.is_truncated = not match_len == ref_len
     aln.has_gaps = aligned[1].isGapped()
-    aln.has_mismatches = not aligned[1].canMatch(aligned[0])
+    columns, aln.masked_positions = masked_mismatches(clone,
+                    str(aligned[0]), str(aligned[1]), first_clone_pos,
+                    mask_quality)
+    aligned_clone = aligned[0]
+    if len(columns) > 0:
+        # a masked base is as good as an N, which can match anything
+        bases = list(str(aligned_clone))
+        for i in columns: bases[i] = 'N'
+        aligned_clone = aligned_clone.__class__(''.join(bases))
+    aln.has_mismatches = not aligned[1].canMatch(aligned_clone)
     
     aln.Seqs[0].Name = clone.Name
     aln.Seqs[1].Name = reference.Name
     return aln
 
+def exact_alignment(clone, reference, clone_pos):
+    '''
+    returns the CloneAlignment for a reference that occurs exactly in the
+    clone, starting at clone_pos (e.g. as found by ExactMatcher), without
+    running Smith-Waterman
+    '''
+    ref_len = len(reference)
+    matched = str(clone)[clone_pos:clone_pos + ref_len]
+    if not matched == str(reference):
+        raise AlignmentError('Reference does not occur at position %d' %
+                             clone_pos)
+    aln = CloneAlignment((sequence_class(clone)(matched),
+                          sequence_class(reference)(str(reference))))
+    aln.first_ref_pos = 0
+    aln.first_clone_pos = clone_pos
+    aln.last_ref_pos = ref_len
+    aln.last_clone_pos = clone_pos + ref_len
+    aln.reference_len = ref_len
+    aln.ops = '%d=' % ref_len
+    aln.is_truncated = False
+    aln.has_gaps = False
+    aln.has_mismatches = False
+    aln.Seqs[0].Name = clone.Name
+    aln.Seqs[1].Name = reference.Name
+    return aln
+
+_EDIT_OPS_RE = re.compile('([0-9]+)([=XID])')
+
+def edit_ops(aligned_clone, aligned_ref, gap='-'):
+    '''
+    returns a compact, CIGAR-like description of an alignment of two gapped
+    strings of the same length, e.g. '20=1X3I15='
+        = clone and reference match
+        X clone and reference differ
+        I base in the clone but not in the reference
+        D base in the reference but not in the clone
+    '''
+    ops = []
+    for c, r in zip(aligned_clone, aligned_ref):
+        if c == gap: ops.append('D')
+        elif r == gap: ops.append('I')
+        elif c == r: ops.append('=')
+        else: ops.append('X')
+    return smithwaterman.encode_ops(ops)
+
+def parse_edit_ops(ops):
+    '''yields (count, op) for each run in a string from edit_ops'''
+    for count, op in _EDIT_OPS_RE.findall(ops):
+        yield int(count), op
+
+def alignment_from_record(clone, reference, record):
+    '''
+    rebuilds the CloneAlignment of clone and reference that is described by
+    record (see CloneAlignment.to_record) without aligning them again
+    '''
+    clone_str = str(clone)
+    ref_str = str(reference)
+    i = record['first_clone_pos']
+    j = record['first_ref_pos']
+    aligned_clone = []
+    aligned_ref = []
+    for count, op in parse_edit_ops(record['ops']):
+        if op == 'D':
+            aligned_clone.append('-' * count)
+        else:
+            aligned_clone.append(clone_str[i:i + count])
+            i += count
+        if op == 'I':
+            aligned_ref.append('-' * count)
+        else:
+            aligned_ref.append(ref_str[j:j + count])
+            j += count
+    aligned = (sequence_class(clone)(''.join(aligned_clone)),
+               sequence_class(reference)(''.join(aligned_ref)))
+    aln = CloneAlignment(aligned)
+    for field in CloneAlignment.RECORD_FIELDS:
+        # records cached before masked_positions existed do not have it
+        if field in record: setattr(aln, field, record[field])
+    aln.Seqs[0].Name = clone.Name
+    aln.Seqs[1].Name = reference.Name
+    return aln
+
 class CloneAlignment(Alignment):
     '''
     Class for representing two pycogent Sequence objects aligned
@@ -53,10 +200,43 @@ class CloneAlignment(Alignment):
         '''
         Constructor
         '''
+        if isinstance(data, tuple):
+            # cogent would take two 2-character sequences for a
+            # (name, sequence) pair, so give them cogent's default names
+            data = [('seq_%d' % i, seq) for i, seq in enumerate(data)]
         super(CloneAlignment, self).__init__(data, *args, **kwargs)
         self.Clone = self.Seqs[0]
         self.Reference = self.Seqs[1]
 
+    # the attributes saved by to_record
+    RECORD_FIELDS = ('first_clone_pos', 'last_clone_pos', 'first_ref_pos',
+                     'last_ref_pos', 'reference_len', 'is_truncated',
+                     'has_gaps', 'has_mismatches', 'ops', 'masked_positions')
+
+    # clone positions of low-quality mismatches that were ignored
+    masked_positions = ()
+
+    def to_record(self):
+        '''
+        returns a compact description of the alignment (a dict of positions,
+        flags and edit_ops) that alignment_from_record can turn back into a
+        CloneAlignment, given the original clone and reference
+        '''
+        record = {}
+        for field in self.RECORD_FIELDS:
+            record[field] = getattr(self, field)
+        return record
+
+    def score(self):
+        """
+        returns the Smith-Waterman score of the alignment, worked out from
+        its edit script (ops) with the scores of clonechecker.smithwaterman
+        """
+        op_scores = {'=': smithwaterman.MATCH, 'X': smithwaterman.MISMATCH,
+                     'I': smithwaterman.GAP, 'D': smithwaterman.GAP}
+        return sum(count * op_scores[op] for count, op in
+                   parse_edit_ops(self.ops))
+
     def is_match(self):
         """
         Returns true only if clone matched the full reference
@@ -0,0 +1,196 @@
+'''columnar BED tables backed by NumPy arrays'''
+import numpy
+from clonechecker.TabFile import BedFile
+
+def _gather(pool, offsets, idx):
+    '''
+    returns (pool, offsets) for the strings idx of a string pool, where string
+    i is pool[offsets[i]:offsets[i + 1]]
+    '''
+    lengths = (offsets[1:] - offsets[:-1])[idx]
+    new_offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=new_offsets[1:])
+    positions = numpy.arange(new_offsets[-1], dtype=numpy.int64) + \
+                numpy.repeat(offsets[:-1][idx] - new_offsets[:-1], lengths)
+    return pool[positions], new_offsets
+
+def _string_pool(strings):
+    '''returns (pool, offsets) holding a list of strings'''
+    offsets = numpy.zeros(len(strings) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(s) for s in strings], out=offsets[1:])
+    pool = numpy.frombuffer(''.join(strings), dtype=numpy.uint8)
+    return pool, offsets
+
+def _parse_ints(tokens):
+    '''returns an int64 array of the integers in a list of strings or numbers'''
+    if len(tokens) == 0 or not isinstance(tokens[0], str):
+        return numpy.asarray(tokens, dtype=numpy.int64)
+    # fromstring is much faster than astype, but it stops quietly at anything
+    # that isn't an integer, so it is only used for plain digits
+    if ''.join(tokens).isdigit():
+        return numpy.fromstring(' '.join(tokens), dtype=numpy.int64, sep=' ')
+    return numpy.array(tokens, dtype=str).astype(numpy.int64)
+
+class BedTable(object):
+    '''
+    Usage: table = BedTable.from_file('regions.bed')
+           table = table[table.lengths() > 100].sort()
+
+    BedTable holds the first four columns of a BED file as arrays rather
+    than one BedRow per line:
+        chroms       list of chromosome names
+        chrom_codes  int32 array, the index in chroms of each row's chromosome
+        starts       int64 array of chromStart
+        ends         int64 array of chromEnd
+    Names are kept together in a single string pool (missing names are '').
+
+    chroms is always sorted, so sorting by chrom_codes sorts by chromosome
+    name. Indexing with an integer returns (chrom, start, end, name).
+    Indexing with a slice, boolean mask or array of indices returns a new
+    BedTable, so rows can be filtered with vectorized comparisons.
+    '''
+
+    def __init__(self, chroms, chrom_codes, starts, ends, name_pool=None,
+                 name_offsets=None):
+        self.chroms = list(chroms)
+        self.chrom_codes = numpy.asarray(chrom_codes, dtype=numpy.int32)
+        self.starts = numpy.asarray(starts, dtype=numpy.int64)
+        self.ends = numpy.asarray(ends, dtype=numpy.int64)
+        if name_pool is None:
+            name_pool = numpy.zeros(0, dtype=numpy.uint8)
+            name_offsets = numpy.zeros(len(self.starts) + 1, dtype=numpy.int64)
+        self._name_pool = name_pool
+        self._name_offsets = name_offsets
+
+    @classmethod
+    def from_columns(cls, chroms, starts, ends, names=None):
+        '''makes a BedTable from lists of chromosome names, starts, ends and names'''
+        chrom_list, chrom_codes = numpy.unique(numpy.array(chroms, dtype=str),
+                                               return_inverse=True)
+        if names is None: pool, offsets = None, None
+        else: pool, offsets = _string_pool(names)
+        return cls(chrom_list.tolist(), chrom_codes,
+                   _parse_ints(starts), _parse_ints(ends),
+                   pool, offsets)
+
+    @classmethod
+    def from_file(cls, filename, **kwargs):
+        '''
+        reads a BED file (or anything else BedFile accepts, with the same
+        keyword arguments) in a single streaming pass, one chunk of lines at
+        a time
+        '''
+        kwargs.setdefault('streaming', True)
+        bf = BedFile(filename, **kwargs)
+        tables = [cls._parse_lines(lines) for lines in bf._iter_data_chunks()
+                  if len(lines) > 0]
+        if len(tables) == 0: return cls._parse_lines([])
+        return concatenate(tables)
+
+    @classmethod
+    def from_region(cls, filename, chrom, start, end, **kwargs):
+        '''
+        reads only the rows of a BGZF-compressed BED file that overlap
+        [start, end) on chrom (see BedFile.fetch)
+        '''
+        bf = BedFile(filename, **kwargs)
+        rows = list(bf.fetch(chrom, start, end))
+        bf.close()
+        return cls.from_columns([row.chrom() for row in rows],
+                                [row.chrom_start() for row in rows],
+                                [row.chrom_end() for row in rows],
+                                [row[3] if len(row) > 3 else '' for row in rows])
+
+    @classmethod
+    def _parse_lines(cls, lines):
+        '''parses a list of BED lines'''
+        tokens = ''.join(lines).split()
+        num_cols = len(tokens) // max(1, len(lines))
+        tab_counts = set([line.count('\t') for line in lines])
+        if len(lines) > 0 and num_cols >= 3 and tab_counts == set([num_cols - 1]) \
+                and len(tokens) == num_cols * len(lines):
+            # every line has the same number of fields
+            columns = [tokens[i::num_cols] for i in xrange(min(num_cols, 4))]
+        else:
+            rows = [line.split(None, 4) for line in lines]
+            columns = [[row[i] for row in rows] for i in xrange(3)]
+            columns.append([row[3] if len(row) > 3 else '' for row in rows])
+        if len(columns) < 4: columns.append([''] * len(lines))
+        return cls.from_columns(*columns)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, numpy.integer)):
+            return (self.chroms[self.chrom_codes[key]], int(self.starts[key]),
+                    int(self.ends[key]), self.name(key))
+        idx = numpy.arange(len(self))[key]
+        pool, offsets = _gather(self._name_pool, self._name_offsets, idx)
+        return BedTable(self.chroms, self.chrom_codes[idx], self.starts[idx],
+                        self.ends[idx], pool, offsets)
+
+    def __iter__(self):
+        for i in xrange(len(self)): yield self[i]
+
+    def name(self, i):
+        '''returns the name of row i'''
+        return self._name_pool[self._name_offsets[i]:
+                               self._name_offsets[i + 1]].tostring()
+
+    def names(self):
+        '''returns a list of the names of all rows'''
+        pool = self._name_pool.tostring()
+        offsets = self._name_offsets.tolist()
+        return [pool[offsets[i]:offsets[i + 1]] for i in xrange(len(self))]
+
+    def chrom_names(self):
+        '''returns an array with the chromosome name of each row'''
+        return numpy.array(self.chroms, dtype=str)[self.chrom_codes]
+
+    def chrom_mask(self, chroms):
+        '''returns a boolean array, True for rows on any of chroms'''
+        codes = [i for i, chrom in enumerate(self.chroms) if chrom in chroms]
+        return numpy.in1d(self.chrom_codes, codes)
+
+    def lengths(self):
+        '''returns an array of the length of each region'''
+        return self.ends - self.starts
+
+    def argsort(self):
+        '''returns the indices that sort the rows by chromosome, start and end'''
+        return numpy.lexsort((self.ends, self.starts, self.chrom_codes))
+
+    def sort(self):
+        '''returns a new BedTable sorted by chromosome, start and end'''
+        return self[self.argsort()]
+
+    def regions(self):
+        '''returns a list of (chrom, start, end) for every row'''
+        return zip(self.chrom_names().tolist(), self.starts.tolist(),
+                   self.ends.tolist())
+
+    def region_names(self):
+        '''returns a list of names like 'name (chr:start-end)' for every row'''
+        return ['%s (%s:%d-%d)' % (name, chrom, start, end) for
+                name, (chrom, start, end) in zip(self.names(), self.regions())]
+
+def concatenate(tables):
+    '''joins a list of BedTables into one, in order'''
+    chroms = sorted(set([chrom for table in tables for chrom in table.chroms]))
+    lookup = dict((chrom, i) for i, chrom in enumerate(chroms))
+    codes = []
+    pools = []
+    offsets = [numpy.zeros(1, dtype=numpy.int64)]
+    pool_size = 0
+    for table in tables:
+        recode = numpy.array([lookup[chrom] for chrom in table.chroms],
+                             dtype=numpy.int32)
+        codes.append(recode[table.chrom_codes])
+        pools.append(table._name_pool)
+        offsets.append(table._name_offsets[1:] + pool_size)
+        pool_size += len(table._name_pool)
+    return BedTable(chroms, numpy.concatenate(codes),
+                    numpy.concatenate([table.starts for table in tables]),
+                    numpy.concatenate([table.ends for table in tables]),
+                    numpy.concatenate(pools), numpy.concatenate(offsets))
@@ -0,0 +1,113 @@
+'''
+best-hit search: upper bounds on the Smith-Waterman score of clone/reference
+pairs, so that only the pairs that could still give the best alignment are
+aligned
+'''
+import numpy
+from clonechecker.packed import PackedSequence
+from clonechecker.smithwaterman import MATCH, MISMATCH, GAP
+
+_ACGT = numpy.zeros(256, dtype=bool)
+_ACGT[numpy.frombuffer('ACGTacgt', dtype=numpy.uint8)] = True
+
+def composition(seq):
+    '''returns the number of times each byte (0-255) occurs in seq'''
+    if isinstance(seq, PackedSequence): chars = seq.ascii()
+    else: chars = numpy.frombuffer(str(seq), dtype=numpy.uint8)
+    return numpy.bincount(chars, minlength=256)
+
+class ScoreBound(object):
+    '''
+    Usage: bound = ScoreBound(references, k=12)
+           bound.upper_bound(clone, ref_idx, hits)
+
+    ScoreBound gives an upper bound on the Smith-Waterman score of a query
+    and a reference (with the scores of clonechecker.smithwaterman), without
+    aligning them. The bound is the smallest of
+
+    - length: every column scores at most MATCH, and there are at most as
+      many match columns as bases in the shorter sequence
+    - composition: a match pairs a query base with an identical reference
+      base, so for each base there are at most as many matches as the
+      smaller of its counts in the query and the reference
+    - seed hits: the k-mer seeds that the query and the reference share (see
+      KmerIndex, which was built with the same k). An alignment with M
+      matches and E mismatches and gap columns has at most E + 1 runs of
+      matches, so it contains at least M - (E + 1) * (k - 1) shared
+      k-mers. With a score of S = M - E (for unit scores) and M at most the
+      composition bound C, few hits mean a low score:
+          S <= 1 + (hits + C * (k - 2)) / (k - 1)
+      This only holds for sequences of A, C, G and T, since KmerIndex does
+      not index k-mers with other characters, and for unit scores
+
+    Ungapped scores along the best seed diagonal would be tighter, but they
+    are not bounds: an indel lets the gapped score exceed every ungapped
+    diagonal. The diagonals are only used to order the search (see
+    search_best_hits). References are identified by their index in the list
+    that was given to the constructor.
+    '''
+
+    def __init__(self, references, k=None):
+        self.k = k
+        self._compositions = numpy.array([composition(ref) for
+                                          ref in references])
+        self._is_acgt = ~self._compositions[:, ~_ACGT].any(axis=1)
+        self._unit_scores = (MATCH, MISMATCH, GAP) == (1, -1, -1)
+
+    def upper_bounds(self, query, candidates):
+        '''
+        returns a list of upper bounds on the score of the query and each
+        of candidates, a list of (ref_idx, hits) (hits is the number of seed
+        hits of that reference, or None if they were not counted)
+        '''
+        query_composition = composition(query)
+        query_is_acgt = not query_composition[~_ACGT].any()
+        bounds = []
+        for ref_idx, hits in candidates:
+            matches = int(numpy.minimum(query_composition,
+                                        self._compositions[ref_idx]).sum())
+            bound = matches * MATCH
+            if hits is not None and self.k is not None and self.k >= 2 and \
+                    self._unit_scores and query_is_acgt and \
+                    self._is_acgt[ref_idx]:
+                k = self.k
+                bound = min(bound, 1 + (hits + matches * (k - 2)) // (k - 1))
+            bounds.append(bound)
+        return bounds
+
+    def upper_bound(self, query, ref_idx, hits=None):
+        '''returns an upper bound on the score of the query and a reference'''
+        return self.upper_bounds(query, [(ref_idx, hits)])[0]
+
+def search_best_hits(candidates, bounds, align):
+    '''
+    aligns candidates, best bound first, until no remaining candidate can
+    beat or tie the best score found so far
+
+    candidates is a list of (key, hits), where key is passed to align and
+    hits orders candidates with the same bound (more hits first), and bounds
+    are their upper bounds (see ScoreBound). align(key) returns
+    (score, result), or None if there is no alignment
+
+    returns (results, num_aligned, num_skipped), where results holds the
+    result of every candidate whose score is the best score, in the order
+    they were aligned
+    '''
+    order = sorted(xrange(len(candidates)),
+                   key=lambda i: (-bounds[i], -(candidates[i][1] or 0), i))
+    best_score = None
+    best = []
+    num_aligned = 0
+    for n, i in enumerate(order):
+        if best_score is not None and bounds[i] < best_score:
+            return best, num_aligned, len(order) - n
+        aligned = align(candidates[i][0])
+        num_aligned += 1
+        if aligned is None: continue
+        score, result = aligned
+        if best_score is None or score > best_score:
+            best_score = score
+            best = [result]
+        elif score == best_score:
+            best.append(result)
+    return best, num_aligned, 0
@@ -0,0 +1,450 @@
+'''
+BGZF (blocked gzip) files, as written by bgzip: reading, writing, random
+access by region and parallel decompression
+
+A BGZF file is a series of gzip members ("blocks") of at most 64kb each, so
+any block can be decompressed on its own. A position in the uncompressed data
+is given by a virtual offset: (offset of the block in the file << 16) |
+(offset within the decompressed block)
+'''
+import os
+import collections
+import struct
+import zlib
+import multiprocessing
+import numpy
+
+GZIP_MAGIC = '\x1f\x8b'
+BGZF_MAGIC = '\x1f\x8b\x08\x04'
+# bgzip puts at most this much uncompressed data in a block
+MAX_BLOCK_DATA = 0xff00
+EOF_BLOCK = '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' \
+            '\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+INDEX_SUFFIX = '.bgi.npz'
+# blocks are handed to decompression workers this many at a time
+_BLOCKS_PER_TASK = 16
+# and at most this many tasks per worker are waiting or running at a time
+_TASKS_PER_PROCESS = 2
+
+class BgzfError(IOError):
+    def __init__(self, msg):
+        super(BgzfError, self).__init__(msg)
+
+def is_bgzf(filename):
+    '''returns True if filename starts with a BGZF block'''
+    fh = open(filename, 'rb')
+    try:
+        header = fh.read(12)
+        if len(header) < 12 or not header.startswith(BGZF_MAGIC): return False
+        xlen = struct.unpack('<H', header[10:12])[0]
+        return _block_size(fh.read(xlen)) is not None
+    finally:
+        fh.close()
+
+def _block_size(extra):
+    '''returns the total size of a block from its gzip extra field, or None'''
+    pos = 0
+    while pos + 4 <= len(extra):
+        subfield_length = struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+        if extra[pos:pos + 2] == 'BC' and subfield_length == 2:
+            return struct.unpack('<H', extra[pos + 4:pos + 6])[0] + 1
+        pos += 4 + subfield_length
+    return None
+
+def _read_raw_block(fh):
+    '''
+    reads the next block and returns (offset, size, compressed data, crc,
+    uncompressed size), or None at the end of the file
+    '''
+    offset = fh.tell()
+    header = fh.read(12)
+    if len(header) == 0: return None
+    if len(header) < 12 or not header.startswith(BGZF_MAGIC):
+        raise BgzfError('Not a BGZF block at offset %d' % offset)
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = fh.read(xlen)
+    size = _block_size(extra)
+    if size is None:
+        raise BgzfError('Not a BGZF block at offset %d' % offset)
+    rest = fh.read(size - 12 - xlen)
+    if len(rest) < size - 12 - xlen:
+        raise BgzfError('Truncated BGZF block at offset %d' % offset)
+    crc, data_size = struct.unpack('<iI', rest[-8:])
+    return offset, size, rest[:-8], crc, data_size
+
+def _inflate(raw_block):
+    '''decompresses a block from _read_raw_block, returns (offset, size, data)'''
+    offset, size, cdata, crc, data_size = raw_block
+    data = zlib.decompress(cdata, -15)
+    if len(data) != data_size or zlib.crc32(data) != crc:
+        raise BgzfError('Corrupt BGZF block at offset %d' % offset)
+    return offset, size, data
+
+def _inflate_many(raw_blocks):
+    return [_inflate(raw_block) for raw_block in raw_blocks]
+
+class BgzfReader(object):
+    '''
+    Usage: fh = BgzfReader('regions.bed.gz', processes=4)
+           for line in fh: ...
+
+    BgzfReader is a read-only file object for BGZF files. tell() returns
+    and seek() takes virtual offsets.
+
+    With processes > 1, blocks are decompressed by a pool of worker
+    processes while the file is read from start to end, which speeds up
+    scans of whole files. Only a few blocks per worker are read ahead, and
+    seek() throws them away.
+    '''
+
+    def __init__(self, filename, processes=None):
+        self.name = filename
+        self.processes = processes
+        self._file_pointer = open(filename, 'rb')
+        self._pool = None
+        self._offset = None
+        self._data = ''
+        self.seek(0)
+
+    def _blocks(self):
+        '''yields (offset, size, data) for each block from the current offset'''
+        fh = self._file_pointer
+        if self.processes is None or self.processes < 2:
+            while True:
+                raw_block = _read_raw_block(fh)
+                if raw_block is None: return
+                yield _inflate(raw_block)
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(processes=self.processes)
+        # the raw blocks are read here, on the calling thread, and only a few
+        # tasks per worker are in flight, so the file is never read far
+        # ahead of the caller (and seek or close can happen at any time)
+        pending = collections.deque()
+        at_end = False
+        while True:
+            while not at_end and \
+                    len(pending) < _TASKS_PER_PROCESS * self.processes:
+                chunk = []
+                for i in xrange(_BLOCKS_PER_TASK):
+                    raw_block = _read_raw_block(fh)
+                    if raw_block is None:
+                        at_end = True
+                        break
+                    chunk.append(raw_block)
+                if len(chunk) == 0: break
+                pending.append(self._pool.apply_async(_inflate_many, (chunk,)))
+            if len(pending) == 0: return
+            # the tasks are collected in the order they were submitted, so
+            # the blocks stay in file order
+            for block in pending.popleft().get(): yield block
+
+    def _load_next(self):
+        '''moves on to the next block, returns False at the end of the file'''
+        for offset, size, data in self._block_iter:
+            self._offset, self._next_offset, self._data = offset, offset + size, data
+            self._pos = 0
+            if len(data) > 0: return True
+        self._offset = self._next_offset
+        self._data = ''
+        self._pos = 0
+        return False
+
+    def seek(self, virtual_offset, whence=0):
+        '''moves to a virtual offset (from tell)'''
+        if whence != 0: raise BgzfError('BGZF files only support absolute seeks')
+        offset, pos = virtual_offset >> 16, virtual_offset & 0xffff
+        if offset == self._offset and 0 < len(self._data) and \
+                pos <= len(self._data):
+            # still in the current block, which is kept rather than
+            # decompressed again (RegionIndex.fetch often seeks to the
+            # next run of lines in the same block)
+            self._file_pointer.seek(self._next_offset)
+            self._block_iter = self._blocks()
+            self._pos = pos
+            return
+        self._file_pointer.seek(offset)
+        self._block_iter = self._blocks()
+        self._offset = self._next_offset = offset
+        self._data = ''
+        self._pos = 0
+        if pos > 0:
+            self._load_next()
+            if self._offset != offset or pos > len(self._data):
+                raise BgzfError('Bad virtual offset %d' % virtual_offset)
+            self._pos = pos
+
+    def tell(self):
+        '''returns the virtual offset of the current position'''
+        if self._pos >= len(self._data): return self._next_offset << 16
+        return (self._offset << 16) | self._pos
+
+    def readline(self):
+        pieces = []
+        while True:
+            if self._pos >= len(self._data) and not self._load_next(): break
+            end = self._data.find('\n', self._pos)
+            if end == -1:
+                pieces.append(self._data[self._pos:])
+                self._pos = len(self._data)
+            else:
+                pieces.append(self._data[self._pos:end + 1])
+                self._pos = end + 1
+                break
+        return ''.join(pieces)
+
+    def readlines(self, sizehint=0):
+        '''
+        returns a list of lines, reading whole blocks at a time until about
+        sizehint bytes have been read (or the whole file, if sizehint is 0)
+        '''
+        pieces = []
+        size = 0
+        while sizehint <= 0 or size < sizehint:
+            if self._pos >= len(self._data) and not self._load_next(): break
+            piece = self._data[self._pos:]
+            pieces.append(piece)
+            size += len(piece)
+            self._pos = len(self._data)
+        if len(pieces) > 0 and not pieces[-1].endswith('\n'):
+            pieces.append(self.readline())
+        lines = ''.join(pieces).split('\n')
+        last = lines.pop()
+        lines = [line + '\n' for line in lines]
+        if last != '': lines.append(last)
+        return lines
+
+    def read(self, size=-1):
+        pieces = []
+        while size < 0 or size > 0:
+            if self._pos >= len(self._data) and not self._load_next(): break
+            if size < 0: end = len(self._data)
+            else: end = min(len(self._data), self._pos + size)
+            pieces.append(self._data[self._pos:end])
+            if size > 0: size -= end - self._pos
+            self._pos = end
+        return ''.join(pieces)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if line == '': return
+            yield line
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        self._file_pointer.close()
+
+class BgzfWriter(object):
+    '''
+    Usage: fh = BgzfWriter('regions.bed.gz')
+           fh.write(...)
+           fh.close()
+
+    writes a BGZF file that bgzip, tabix and samtools can read
+    '''
+
+    def __init__(self, filename, level=6):
+        self.name = filename
+        self.level = level
+        self._file_pointer = open(filename, 'wb')
+        self._buffer = []
+        self._buffer_size = 0
+
+    def write(self, s):
+        self._buffer.append(s)
+        self._buffer_size += len(s)
+        if self._buffer_size >= MAX_BLOCK_DATA: self._flush(complete=False)
+
+    def writelines(self, lines):
+        for line in lines: self.write(line)
+
+    def _flush(self, complete=True):
+        '''writes out full blocks (and the final partial block if complete)'''
+        data = ''.join(self._buffer)
+        start = 0
+        while len(data) - start >= MAX_BLOCK_DATA or \
+                (complete and start < len(data)):
+            self._write_block(data[start:start + MAX_BLOCK_DATA])
+            start += MAX_BLOCK_DATA
+        self._buffer = [data[start:]]
+        self._buffer_size = len(data) - start
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        header = BGZF_MAGIC + struct.pack('<IBBHBBHH', 0, 0, 0xff, 6,
+                                          ord('B'), ord('C'), 2,
+                                          len(cdata) + 25)
+        self._file_pointer.write(header + cdata +
+                                 struct.pack('<iI', zlib.crc32(data),
+                                             len(data)))
+
+    def close(self):
+        self._flush()
+        self._file_pointer.write(EOF_BLOCK)
+        self._file_pointer.close()
+
+def compress_file(input_filename, output_filename, level=6):
+    '''compresses a file to BGZF'''
+    fh = open(input_filename, 'rb')
+    out = BgzfWriter(output_filename, level=level)
+    try:
+        for block in iter(lambda: fh.read(MAX_BLOCK_DATA), ''): out.write(block)
+    finally:
+        fh.close()
+        out.close()
+
+def _interval(line):
+    '''returns (chrom, start, end) for a BED-like line, or None for comments'''
+    fields = line.split(None, 3)
+    if len(fields) < 3 or not fields[1].isdigit() or \
+            not fields[2].isdigit():
+        return None
+    return fields[0], int(fields[1]), int(fields[2])
+
+class RegionIndex(object):
+    '''
+    Usage: index = RegionIndex('regions.bed.gz')
+           for line in index.fetch('chr1', 1000, 2000): ...
+
+    RegionIndex finds the lines of a BGZF-compressed BED-like file (chrom,
+    start and end in the first three columns) that overlap a region,
+    decompressing only the blocks they are in.
+
+    The index has one entry per run of lines that start in the same block
+    and are on the same chromosome: its virtual offset, number of lines and
+    the smallest start and largest end of its intervals. The file does not
+    need to be sorted, but sorted files touch fewer blocks. Lines whose
+    second and third columns are not integers (comments, headers) are
+    skipped.
+
+    The index is saved next to the file (filename + '.bgi.npz'), if the
+    directory can be written to, and is rebuilt whenever the file is newer
+    than it.
+    '''
+
+    def __init__(self, filename):
+        self._filename = filename
+        index_filename = filename + INDEX_SUFFIX
+        if os.path.exists(index_filename) and \
+                os.path.getmtime(index_filename) >= os.path.getmtime(filename):
+            self._load(index_filename)
+        else:
+            self._build()
+            try:
+                self._save(index_filename)
+            except (IOError, OSError):
+                # e.g. a read-only directory: the index is only a shortcut
+                # for next time
+                pass
+        self._lookup = dict((chrom, i) for i, chrom in enumerate(self.chroms))
+        self._sort()
+        self._reader = None
+
+    def _build(self):
+        reader = BgzfReader(self._filename)
+        chroms = {}
+        codes, starts, ends, offsets, counts = [], [], [], [], []
+        group_key = None
+        try:
+            while True:
+                virtual_offset = reader.tell()
+                line = reader.readline()
+                if line == '': break
+                interval = _interval(line)
+                if interval is None:
+                    if group_key is not None: counts[-1] += 1
+                    continue
+                chrom, start, end = interval
+                key = (chrom, virtual_offset >> 16)
+                if key == group_key:
+                    counts[-1] += 1
+                    starts[-1] = min(starts[-1], start)
+                    ends[-1] = max(ends[-1], end)
+                    continue
+                group_key = key
+                codes.append(chroms.setdefault(chrom, len(chroms)))
+                starts.append(start)
+                ends.append(end)
+                offsets.append(virtual_offset)
+                counts.append(1)
+        finally:
+            reader.close()
+        self.chroms = sorted(chroms, key=chroms.get)
+        self.codes = numpy.array(codes, dtype=numpy.int32)
+        self.starts = numpy.array(starts, dtype=numpy.int64)
+        self.ends = numpy.array(ends, dtype=numpy.int64)
+        self.offsets = numpy.array(offsets, dtype=numpy.uint64)
+        self.counts = numpy.array(counts, dtype=numpy.int64)
+
+    def _save(self, index_filename):
+        fh = open(index_filename, 'wb')
+        try:
+            numpy.savez(fh, chroms=numpy.array(self.chroms, dtype=str),
+                        codes=self.codes, starts=self.starts, ends=self.ends,
+                        offsets=self.offsets, counts=self.counts)
+        finally:
+            fh.close()
+
+    def _sort(self):
+        '''
+        sorts the entries by chromosome and start and keeps a running maximum
+        of their ends, as IntervalIndex does, so that fetch can find the
+        entries that overlap a region with two binary searches
+        '''
+        order = numpy.lexsort((self.starts, self.codes))
+        self._order = order
+        self._sorted_starts = self.starts[order]
+        # _bounds[i]:_bounds[i + 1] are the entries on chromosome i
+        self._bounds = numpy.searchsorted(self.codes[order],
+                                          numpy.arange(len(self.chroms) + 1))
+        self._max_ends = numpy.zeros(len(order), dtype=numpy.int64)
+        for i in xrange(len(self.chroms)):
+            lo, hi = self._bounds[i], self._bounds[i + 1]
+            if lo == hi: continue
+            self._max_ends[lo:hi] = numpy.maximum.accumulate(
+                self.ends[order[lo:hi]])
+
+    def _entries(self, chrom, start, end):
+        '''returns the entries that may overlap [start, end), in file order'''
+        i = self._lookup[chrom]
+        lo, hi = self._bounds[i], self._bounds[i + 1]
+        first = lo + numpy.searchsorted(self._max_ends[lo:hi], start,
+                                        side='right')
+        last = lo + numpy.searchsorted(self._sorted_starts[lo:hi], end,
+                                       side='left')
+        entries = self._order[first:max(first, last)]
+        return numpy.sort(entries[self.ends[entries] > start])
+
+    def _load(self, index_filename):
+        data = numpy.load(index_filename)
+        try:
+            self.chroms = data['chroms'].tolist()
+            self.codes = data['codes']
+            self.starts = data['starts']
+            self.ends = data['ends']
+            self.offsets = data['offsets']
+            self.counts = data['counts']
+        finally:
+            data.close()
+
+    def fetch(self, chrom, start, end):
+        '''yields the lines with intervals that overlap [start, end) on chrom'''
+        if chrom not in self._lookup: return
+        entries = self._entries(chrom, start, end)
+        if self._reader is None: self._reader = BgzfReader(self._filename)
+        reader = self._reader
+        for i in entries:
+            reader.seek(int(self.offsets[i]))
+            for j in xrange(self.counts[i]):
+                line = reader.readline()
+                interval = _interval(line)
+                if interval is None: continue
+                if interval[0] == chrom and interval[1] < end and \
+                        interval[2] > start:
+                    yield line
+
+    def close(self):
+        if self._reader is not None: self._reader.close()
@@ -0,0 +1,131 @@
+'''content-addressed on-disk cache of alignment results'''
+import os
+import errno
+import hashlib
+import tempfile
+from clonechecker.quality import get_quality
+try:
+    from cPickle import dump, load, HIGHEST_PROTOCOL
+except ImportError:
+    from pickle import dump, load, HIGHEST_PROTOCOL
+from clonechecker.defaults import DEFAULT_MAX_SIZE
+
+def sequence_digest(seq):
+    '''
+    returns the sha1 hex digest of str(seq), and of its base qualities if it
+    has any (see clonechecker.quality)
+    '''
+    digest = hashlib.sha1(str(seq))
+    quality = get_quality(seq)
+    if quality is not None: digest.update(quality.tostring())
+    return digest.hexdigest()
+
+def alignment_key(clone_digest, ref_digest, reverse=False, *params):
+    '''
+    returns the cache key for aligning a clone to a reference
+
+    clone_digest and ref_digest come from sequence_digest (the clone digest is
+    always taken in the forward orientation), reverse is the orientation and
+    params are any aligner settings that can change the result
+    '''
+    parts = [clone_digest, ref_digest, 'rc' if reverse else 'fw']
+    parts.extend([str(x) for x in params])
+    return hashlib.sha1('\t'.join(parts)).hexdigest()
+
+class AlignmentCache(object):
+    '''
+    Usage: cache = AlignmentCache('path/to/dir', max_size=1024**3)
+
+    AlignmentCache maps keys from alignment_key to the compact alignment
+    records from CloneAlignment.to_record (or None, if there was no
+    alignment). It works like a dict:
+        if key in cache: record = cache[key]
+        cache[key] = record
+
+    Each record is stored in its own file under directory. Reading a record
+    updates its modification time, and evict() removes the least recently
+    used records until the cache is no larger than max_size bytes.
+
+    Several processes can read from the same cache. Writes are atomic, but
+    eviction should only be run by one process at a time.
+    '''
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory): os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[0:2], key)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def __getitem__(self, key):
+        path = self._path(key)
+        try:
+            fh = open(path, 'rb')
+        except IOError, e:
+            if e.errno == errno.ENOENT: raise KeyError(key)
+            raise
+        try:
+            record = load(fh)
+        finally:
+            fh.close()
+        # mark as recently used
+        os.utime(path, None)
+        return record
+
+    def __setitem__(self, key, record):
+        path = self._path(key)
+        subdir = os.path.dirname(path)
+        if not os.path.isdir(subdir):
+            try:
+                os.makedirs(subdir)
+            except OSError, e:
+                if e.errno != errno.EEXIST: raise
+        fd, tmp_path = tempfile.mkstemp(dir=subdir)
+        fh = os.fdopen(fd, 'wb')
+        try:
+            dump(record, fh, HIGHEST_PROTOCOL)
+        finally:
+            fh.close()
+        os.rename(tmp_path, path)
+
+    def _entries(self):
+        '''returns a list of (mtime, size, path) for every record'''
+        entries = []
+        for subdir in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subdir): continue
+            for name in os.listdir(subdir):
+                path = os.path.join(subdir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def size(self):
+        '''returns the total size of all records in bytes'''
+        return sum(size for mtime, size, path in self._entries())
+
+    def evict(self):
+        '''
+        removes least recently used records until the cache is no larger than
+        max_size. returns the number of records removed
+        '''
+        entries = self._entries()
+        total = sum(size for mtime, size, path in entries)
+        entries.sort()
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.max_size: break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
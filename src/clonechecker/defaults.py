@@ -0,0 +1,18 @@
+'''
+default settings that the command line needs before any sequences are read
+
+They are kept here, away from the modules that use them, so that
+checkmyclones.py can build its argument parser (and answer --help) without
+importing cogent or numpy.
+'''
+
+# Smith-Waterman implementations (see clonechecker.align)
+ALIGNERS = ['cogent', 'numpy']
+DEFAULT_ALIGNER = 'cogent'
+# the alignment cache is trimmed to this many bytes (see clonechecker.cache)
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+# Mott trimming keeps the stretch of bases whose error probabilities fall
+# furthest below this cutoff (see clonechecker.quality)
+DEFAULT_TRIM_CUTOFF = 0.05
+# mismatches at clone bases with a Phred score below this are ignored
+DEFAULT_MASK_QUALITY = 20
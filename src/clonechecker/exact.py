@@ -0,0 +1,69 @@
+'''finds references that occur exactly inside a clone, without any alignment'''
+from collections import defaultdict
+
+DEFAULT_PREFIX_LENGTH = 16
+
+class ExactMatcher(object):
+    '''
+    Usage: matcher = ExactMatcher(references)
+           hits = matcher.find(clone)
+
+    ExactMatcher finds the references that occur exactly in a clone. It is
+    not a general multi-pattern matcher (such as Aho-Corasick), just two
+    dicts:
+      - references of at least prefix_length (16) bases are filed under
+        their first prefix_length bases. The clone is scanned once, the
+        prefix_length bases at each position are looked up, and only the
+        references filed under them are compared with the clone there.
+      - shorter references (e.g. restriction sites or primers) are filed
+        under their whole sequence, in one dict per distinct length, and the
+        clone is scanned once more for each of those lengths.
+    So a clone costs one scan, plus one per short length, plus one string
+    comparison for each reference whose prefix occurs in it.
+
+    Matching is exact and case-sensitive, just like the scoring used by the
+    aligners, so a hit always means the alignment would be a full match.
+    References are identified by their index in the list that was given to
+    the constructor.
+    '''
+
+    def __init__(self, references, prefix_length=DEFAULT_PREFIX_LENGTH):
+        self._references = [str(ref) for ref in references]
+        self.prefix_length = prefix_length
+        self._prefixes = defaultdict(list)
+        # length -> {reference sequence: [ref_idx, ...]}
+        self._short = defaultdict(lambda: defaultdict(list))
+        for ref_idx, ref in enumerate(self._references):
+            if len(ref) == 0: continue
+            if len(ref) < prefix_length:
+                self._short[len(ref)][ref].append(ref_idx)
+            else:
+                self._prefixes[ref[0:prefix_length]].append(ref_idx)
+
+    def __len__(self):
+        '''returns the number of references'''
+        return len(self._references)
+
+    def find(self, query):
+        '''
+        returns a dict of ref_idx -> position of the first occurrence of that
+        reference in query, for every reference that occurs in query
+        '''
+        s = str(query)
+        q = self.prefix_length
+        prefixes = self._prefixes
+        references = self._references
+        hits = {}
+        for pos in xrange(len(s) - q + 1):
+            candidates = prefixes.get(s[pos:pos + q])
+            if candidates is None: continue
+            for ref_idx in candidates:
+                if ref_idx in hits: continue
+                if s.startswith(references[ref_idx], pos): hits[ref_idx] = pos
+        for length, patterns in self._short.iteritems():
+            for pos in xrange(len(s) - length + 1):
+                candidates = patterns.get(s[pos:pos + length])
+                if candidates is None: continue
+                for ref_idx in candidates:
+                    if ref_idx not in hits: hits[ref_idx] = pos
+        return hits
@@ -0,0 +1,119 @@
+'''FASTA files with a samtools-style .fai index, for random access by name'''
+import os
+import tempfile
+
+DEFAULT_LINE_LENGTH = 60
+
+def index_path(filename):
+    '''returns the path of the index for a FASTA file'''
+    return filename + '.fai'
+
+def _write_atomically(filename, write):
+    '''calls write(file_handle) on a temporary file, then renames it'''
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    # mkstemp makes the file private (0600), give it the permissions that
+    # open would have
+    umask = os.umask(0)
+    os.umask(umask)
+    os.fchmod(fd, 0666 & ~umask)
+    fh = os.fdopen(fd, 'w')
+    try:
+        write(fh)
+    finally:
+        fh.close()
+    os.rename(tmp_path, filename)
+
+def write_indexed_fasta(filename, records, line_length=DEFAULT_LINE_LENGTH):
+    '''
+    writes (name, sequence) records to filename and writes its index
+
+    the index is written last, so a FASTA file only has an index once it is
+    complete. each index line is name, length, offset of the first base,
+    bases per line and bytes per line, separated by tabs
+    '''
+    index = []
+    def write_records(fh):
+        offset = 0
+        for name, seq in records:
+            seq = str(seq)
+            header = '>%s\n' % name
+            fh.write(header)
+            offset += len(header)
+            index.append((name, len(seq), offset, line_length,
+                          line_length + 1))
+            for start in xrange(0, len(seq), line_length):
+                line = seq[start:start + line_length] + '\n'
+                fh.write(line)
+                offset += len(line)
+    def write_index(fh):
+        for row in index:
+            fh.write('\t'.join([str(x) for x in row]) + '\n')
+    _write_atomically(filename, write_records)
+    _write_atomically(index_path(filename), write_index)
+
+class IndexedFasta(object):
+    '''
+    Usage: fasta = IndexedFasta('regions.fa')
+           seq = fasta['name']
+           part = fasta.fetch('name', 100, 200)
+
+    IndexedFasta reads only the index when it is opened. Sequences are read
+    from the file when they are asked for, by seeking straight to them.
+    Names are the whole FASTA header line (not just its first word), in the
+    order of the file.
+    '''
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._index = {}
+        self._names = []
+        fh = open(index_path(filename), 'r')
+        try:
+            for line in fh:
+                name, length, offset, line_bases, line_width = \
+                    line.rstrip('\n').split('\t')
+                self._names.append(name)
+                self._index[name] = (int(length), int(offset),
+                                     int(line_bases), int(line_width))
+        finally:
+            fh.close()
+        self._file_pointer = open(filename, 'rb')
+
+    def close(self):
+        self._file_pointer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, name):
+        return self.fetch(name)
+
+    def names(self):
+        '''returns the names of the sequences, in file order'''
+        return list(self._names)
+
+    def sequence_size(self, name):
+        '''returns the length of a sequence'''
+        return self._index[name][0]
+
+    def fetch(self, name, start=0, end=None):
+        '''returns bases [start, end) of a sequence as a string'''
+        length, offset, line_bases, line_width = self._index[name]
+        if end is None or end > length: end = length
+        start = max(0, start)
+        if start >= end: return ''
+        first = offset + (start // line_bases) * line_width + start % line_bases
+        last = offset + ((end - 1) // line_bases) * line_width + \
+               (end - 1) % line_bases + 1
+        self._file_pointer.seek(first)
+        return self._file_pointer.read(last - first).replace('\n', '')
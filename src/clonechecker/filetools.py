@@ -3,69 +3,356 @@ Created on Aug 20, 2011
 
 @author: ben
 '''
-from cogent.parse.record import FileFormatError
-from cogent import LoadSeqs, DNA
+from cogent import DNA
+from cogent.parse.fasta import MinimalFastaParser
+from cogent.parse.fastq import MinimalFastqParser
+import os
 import os.path
-from twobitreader import TwoBitFile
-from clonechecker.TabFile import BedFile
+import time
+import itertools
+import multiprocessing
+from collections import namedtuple
+from glob import glob
+import hashlib
+import numpy
+from clonechecker.twobit import TwoBitGenome
+from clonechecker.fasta import IndexedFasta, write_indexed_fasta, index_path
+from clonechecker.bedtable import BedTable
+from clonechecker.packed import PackedSequence
+from clonechecker.quality import phred_scores, parse_qual_values, QUALITY_KEY
 import platform
 from errno import ENOENT
+try:
+    from os import scandir
+except ImportError:
+    # the backport, for python < 3.5
+    try: from scandir import scandir
+    except ImportError: scandir = None
 
 
+SEQ_FORMATS = ['fasta', 'fastq', 'plain']
+# Phred scores for a FASTA or plain-text file foo.seq are read from foo.qual
+QUAL_EXTENSION = '.qual'
+
+def sniff_format(text):
+    """
+    returns the format of the sequence file text, 'fasta' or 'fastq' if the
+    first character that is not whitespace is '>' or '@', or 'plain'
+    """
+    stripped = text.lstrip()
+    if stripped.startswith('>'): return 'fasta'
+    elif stripped.startswith('@'): return 'fastq'
+    else: return 'plain'
+
+def parse_seqs(text, name, format=None):
+    """
+    parses the contents of a sequence file, in format (default: sniffed with
+    sniff_format)
+    
+    returns a list of (name, sequence, quality), where quality is an array of
+    Phred scores for FASTQ and None otherwise. a plain-text file is one
+    sequence, called name, with all whitespace removed
+    """
+    if format is None: format = sniff_format(text)
+    lines = text.splitlines()
+    if format == 'fasta':
+        return [(label, seq, None) for label, seq in MinimalFastaParser(lines)]
+    elif format == 'fastq':
+        return [(label, seq, phred_scores(qual)) for label, seq, qual in
+                MinimalFastqParser(lines, strict=False)]
+    elif format == 'plain':
+        return [(name, ''.join(text.split()), None)]
+    else:
+        raise ValueError('format must be one of %s' % ', '.join(SEQ_FORMATS))
+
+def read_qual_file(foo):
+    """
+    reads a .qual file (FASTA-style records of whitespace-separated Phred
+    scores, as written by phred) and returns a list of (name, quality)
+    """
+    fh = open(foo, 'rU')
+    try: text = fh.read()
+    finally: fh.close()
+    if sniff_format(text) == 'plain':
+        return [(os.path.basename(foo), parse_qual_values(text))]
+    records = []
+    for record in text.split('>')[1:]:
+        label, values = (record + '\n').split('\n', 1)
+        records.append((label.strip(), parse_qual_values(values)))
+    return records
+
+def read_seq_records(foo):
+    """
+    reads a FASTA, FASTQ or plain-text file once and returns a list of
+    (name, sequence, quality) (see parse_seqs)
+    
+    the qualities of a FASTA or plain-text file are taken from a .qual file
+    next to it with the same name (see QUAL_EXTENSION), if there is one and
+    it has a quality for every base
+    """
+    fh = open(foo, 'rU')
+    try: text = fh.read()
+    finally: fh.close()
+    records = parse_seqs(text, os.path.basename(foo))
+    qual_path = os.path.splitext(foo)[0] + QUAL_EXTENSION
+    if len(records) == 0 or records[0][2] is not None or \
+            not os.path.isfile(qual_path):
+        return records
+    quals = read_qual_file(qual_path)
+    if len(quals) == len(records) and \
+            all(len(seq) == len(qual) for (name, seq, none), (qual_name, qual)
+                in zip(records, quals)):
+        records = [(name, seq, qual) for (name, seq, none), (qual_name, qual)
+                   in zip(records, quals)]
+    return records
+
+def _make_seq(moltype, seq, name, quality, packed=False):
+    """
+    makes a Seq (or a PackedSequence, if packed is True, or if seq already is
+    one), keeping its Phred scores (if any) in Info
+    """
+    if isinstance(seq, PackedSequence):
+        seq.Name = name
+        return seq
+    if packed: return PackedSequence.from_string(seq, Name=name, quality=quality)
+    if quality is None: return moltype.makeSequence(seq, Name=name)
+    return moltype.makeSequence(seq, Name=name, Info={QUALITY_KEY: quality})
+
 def load_one_seq(foo, moltype=DNA):
     """
-    load one sequence from path foo if it is a FASTQ or plain-text file
+    load one sequence from path foo if it is a FASTA, FASTQ or plain-text file
     """   
-    try:
-        seqs = LoadSeqs(foo, aligned=False, format='fasta', moltype=moltype)
-    except FileFormatError:
-        fh = open(foo, 'rU')
-        s = fh.read().strip()
-        name = os.path.basename(foo)
-        seqs = LoadSeqs(data=[(name, s)], aligned=False, moltype=moltype)
-    return seqs.Seqs[0]
+    return load_seqs(foo, moltype=moltype)[0]
 
 def load_seqs(foo, moltype=DNA):
     """
-    load one or more sequences from path foo if it is a FASTQ or plain-text file
+    load one or more sequences from path foo if it is a FASTA, FASTQ or
+    plain-text file
     
-    returns a list of Seq objects
+    returns a list of Seq objects, with the Phred scores of FASTQ reads in
+    seq.Info['quality']
     """   
+    return [_make_seq(moltype, seq, name, quality) for
+            name, seq, quality in read_seq_records(foo)]
+
+def _list_dir(path):
+    """
+    returns the sorted paths of the files and of the directories in path,
+    leaving out hidden entries (as glob does) and .qual files
+    """
+    files = []
+    dirs = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.name.startswith('.') or \
+                    entry.name.endswith(QUAL_EXTENSION): continue
+            if entry.is_dir(): dirs.append(entry.path)
+            elif entry.is_file(): files.append(entry.path)
+    else:
+        for name in os.listdir(path):
+            if name.startswith('.') or name.endswith(QUAL_EXTENSION): continue
+            entry_path = os.path.join(path, name)
+            if os.path.isdir(entry_path): dirs.append(entry_path)
+            elif os.path.isfile(entry_path): files.append(entry_path)
+    return sorted(files), sorted(dirs)
+
+def _walk_seq_files(path, recursive):
+    """yields the files in directory path (and its subdirectories)"""
+    files, dirs = _list_dir(path)
+    for foo in files: yield foo
+    if recursive:
+        for boo in dirs:
+            for foo in _walk_seq_files(boo, recursive): yield foo
+
+def find_seq_files(paths, recursive=True):
+    """
+    yields the files that match a path or list of paths, in a stable order
+    
+    wildcards are allowed. if recursive is True, directories are searched
+    recursively, one directory listing each. files come in the order of the
+    paths, then in sorted order. .qual files are left out (see
+    read_seq_records)
+    """
+    if isinstance(paths, basestring): paths = [paths]
+    for glob_path in paths:
+        for foo in sorted(glob(glob_path)):
+            if os.path.isfile(foo):
+                if not foo.endswith(QUAL_EXTENSION): yield foo
+            elif recursive and os.path.isdir(foo):
+                for boo in _walk_seq_files(foo, recursive): yield boo
+
+def _read_seq_file(foo, packed=False):
+    """
+    load_seq_files worker: returns (foo, bytes read, records, error), where
+    error is None unless the file could not be read. if packed is True, the
+    sequences in records are PackedSequences, which are much smaller to send
+    back from a worker process
+    """
     try:
-        seqs = LoadSeqs(foo, aligned=False, format='fasta', moltype=moltype)
-    except FileFormatError:
-        fh = open(foo, 'rU')
-        s = fh.read().strip()
-        name = os.path.basename(foo)
-        seqs = LoadSeqs(data=[(name, s)], aligned=False, moltype=moltype)
-    return [seq for seq in seqs.Seqs]
-
-def write_to_fasta(file_handle, sequence, name=''):
-    """write a record to a fasta file without closing it"""
-    # write first line
-    file_handle.write('>{!s}\n'.format(name))
-    # write sequence
-    num_lines = (len(sequence)+ 59 ) / 60
-    for j in xrange(num_lines):
-        start = 0 + j*60
-        end = 60 + j*60
-        file_handle.write('{!s}\n'.format(sequence[start:end]))
-    return
-
-def read_bed_file(foo, moltype=DNA, genome=None, write_fasta=True):
-    """read in all regions from a BED file"""
-    t = TwoBitFile(genome)
-    bf = BedFile(foo)
+        size = os.path.getsize(foo)
+        records = read_seq_records(foo)
+        if packed:
+            records = [(name, PackedSequence.from_string(seq, Name=name,
+                                                         quality=quality),
+                        quality) for name, seq, quality in records]
+        return foo, size, records, None
+    except Exception, e:
+        return foo, 0, [], e
+
+def _read_packed_seq_file(foo):
+    """load_seq_files worker for packed sequences (see _read_seq_file)"""
+    return _read_seq_file(foo, packed=True)
+
+class LoadStats(namedtuple('LoadStats', 'files bytes seconds failed')):
+    """
+    what load_seq_files did: the number of files and bytes read, how long it
+    took and the list of files that could not be read
+    """
+
+    def files_per_second(self):
+        return self.files / max(self.seconds, 1e-9)
+
+    def bytes_per_second(self):
+        return self.bytes / max(self.seconds, 1e-9)
+
+    def __str__(self):
+        return '%d files (%.1f MB) in %.2f s: %.0f files/s, %.1f MB/s' % \
+            (self.files, self.bytes / 1e6, self.seconds,
+             self.files_per_second(), self.bytes_per_second() / 1e6)
+
+def load_seq_files(paths, moltype=DNA, recursive=True, processes=None,
+                   packed=False):
+    """
+    load all sequences in the files that match a path or list of paths (see
+    find_seq_files), each named 'name (path)'
+    
+    the format of each file is sniffed from its contents, which are read
+    once. with processes > 1, files are read and parsed by a pool of
+    processes. sequences are returned in the same order either way
+    
+    if packed is True, the sequences are PackedSequences (DNA only)
+    
+    returns (list of Seq objects, LoadStats)
+    """
+    start = time.time()
+    files = list(find_seq_files(paths, recursive=recursive))
+    if packed: read_file = _read_packed_seq_file
+    else: read_file = _read_seq_file
+    pool = None
+    if processes is not None and processes > 1 and len(files) > 1:
+        pool = multiprocessing.Pool(processes=processes)
+        chunksize = max(1, min(64, len(files) // (4 * processes)))
+        # imap keeps the files in order
+        results = pool.imap(read_file, files, chunksize)
+    else:
+        results = itertools.imap(read_file, files)
     seqs = []
-    if write_fasta: fasta_output = open(os.path.basename(foo) + '.fa', 'w')
-    for row in bf:
-        chr, start, end = row.chrom(), row.chrom_start(), row.chrom_end()
-        region_seq = t[chr][long(start):long(end)]
-        region_name = row.name() + ' (%s:%s-%s)' % (chr, start, end)
-        if write_fasta: write_to_fasta(fasta_output, region_seq, name=region_name)
-        s = LoadSeqs(data=[(region_name, region_seq)], aligned=False,
-                     moltype=moltype)
-        seqs.append(s.Seqs[0])
+    failed = []
+    total_bytes = 0
+    try:
+        for foo, size, records, error in results:
+            try:
+                if error is not None: raise error
+                file_seqs = [_make_seq(moltype, seq, '%s (%s)' % (name, foo),
+                                       quality)
+                             for name, seq, quality in records]
+            except Exception:
+                failed.append(foo)
+                continue
+            total_bytes += size
+            seqs.extend(file_seqs)
+        if pool is not None: pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    stats = LoadStats(len(files) - len(failed), total_bytes,
+                      time.time() - start, failed)
+    return seqs, stats
+
+def bed_cache_path(foo, genome, cache_dir=None):
+    """
+    returns the path of the indexed FASTA file that caches the regions of BED
+    file foo fetched from genome
+    
+    the name includes a hash of the contents of the BED file and of the path
+    and modification time of the genome, so editing either one starts a new
+    cache file. cache files are kept in cache_dir (default: the current
+    directory)
+    """
+    digest = hashlib.sha1()
+    fh = open(foo, 'rb')
+    try:
+        for block in iter(lambda: fh.read(1024 * 1024), ''): digest.update(block)
+    finally:
+        fh.close()
+    digest.update('\t%s\t%d' % (os.path.abspath(genome),
+                                 os.path.getmtime(genome)))
+    if cache_dir is None: cache_dir = os.curdir
+    return os.path.join(cache_dir, '%s.%s.fa' % (os.path.basename(foo),
+                                                 digest.hexdigest()[0:16]))
+
+def fetch_bed_regions(foo, genome, select=None):
+    """
+    fetch all regions from a BED file from a .2bit genome in one batch
+    (see TwoBitGenome.fetch_regions)
+    
+    if select is given, only regions for which select(name) is True are
+    fetched
+    
+    returns a list of (name, sequence), with names like 'name (chr:start-end)'
+    """
+    table = BedTable.from_file(foo)
+    names = table.region_names()
+    if select is not None:
+        keep = numpy.array([select(name) for name in names], dtype=bool)
+        table = table[keep]
+        names = [name for name, k in zip(names, keep) if k]
+    t = TwoBitGenome(genome)
+    try: region_seqs = t.fetch_regions(table.regions())
+    finally: t.close()
+    return zip(names, region_seqs)
+
+def read_bed_file(foo, moltype=DNA, genome=None, write_fasta=True,
+                  cache_dir=None, select=None, overlapping=None, packed=False):
+    """
+    read in all regions from a BED file
+    
+    if write_fasta is True, the regions are kept in an indexed FASTA file
+    (see bed_cache_path), and later calls with the same BED file and genome
+    read them from there instead of from the genome
+    
+    if select is given, only regions for which select(name) is True are
+    returned (and, when they come from the cache, read at all). likewise, if
+    overlapping is an IntervalIndex, only regions that overlap one of its
+    intervals are returned
+    
+    if packed is True, the regions are returned as PackedSequences
+    """
+    if select is None: select = lambda name: True
+    if overlapping is not None:
+        table = BedTable.from_file(foo)
+        keep = overlapping.overlaps_any(table)
+        overlapping_names = set([name for name, k in
+                                 zip(table.region_names(), keep) if k])
+        name_selected = select
+        select = lambda name: name in overlapping_names and name_selected(name)
+    if not write_fasta:
+        return [_make_seq(moltype, region_seq, region_name, None, packed) for
+                region_name, region_seq in fetch_bed_regions(foo, genome,
+                                                             select)]
+    fasta_path = bed_cache_path(foo, genome, cache_dir)
+    if not os.path.exists(index_path(fasta_path)):
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        write_indexed_fasta(fasta_path, fetch_bed_regions(foo, genome))
+    fasta = IndexedFasta(fasta_path)
+    try:
+        seqs = [_make_seq(moltype, fasta[region_name], region_name, None,
+                          packed) for
+                region_name in fasta.names() if select(region_name)]
+    finally:
+        fasta.close()
     return seqs
 
 def find_2bit_file(ref_genome, path_to_gbdb=None):
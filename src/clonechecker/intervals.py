@@ -0,0 +1,210 @@
+'''
+interval index over BED regions for overlap, nearest-neighbour and
+containment queries
+'''
+import os
+import numpy
+from clonechecker.bedtable import BedTable
+
+INDEX_SUFFIX = '.iix.npz'
+
+class IntervalIndex(object):
+    '''
+    Usage: index = IntervalIndex.for_file('loci.bed')
+           rows = index.overlap('chr1', 1000, 2000)
+           mask = index.overlaps_any(other_table)
+
+    IntervalIndex sorts the rows of a BedTable by chromosome and start and
+    keeps, for every chromosome, the sorted starts, the ends in the same
+    order and a running maximum of the ends. The intervals that overlap
+    [start, end) are then the ones before the first start >= end that come
+    after the last running maximum <= start, so each query takes two binary
+    searches plus the hits.
+
+    Intervals are half-open, as in BED. Queries return row numbers in the
+    BedTable the index was built from (index.table), and the *_any and
+    nearest methods answer a whole BedTable (or arrays) of queries at once.
+
+    save and load keep the index (and its table) in a .npz file, and
+    for_file keeps one next to a BED file, rebuilding it whenever the BED
+    file is newer.
+    '''
+
+    def __init__(self, table):
+        self.table = table
+        order = numpy.lexsort((table.ends, table.starts, table.chrom_codes))
+        codes = table.chrom_codes[order]
+        self._rows = order
+        self._starts = table.starts[order]
+        self._ends = table.ends[order]
+        # _bounds[i]:_bounds[i + 1] are the rows on chromosome i
+        self._bounds = numpy.searchsorted(codes,
+                                          numpy.arange(len(table.chroms) + 1))
+        self._lookup = dict((chrom, i) for i, chrom in enumerate(table.chroms))
+        self._max_ends = numpy.zeros(len(order), dtype=numpy.int64)
+        self._max_rows = numpy.zeros(len(order), dtype=numpy.int64)
+        for i in xrange(len(table.chroms)):
+            lo, hi = self._bounds[i], self._bounds[i + 1]
+            if lo == hi: continue
+            ends = self._ends[lo:hi]
+            max_ends = numpy.maximum.accumulate(ends)
+            self._max_ends[lo:hi] = max_ends
+            # position of the interval that gives each running maximum
+            is_new_max = numpy.concatenate(([True], ends[1:] > max_ends[:-1]))
+            self._max_rows[lo:hi] = numpy.maximum.accumulate(
+                numpy.where(is_new_max, numpy.arange(hi - lo), 0)) + lo
+
+    def __len__(self):
+        return len(self._rows)
+
+    @classmethod
+    def from_file(cls, filename, **kwargs):
+        '''builds an index over a BED file (see BedTable.from_file)'''
+        return cls(BedTable.from_file(filename, **kwargs))
+
+    @classmethod
+    def for_file(cls, filename, **kwargs):
+        '''
+        loads the index saved next to a BED file, or builds and saves it if
+        it is missing or older than the BED file
+        '''
+        index_filename = filename + INDEX_SUFFIX
+        if os.path.exists(index_filename) and \
+                os.path.getmtime(index_filename) >= os.path.getmtime(filename):
+            return cls.load(index_filename)
+        index = cls.from_file(filename, **kwargs)
+        try:
+            index.save(index_filename)
+        except (IOError, OSError):
+            # the index is only a shortcut for next time
+            pass
+        return index
+
+    def save(self, filename):
+        '''saves the table to a .npz file (the index is rebuilt by load)'''
+        table = self.table
+        fh = open(filename, 'wb')
+        try:
+            numpy.savez(fh, chroms=numpy.array(table.chroms, dtype=str),
+                        chrom_codes=table.chrom_codes, starts=table.starts,
+                        ends=table.ends, name_pool=table._name_pool,
+                        name_offsets=table._name_offsets)
+        finally:
+            fh.close()
+
+    @classmethod
+    def load(cls, filename):
+        '''loads an index saved with save'''
+        data = numpy.load(filename)
+        try:
+            table = BedTable(data['chroms'].tolist(), data['chrom_codes'],
+                             data['starts'], data['ends'], data['name_pool'],
+                             data['name_offsets'])
+        finally:
+            data.close()
+        return cls(table)
+
+    def _chrom_range(self, chrom):
+        '''returns the (lo, hi) positions of a chromosome's intervals'''
+        i = self._lookup.get(chrom)
+        if i is None: return 0, 0
+        return self._bounds[i], self._bounds[i + 1]
+
+    def overlap(self, chrom, start, end):
+        '''returns the rows of the intervals that overlap [start, end)'''
+        lo, hi = self._chrom_range(chrom)
+        first = lo + numpy.searchsorted(self._max_ends[lo:hi], start,
+                                        side='right')
+        last = lo + numpy.searchsorted(self._starts[lo:hi], end, side='left')
+        hits = numpy.arange(first, max(first, last))
+        hits = hits[self._ends[hits] > start]
+        return numpy.sort(self._rows[hits])
+
+    def containing(self, chrom, start, end):
+        '''returns the rows of the intervals that contain all of [start, end)'''
+        hits = self.overlap(chrom, start, end)
+        table = self.table
+        return hits[(table.starts[hits] <= start) & (table.ends[hits] >= end)]
+
+    def contained(self, chrom, start, end):
+        '''returns the rows of the intervals that lie within [start, end)'''
+        lo, hi = self._chrom_range(chrom)
+        first = lo + numpy.searchsorted(self._starts[lo:hi], start,
+                                        side='left')
+        last = lo + numpy.searchsorted(self._starts[lo:hi], end, side='left')
+        hits = numpy.arange(first, max(first, last))
+        hits = hits[self._ends[hits] <= end]
+        return numpy.sort(self._rows[hits])
+
+    def _queries(self, table):
+        '''yields (query rows, lo, hi) for each chromosome of a BedTable'''
+        for code, chrom in enumerate(table.chroms):
+            rows = numpy.flatnonzero(table.chrom_codes == code)
+            if len(rows) == 0: continue
+            lo, hi = self._chrom_range(chrom)
+            yield rows, lo, hi
+
+    def overlaps_any(self, table):
+        '''
+        returns a boolean array, True for each row of a BedTable that overlaps
+        at least one interval in the index
+        '''
+        result = numpy.zeros(len(table), dtype=bool)
+        for rows, lo, hi in self._queries(table):
+            if lo == hi: continue
+            # the last interval that starts before each query ends
+            last = numpy.searchsorted(self._starts[lo:hi], table.ends[rows],
+                                      side='left') - 1
+            has_before = last >= 0
+            max_ends = self._max_ends[lo:hi][numpy.maximum(last, 0)]
+            result[rows] = has_before & (max_ends > table.starts[rows])
+        return result
+
+    def contained_in_any(self, table):
+        '''
+        returns a boolean array, True for each row of a BedTable that lies
+        entirely within one interval in the index
+        '''
+        result = numpy.zeros(len(table), dtype=bool)
+        for rows, lo, hi in self._queries(table):
+            if lo == hi: continue
+            # of the intervals that start at or before the query, the one
+            # that reaches furthest
+            last = numpy.searchsorted(self._starts[lo:hi], table.starts[rows],
+                                      side='right') - 1
+            has_before = last >= 0
+            max_ends = self._max_ends[lo:hi][numpy.maximum(last, 0)]
+            result[rows] = has_before & (max_ends >= table.ends[rows])
+        return result
+
+    def nearest(self, chroms, positions):
+        '''
+        for each chromosome and position, returns (rows, distances), the row
+        of the nearest interval (one that overlaps the position, if any) and
+        its distance in bases, or -1 and -1 if the chromosome has no
+        intervals. ties go to the interval on the left
+        '''
+        chroms = numpy.asarray(chroms, dtype=str)
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        rows = numpy.zeros(len(positions), dtype=numpy.int64) - 1
+        distances = numpy.zeros(len(positions), dtype=numpy.int64) - 1
+        for chrom in numpy.unique(chroms):
+            query = numpy.flatnonzero(chroms == chrom)
+            lo, hi = self._chrom_range(chrom)
+            if lo == hi: continue
+            pos = positions[query]
+            # intervals that start at or before pos (left) and after it (right)
+            split = numpy.searchsorted(self._starts[lo:hi], pos, side='right')
+            left = numpy.maximum(split - 1, 0) + lo
+            right = numpy.minimum(split, hi - lo - 1) + lo
+            left_distance = numpy.where(split > 0,
+                    numpy.maximum(pos - self._max_ends[left] + 1, 0),
+                    numpy.iinfo(numpy.int64).max)
+            right_distance = numpy.where(split < hi - lo,
+                    self._starts[right] - pos, numpy.iinfo(numpy.int64).max)
+            use_left = left_distance <= right_distance
+            rows[query] = self._rows[numpy.where(use_left,
+                                                 self._max_rows[left], right)]
+            distances[query] = numpy.where(use_left, left_distance,
+                                           right_distance)
+        return rows, distances
@@ -0,0 +1,205 @@
+'''k-mer seed index for choosing which clone/reference pairs are worth aligning'''
+from collections import defaultdict
+from string import maketrans
+
+DEFAULT_K = 12
+DEFAULT_MIN_SEED_HITS = 2
+# a strand wins the orientation vote for a reference if it has at least this
+# many times as many seed hits as the other strand
+DEFAULT_ORIENTATION_RATIO = 2.0
+
+_COMPLEMENT = maketrans('ACGT', 'TGCA')
+
+class KmerIndex(object):
+    '''
+    Usage: index = KmerIndex(references, k=12)
+
+    KmerIndex records every k-mer of every reference sequence (anything that
+    str() turns into a sequence, e.g. cogent Sequence objects) along with its
+    position, so that a clone can be compared to all references in a single
+    pass over the clone.
+
+    k-mers that contain anything other than A, C, G or T are not indexed.
+    References are identified by their index in the list that was given to
+    the constructor.
+
+    A reference with fewer than min_hits indexed k-mers (one shorter than
+    k, or broken up by Ns) could never reach min_hits seeds, so candidates
+    and oriented_candidates always include it instead of pruning it (see
+    unseedable).
+    '''
+
+    def __init__(self, references, k=DEFAULT_K):
+        if k < 1: raise ValueError('k must be a positive integer')
+        self.k = k
+        self._index = defaultdict(list)
+        self._num_references = 0
+        self._num_kmers = []
+        self._unseedable = {}
+        for ref in references: self.add(ref)
+
+    def __len__(self):
+        '''returns the number of references in the index'''
+        return self._num_references
+
+    def add(self, reference):
+        '''adds one reference to the index and returns its index'''
+        ref_idx = self._num_references
+        self._num_references += 1
+        index = self._index
+        num_kmers = 0
+        for pos, kmer in self._iter_kmers(str(reference)):
+            index[kmer].append((ref_idx, pos))
+            num_kmers += 1
+        self._num_kmers.append(num_kmers)
+        self._unseedable.clear()
+        return ref_idx
+
+    def unseedable(self, min_hits=DEFAULT_MIN_SEED_HITS):
+        '''
+        returns a list of the references with fewer than min_hits indexed
+        k-mers, which no query could share min_hits seeds with
+        '''
+        if min_hits not in self._unseedable:
+            self._unseedable[min_hits] = [ref_idx for ref_idx, num_kmers in
+                                          enumerate(self._num_kmers) if
+                                          num_kmers < min_hits]
+        return self._unseedable[min_hits]
+
+    def _iter_kmers(self, s):
+        '''yields (position, k-mer) for each valid k-mer in s'''
+        k = self.k
+        s = s.upper()
+        # skip ahead past anything that isn't A, C, G or T
+        next_valid = 0
+        for i in xrange(len(s)):
+            if s[i] not in 'ACGT': next_valid = i + 1
+            elif i + 1 - next_valid >= k:
+                yield i + 1 - k, s[i + 1 - k:i + 1]
+
+    def seeds(self, query):
+        '''
+        yields (ref_idx, query_pos, ref_pos) for every k-mer shared by the
+        query and a reference
+        '''
+        index = self._index
+        for query_pos, kmer in self._iter_kmers(str(query)):
+            hits = index.get(kmer)
+            if hits is None: continue
+            for ref_idx, ref_pos in hits:
+                yield ref_idx, query_pos, ref_pos
+
+    def stranded_seeds(self, query):
+        '''
+        like seeds, but also finds seeds on the reverse complement of the query
+        in the same pass over the query
+
+        yields (reverse, ref_idx, query_pos, ref_pos), where query_pos is a
+        position in the reverse complement of the query if reverse is True
+        '''
+        index = self._index
+        s = str(query)
+        last_pos = len(s) - self.k
+        for query_pos, kmer in self._iter_kmers(s):
+            hits = index.get(kmer)
+            if hits is not None:
+                for ref_idx, ref_pos in hits:
+                    yield False, ref_idx, query_pos, ref_pos
+            hits = index.get(kmer.translate(_COMPLEMENT)[::-1])
+            if hits is not None:
+                for ref_idx, ref_pos in hits:
+                    yield True, ref_idx, last_pos - query_pos, ref_pos
+
+    def _tally(self, votes):
+        '''turns {ref_idx: {diagonal: votes}} into {ref_idx: (hits, diagonal)}'''
+        result = {}
+        for ref_idx, diagonals in votes.iteritems():
+            diagonal = max(diagonals, key=diagonals.get)
+            result[ref_idx] = (sum(diagonals.itervalues()), diagonal)
+        return result
+
+    def vote(self, query):
+        '''
+        seed-and-vote: every shared k-mer casts one vote for its reference and
+        for the diagonal (query_pos - ref_pos) that it lies on
+
+        returns a dict of ref_idx -> (hits, diagonal), where hits is the number
+        of seeds shared with that reference and diagonal is the diagonal with
+        the most votes
+        '''
+        votes = defaultdict(lambda: defaultdict(int))
+        for ref_idx, query_pos, ref_pos in self.seeds(query):
+            votes[ref_idx][query_pos - ref_pos] += 1
+        return self._tally(votes)
+
+    def stranded_vote(self, query):
+        '''
+        returns (forward, reverse), the results of vote for the query and for
+        its reverse complement, computed in a single pass over the query
+        '''
+        votes = (defaultdict(lambda: defaultdict(int)),
+                 defaultdict(lambda: defaultdict(int)))
+        for reverse, ref_idx, query_pos, ref_pos in self.stranded_seeds(query):
+            votes[reverse][ref_idx][query_pos - ref_pos] += 1
+        return self._tally(votes[0]), self._tally(votes[1])
+
+    def oriented_candidates(self, query, min_hits=DEFAULT_MIN_SEED_HITS,
+                            ratio=DEFAULT_ORIENTATION_RATIO):
+        '''
+        picks the strand of the query to align to each reference by comparing
+        the seed hits on each strand (see stranded_vote)
+
+        a strand is chosen for a reference if it has at least ratio times as
+        many hits as the other strand. if neither does, the vote is ambiguous
+        and both strands are returned. references with fewer than min_hits
+        hits on both strands are left out, except for unseedable references,
+        which are returned on both strands
+
+        returns (candidates, confidence), where candidates is a list of
+        (ref_idx, reverse, hits, diagonal), best first, and confidence is the
+        fraction of all hits to those references that are on the strand with
+        the most hits (1.0 if every hit agrees, 0.5 if they are split evenly,
+        None if there are no candidates)
+        '''
+        forward, reverse = self.stranded_vote(query)
+        candidates = []
+        strand_hits = [0, 0]
+        for ref_idx in set(forward) | set(reverse):
+            f_hits, f_diagonal = forward.get(ref_idx, (0, None))
+            r_hits, r_diagonal = reverse.get(ref_idx, (0, None))
+            if max(f_hits, r_hits) < min_hits: continue
+            strand_hits[0] += f_hits
+            strand_hits[1] += r_hits
+            if f_hits > 0 and f_hits >= ratio * r_hits:
+                candidates.append((ref_idx, False, f_hits, f_diagonal))
+            elif r_hits > 0 and r_hits >= ratio * f_hits:
+                candidates.append((ref_idx, True, r_hits, r_diagonal))
+            else:
+                candidates.append((ref_idx, False, f_hits, f_diagonal))
+                candidates.append((ref_idx, True, r_hits, r_diagonal))
+        for ref_idx in self.unseedable(min_hits):
+            f_hits, f_diagonal = forward.get(ref_idx, (0, None))
+            r_hits, r_diagonal = reverse.get(ref_idx, (0, None))
+            if max(f_hits, r_hits) >= min_hits: continue
+            candidates.append((ref_idx, False, f_hits, f_diagonal))
+            candidates.append((ref_idx, True, r_hits, r_diagonal))
+        candidates.sort(key=lambda x: (-x[2], x[0], x[1]))
+        total = sum(strand_hits)
+        if total == 0: confidence = None
+        else: confidence = float(max(strand_hits)) / total
+        return candidates, confidence
+
+    def candidates(self, query, min_hits=DEFAULT_MIN_SEED_HITS):
+        '''
+        returns a list of (ref_idx, hits, diagonal) for every reference that
+        shares at least min_hits seeds with the query, and for every
+        unseedable reference, best first
+        '''
+        votes = self.vote(query)
+        hits = [(ref_idx, n, diagonal) for ref_idx, (n, diagonal) in
+                votes.iteritems() if n >= min_hits]
+        for ref_idx in self.unseedable(min_hits):
+            n, diagonal = votes.get(ref_idx, (0, None))
+            if n < min_hits: hits.append((ref_idx, n, diagonal))
+        hits.sort(key=lambda x: (-x[1], x[0]))
+        return hits
@@ -0,0 +1,204 @@
+'''compact DNA sequences, packed 2 bits per base'''
+import numpy
+from cogent import DNA
+
+_BASES = 'ACGT'
+# 2-bit code of A, C, G and T (either case), and _OTHER for any other byte
+_OTHER = 4
+_CODE_TABLE = numpy.zeros(256, dtype=numpy.uint8) + _OTHER
+for _code, _base in enumerate(_BASES):
+    _CODE_TABLE[ord(_base)] = _code
+    _CODE_TABLE[ord(_base.lower())] = _code
+_ASCII = numpy.frombuffer(_BASES, dtype=numpy.uint8)
+# the other characters that a cogent DNA sequence may contain (IUPAC codes,
+# gaps and '?'), and their complements
+_COMPLEMENT_TABLE = numpy.zeros(256, dtype=numpy.uint8)
+for _base, _complement in DNA.Complements.items():
+    _COMPLEMENT_TABLE[ord(_base)] = ord(_complement)
+_COMPLEMENT_TABLE[ord('?')] = ord('?')
+
+def _pack_codes(codes):
+    '''packs an array of 2-bit codes, 4 to a byte, first base highest'''
+    padded = numpy.zeros((len(codes) + 3) // 4 * 4, dtype=numpy.uint8)
+    padded[:len(codes)] = codes
+    quads = padded.reshape(-1, 4)
+    return (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | \
+           quads[:, 3]
+
+def _unpack_codes(packed, start, end):
+    '''returns the 2-bit codes of bases [start, end) of a packed array'''
+    first_byte = start // 4
+    data = packed[first_byte:(end + 3) // 4]
+    codes = numpy.empty((len(data), 4), dtype=numpy.uint8)
+    codes[:, 0] = data >> 6
+    codes[:, 1] = (data >> 4) & 3
+    codes[:, 2] = (data >> 2) & 3
+    codes[:, 3] = data & 3
+    offset = start - first_byte * 4
+    return codes.ravel()[offset:offset + end - start]
+
+def sequence_class(seq):
+    '''
+    returns the cogent class to use for sequences (such as aligned
+    sequences) derived from seq: its own class, or DnaSequence for a
+    PackedSequence
+    '''
+    if isinstance(seq, PackedSequence): return DNA.Sequence
+    return seq.__class__
+
+class PackedSequence(object):
+    '''
+    Usage: seq = PackedSequence.from_string('ACGTNNACGT', Name='clone1')
+           part = seq[2:8]
+           rc = seq.rc()
+           cogent_seq = seq.to_cogent()
+
+    PackedSequence keeps a DNA sequence in a quarter of the memory of a
+    string: each base is a 2-bit code (A, C, G, T), 4 to a byte. Anything
+    else (N and the other IUPAC codes) is kept in a side mask, the sorted
+    positions of those bases and their characters, and packed as an A.
+    Lowercase bases are stored as uppercase, as in cogent.
+
+    Slicing (with step 1) returns a PackedSequence that shares the packed
+    bytes and mask of the original, so no bases are copied. rc() works on
+    the whole array of codes at once. Pickling writes only the bases of the
+    slice, so PackedSequences are cheap to send to worker processes.
+
+    Like a cogent Sequence, a PackedSequence has a Name and an Info dict,
+    and str() gives its bases, so it can be used wherever only those are
+    needed (k-mer and exact matching, alignment, caching). Base qualities in
+    Info['quality'] (see clonechecker.quality) are sliced and reversed along
+    with the bases. to_cogent converts it for anything else, e.g. output.
+    '''
+    MolType = DNA
+
+    def __init__(self, packed, length, mask_positions, mask_chars, Name='',
+                 Info=None, start=0):
+        self._packed = packed
+        self._start = start
+        self._length = length
+        self._mask_positions = mask_positions
+        self._mask_chars = mask_chars
+        self.Name = Name
+        if Info is None: Info = {}
+        self.Info = Info
+
+    @classmethod
+    def from_string(cls, s, Name='', quality=None):
+        '''
+        packs a string of bases, raising ValueError if it has characters
+        that are not in cogent's DNA alphabet
+        '''
+        chars = numpy.frombuffer(str(s).upper(), dtype=numpy.uint8)
+        codes = _CODE_TABLE[chars]
+        mask_positions = numpy.flatnonzero(codes == _OTHER)
+        mask_chars = chars[mask_positions]
+        if not _COMPLEMENT_TABLE[mask_chars].all():
+            bad = mask_chars[_COMPLEMENT_TABLE[mask_chars] == 0][0]
+            message = 'Invalid DNA character %r' % chr(bad)
+            if Name: message += ' in %s' % Name
+            raise ValueError(message)
+        codes[mask_positions] = 0
+        info = {}
+        if quality is not None: info['quality'] = quality
+        return cls(_pack_codes(codes), len(codes), mask_positions, mask_chars,
+                   Name=Name, Info=info)
+
+    @classmethod
+    def from_seq(cls, seq):
+        '''packs a cogent Sequence (or anything with str, Name and Info)'''
+        if isinstance(seq, PackedSequence): return seq
+        info = getattr(seq, 'Info', None)
+        quality = None
+        if info is not None and 'quality' in info: quality = info['quality']
+        return cls.from_string(str(seq), Name=getattr(seq, 'Name', ''),
+                               quality=quality)
+
+    def to_cogent(self, moltype=DNA):
+        '''returns the sequence as a cogent Sequence, with the same Info'''
+        return moltype.makeSequence(str(self), Name=self.Name,
+                                    Info=dict(self.Info))
+
+    def __len__(self):
+        return self._length
+
+    def _mask(self):
+        '''returns the positions (in this sequence) and characters of the mask'''
+        lo, hi = numpy.searchsorted(self._mask_positions,
+                                    [self._start, self._start + self._length])
+        return self._mask_positions[lo:hi] - self._start, \
+               self._mask_chars[lo:hi]
+
+    def codes(self):
+        '''returns an array of the 2-bit code of each base (0 for masked bases)'''
+        return _unpack_codes(self._packed, self._start,
+                             self._start + self._length)
+
+    def ascii(self):
+        '''returns the bases as an array of uint8 characters'''
+        chars = _ASCII[self.codes()]
+        positions, mask_chars = self._mask()
+        chars[positions] = mask_chars
+        return chars
+
+    def __str__(self):
+        return self.ascii().tostring()
+
+    def __repr__(self):
+        return 'PackedSequence(%r, Name=%r)' % (str(self), self.Name)
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, numpy.integer)):
+            if key < 0: key += self._length
+            if not 0 <= key < self._length:
+                raise IndexError('PackedSequence index out of range')
+            return str(self[key:key + 1])
+        if not isinstance(key, slice):
+            raise TypeError('PackedSequence indices must be integers or slices')
+        start, stop, step = key.indices(self._length)
+        info = dict(self.Info)
+        if 'quality' in info: info['quality'] = info['quality'][key]
+        if step != 1:
+            return PackedSequence.from_string(str(self)[key], Name=self.Name,
+                                              quality=info.get('quality'))
+        stop = max(start, stop)
+        return PackedSequence(self._packed, stop - start, self._mask_positions,
+                              self._mask_chars, Name=self.Name, Info=info,
+                              start=self._start + start)
+
+    def rc(self):
+        '''returns the reverse complement (with qualities reversed, if any)'''
+        codes = 3 - self.codes()[::-1]
+        positions, mask_chars = self._mask()
+        info = dict(self.Info)
+        if 'quality' in info: info['quality'] = info['quality'][::-1]
+        return PackedSequence(_pack_codes(codes), self._length,
+                              (self._length - 1 - positions)[::-1],
+                              _COMPLEMENT_TABLE[mask_chars][::-1],
+                              Name=self.Name, Info=info)
+
+    def compact(self):
+        '''returns a copy that holds only the bases of this (sliced) sequence'''
+        if self._start % 4 == 0:
+            first = self._start // 4
+            packed = self._packed[first:first + (self._length + 3) // 4].copy()
+        else:
+            packed = _pack_codes(self.codes())
+        positions, mask_chars = self._mask()
+        info = dict(self.Info)
+        if 'quality' in info: info['quality'] = numpy.array(info['quality'])
+        return PackedSequence(packed, self._length, positions.copy(),
+                              mask_chars.copy(), Name=self.Name, Info=info)
+
+    def nbytes(self):
+        '''returns the number of bytes used by the packed bases and mask'''
+        return self._packed.nbytes + self._mask_positions.nbytes + \
+               self._mask_chars.nbytes
+
+    def __reduce__(self):
+        seq = self.compact()
+        return (PackedSequence, (seq._packed, seq._length, seq._mask_positions,
+                                 seq._mask_chars, seq.Name, seq.Info))
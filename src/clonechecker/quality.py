@@ -0,0 +1,119 @@
+'''
+base qualities: parsing, Mott trimming of low-quality ends and masking of
+low-quality mismatches
+'''
+import numpy
+from clonechecker.packed import PackedSequence
+from clonechecker.defaults import DEFAULT_TRIM_CUTOFF, DEFAULT_MASK_QUALITY
+
+# FASTQ quality characters are chr(Phred score + PHRED_OFFSET)
+PHRED_OFFSET = 33
+# base qualities are kept in seq.Info under this key
+QUALITY_KEY = 'quality'
+
+def phred_scores(qual, offset=PHRED_OFFSET):
+    '''returns a uint8 array of the Phred scores in a FASTQ quality string'''
+    codes = numpy.frombuffer(qual, dtype=numpy.uint8)
+    if len(codes) > 0 and codes.min() < offset:
+        raise ValueError('Invalid quality character %r' % chr(codes.min()))
+    return codes - numpy.uint8(offset)
+
+def parse_qual_values(text):
+    '''returns a uint8 array of the Phred scores in a .qual record (integers)'''
+    return numpy.array(text.split(), dtype=numpy.int64).clip(0, 255).astype(
+                                                                numpy.uint8)
+
+def get_quality(seq):
+    '''returns the Phred scores of a Seq, or None if it has none'''
+    info = getattr(seq, 'Info', None)
+    if info is None or not QUALITY_KEY in info: return None
+    return info[QUALITY_KEY]
+
+def with_quality(seq, s, quality):
+    '''returns a new Seq of the same kind as seq, with sequence s and quality'''
+    if isinstance(seq, PackedSequence):
+        return PackedSequence.from_string(str(s), Name=seq.Name,
+                                          quality=quality)
+    info = {}
+    if quality is not None: info[QUALITY_KEY] = quality
+    return seq.MolType.makeSequence(str(s), Name=seq.Name, Info=info)
+
+def reverse_complement(seq):
+    '''
+    returns the reverse complement of a Seq, with its quality reversed too
+    (a cogent seq.rc() keeps the Info of seq as it is)
+    '''
+    quality = get_quality(seq)
+    if quality is None or isinstance(seq, PackedSequence): return seq.rc()
+    return with_quality(seq, seq.rc(), quality[::-1].copy())
+
+def mott_trim(quality, cutoff=DEFAULT_TRIM_CUTOFF):
+    '''
+    returns (start, end), the part of a read to keep after Mott trimming
+
+    each base scores cutoff minus its error probability, and the stretch of
+    bases with the highest total score is kept (the maximum subarray, found
+    with a running sum that restarts from zero whenever it goes negative).
+    the running sum and minimum are computed with cumsum and
+    minimum.accumulate, so a read is trimmed without a loop over its bases.
+    returns (0, 0) if no base is better than the cutoff
+    '''
+    quality = numpy.asarray(quality, dtype=numpy.float64)
+    if len(quality) == 0: return 0, 0
+    scores = cutoff - 10.0 ** (-quality / 10.0)
+    sums = numpy.zeros(len(scores) + 1)
+    numpy.cumsum(scores, out=sums[1:])
+    gains = sums - numpy.minimum.accumulate(sums)
+    end = int(gains.argmax())
+    if gains[end] <= 0: return 0, 0
+    # the last time the running sum restarted before end
+    start = end - int(sums[end::-1].argmin())
+    return start, end
+
+def trim_seqs(seqs, cutoff=DEFAULT_TRIM_CUTOFF):
+    '''
+    Mott-trims every Seq that has base qualities (others are kept as they
+    are)
+
+    returns (trimmed Seqs, trims), where trims is a list of
+    (name, bases trimmed from the start, bases trimmed from the end, length
+    left) for each Seq that was trimmed. Seqs with no bases left are
+    left out of the trimmed Seqs
+    '''
+    trimmed = []
+    trims = []
+    for seq in seqs:
+        quality = get_quality(seq)
+        if quality is None:
+            trimmed.append(seq)
+            continue
+        start, end = mott_trim(quality, cutoff)
+        if start > 0 or end < len(seq):
+            trims.append((seq.Name, start, len(seq) - end, end - start))
+            if end == start: continue
+            if isinstance(seq, PackedSequence): seq = seq[start:end]
+            else: seq = with_quality(seq, str(seq)[start:end],
+                                     quality[start:end].copy())
+        trimmed.append(seq)
+    return trimmed, trims
+
+def masked_mismatches(clone, aligned_clone, aligned_ref, first_clone_pos,
+                      min_quality=DEFAULT_MASK_QUALITY, gap='-'):
+    '''
+    finds the mismatches in an alignment (aligned strings) that are at clone
+    bases with a Phred score below min_quality
+
+    returns (alignment columns, clone positions) of those mismatches, as
+    sorted lists, which are empty if the clone has no qualities
+    '''
+    quality = get_quality(clone)
+    if quality is None or not min_quality: return [], []
+    clone_bases = numpy.frombuffer(aligned_clone, dtype=numpy.uint8)
+    ref_bases = numpy.frombuffer(aligned_ref, dtype=numpy.uint8)
+    clone_gap = clone_bases == ord(gap)
+    ref_gap = ref_bases == ord(gap)
+    clone_pos = first_clone_pos + numpy.cumsum(~clone_gap) - 1
+    columns = numpy.flatnonzero(~clone_gap & ~ref_gap &
+                                (clone_bases != ref_bases))
+    columns = columns[quality[clone_pos[columns]] < min_quality]
+    return columns.tolist(), clone_pos[columns].tolist()
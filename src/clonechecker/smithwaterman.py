@@ -0,0 +1,161 @@
+'''
+NumPy implementation of Smith-Waterman local alignment
+
+sw_align is a drop-in replacement for cogent.align.algorithm.sw_align. It uses
+the same scores (match 1, mismatch -1, linear gap -1) and breaks ties the same
+way (up, then diagonal, then left), so it returns the same alignment as cogent.
+
+Each row of the score matrix is computed at once. The only dependency within a
+row is the horizontal gap, and with a linear gap penalty it reduces to a running
+maximum:
+    H[j] = max(A[j], H[j-1] + gap) = max over k <= j of (A[k] + gap * (j - k))
+which numpy.maximum.accumulate computes in a single pass.
+'''
+import numpy
+from itertools import groupby
+from clonechecker.packed import PackedSequence, sequence_class
+
+MATCH = 1
+MISMATCH = -1
+GAP = -1
+
+# traceback pointers
+_NONE = 0
+_DIAG = 1
+_UP = 2
+_LEFT = 3
+
+def _as_codes(seq):
+    '''returns the characters of seq as an array of uint8'''
+    if isinstance(seq, PackedSequence): return seq.ascii()
+    return numpy.frombuffer(str(seq), dtype=numpy.uint8)
+
+def _band_limits(row, num_cols, band, diagonal):
+    '''returns the first and last (inclusive) columns to fill in row'''
+    if band is None or diagonal is None: return 1, num_cols
+    return max(1, row + diagonal - band), min(num_cols, row + diagonal + band)
+
+def fill(seq1, seq2, band=None, diagonal=None, match=MATCH, mismatch=MISMATCH,
+         gap=GAP):
+    '''
+    fills the Smith-Waterman matrix for seq1 (columns) and seq2 (rows)
+
+    if band is given, only cells within band of the diagonal
+    (column - row == diagonal) are filled, and all others score 0. the
+    diagonal is usually taken from a k-mer seed (see KmerIndex.vote)
+
+    returns (max_score, max_row, max_col, pointers), where pointers has one
+    (first_col, row_pointers) tuple per row
+    '''
+    a = _as_codes(seq1)
+    b = _as_codes(seq2)
+    num_cols = len(a)
+    prev_row = numpy.zeros(num_cols + 1, dtype=numpy.int64)
+    pointers = [(1, numpy.zeros(0, dtype=numpy.int8))]
+    max_score, max_row, max_col = 0, 0, 0
+    gap_offsets = gap * numpy.arange(num_cols, dtype=numpy.int64)
+    for row in xrange(1, len(b) + 1):
+        lo, hi = _band_limits(row, num_cols, band, diagonal)
+        curr_row = numpy.zeros(num_cols + 1, dtype=numpy.int64)
+        if lo > hi:
+            pointers.append((1, numpy.zeros(0, dtype=numpy.int8)))
+            prev_row = curr_row
+            continue
+        scores = numpy.where(a[lo - 1:hi] == b[row - 1], match, mismatch)
+        diag = prev_row[lo - 1:hi] + scores
+        up = prev_row[lo:hi + 1] + gap
+        best = numpy.maximum(numpy.maximum(diag, up), 0)
+        offsets = gap_offsets[:hi - lo + 1]
+        best = numpy.maximum.accumulate(best - offsets) + offsets
+        row_pointers = numpy.where(best == up, _UP,
+                       numpy.where(best == diag, _DIAG, _LEFT))
+        row_pointers[best <= 0] = _NONE
+        pointers.append((lo, row_pointers.astype(numpy.int8)))
+        curr_row[lo:hi + 1] = best
+        row_max = best.argmax()
+        if best[row_max] > max_score:
+            max_score = int(best[row_max])
+            max_row = row
+            max_col = lo + int(row_max)
+        prev_row = curr_row
+    return max_score, max_row, max_col, pointers
+
+def encode_ops(ops):
+    '''
+    run-length encodes a sequence of single-character edit operations,
+    e.g. '===X==' -> '3=1X2='
+    '''
+    return ''.join(['%d%s' % (len(list(run)), op) for op, run in groupby(ops)])
+
+def traceback(seq1, seq2, max_row, max_col, pointers):
+    '''
+    follows the pointers from (max_row, max_col) and returns
+    (align_1, align_2, start_row, start_col, ops), where align_1 and align_2
+    are the aligned versions of seq1 and seq2 as lists of characters, the
+    alignment starts after start_row characters of seq2 and start_col
+    characters of seq1, and ops lists the edit operations from seq2 to seq1
+    (= match, X mismatch, I character only in seq1, D character only in seq2)
+    '''
+    s1 = str(seq1)
+    s2 = str(seq2)
+    align_1 = []
+    align_2 = []
+    ops = []
+    row, col = max_row, max_col
+    while True:
+        lo, row_pointers = pointers[row]
+        if lo <= col < lo + len(row_pointers): p = row_pointers[col - lo]
+        else: p = _NONE
+        if p == _DIAG:
+            align_1.append(s1[col - 1])
+            align_2.append(s2[row - 1])
+            if s1[col - 1] == s2[row - 1]: ops.append('=')
+            else: ops.append('X')
+            row -= 1
+            col -= 1
+        elif p == _LEFT:
+            align_1.append(s1[col - 1])
+            align_2.append('-')
+            ops.append('I')
+            col -= 1
+        elif p == _UP:
+            align_1.append('-')
+            align_2.append(s2[row - 1])
+            ops.append('D')
+            row -= 1
+        else:
+            break
+    align_1.reverse()
+    align_2.reverse()
+    ops.reverse()
+    return align_1, align_2, row, col, ops
+
+def local_align(seq1, seq2, band=None, diagonal=None):
+    '''
+    finds the same alignment as sw_align, but also reports where it lies
+
+    returns (aligned, score, (start_1, end_1, start_2, end_2), ops), where
+    aligned is the pair of aligned sequences, seq1[start_1:end_1] and
+    seq2[start_2:end_2] are the aligned parts of seq1 and seq2, and ops is the
+    run-length encoded edit script (see traceback and encode_ops)
+    '''
+    max_score, max_row, max_col, pointers = fill(seq1, seq2, band=band,
+                                                 diagonal=diagonal)
+    align_1, align_2, start_row, start_col, ops = traceback(seq1, seq2,
+                                            max_row, max_col, pointers)
+    aligned = (sequence_class(seq1)(''.join(align_1)),
+               sequence_class(seq2)(''.join(align_2)))
+    coords = (start_col, max_col, start_row, max_row)
+    return aligned, max_score, coords, encode_ops(ops)
+
+def sw_align(seq1, seq2, band=None, diagonal=None, return_score=False):
+    '''Returns locally optimal alignment of seq1 and seq2.'''
+    max_score, max_row, max_col, pointers = fill(seq1, seq2, band=band,
+                                                 diagonal=diagonal)
+    align_1, align_2 = traceback(seq1, seq2, max_row, max_col, pointers)[0:2]
+    aligned = (sequence_class(seq1)(''.join(align_1)),
+               sequence_class(seq2)(''.join(align_2)))
+    if return_score:
+        return aligned, max_score
+    else:
+        return aligned
@@ -0,0 +1,176 @@
+'''
+run statistics: stage timers, task latency histograms, bytes sent between
+processes and worker utilization, written out as JSON
+'''
+import json
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# upper bounds (in seconds) of the latency histogram buckets: powers of 2
+# from about 0.1 ms to about 9 minutes. the last bucket has no upper bound
+LATENCY_BOUNDS = [2.0 ** k for k in xrange(-13, 10)]
+
+class LatencyHistogram(object):
+    '''
+    Usage: h = LatencyHistogram()
+           h.add(0.012)
+           h.percentile(0.9)
+
+    LatencyHistogram counts durations in buckets whose bounds double
+    (LATENCY_BOUNDS), so it takes the same small amount of memory for a
+    thousand tasks or a billion. Percentiles are the upper bound of the
+    bucket that holds them (at most twice the true value); min, max and the
+    mean are exact.
+    '''
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        self.counts[bisect_left(LATENCY_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min: self.min = seconds
+        if self.max is None or seconds > self.max: self.max = seconds
+
+    def percentile(self, fraction):
+        '''returns the upper bound of the bucket that holds a percentile'''
+        if self.count == 0: return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                if i == len(LATENCY_BOUNDS): return self.max
+                return min(LATENCY_BOUNDS[i], self.max)
+        return self.max
+
+    def to_dict(self):
+        if self.count == 0: return {'count': 0}
+        buckets = [[bound, count] for bound, count in
+                   zip(LATENCY_BOUNDS + [None], self.counts) if count > 0]
+        return {'count': self.count, 'total_seconds': self.total,
+                'mean_seconds': self.total / self.count,
+                'min_seconds': self.min, 'max_seconds': self.max,
+                'p50_seconds': self.percentile(0.5),
+                'p90_seconds': self.percentile(0.9),
+                'p99_seconds': self.percentile(0.99),
+                'buckets': buckets}
+
+class RunStats(object):
+    '''
+    Usage: stats = RunStats()
+           with stats.stage('load clones'): ...
+           stats.add_task(worker_pid, 'aligned', seconds, result_bytes,
+                          task_bytes)
+           stats.write_json('stats.json')
+
+    RunStats collects what a run of checkmyclones spends its time on:
+
+    - stages: the wall time of each phase of the run. A stage may be entered
+      more than once (e.g. reporting, once per clone); its times are added
+      up and the number of calls is kept
+    - latency: a LatencyHistogram of the time workers took for each kind of
+      task (e.g. aligned, cached, exact)
+    - ipc: the bytes of pickled tasks sent to workers and of pickled results
+      sent back
+    - workers: for each worker process, the tasks it ran and the time it
+      was busy with them. Utilization is busy time over pool_seconds, the
+      wall time from starting the workers to stopping them (set by the
+      caller), and the overall utilization is that of all num_workers
+    '''
+
+    def __init__(self, num_workers=None):
+        self.started = time.time()
+        self.stages = {}
+        self._stage_order = []
+        self.latency = {}
+        self.ipc = {'tasks': 0, 'task_bytes': 0, 'results': 0,
+                    'result_bytes': 0}
+        self.workers = {}
+        self.counts = {}
+        self.num_workers = num_workers
+        self.pool_seconds = None
+
+    @contextmanager
+    def stage(self, name):
+        '''times the code in a with block as (part of) stage name'''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.time() - start)
+
+    def add_stage_time(self, name, seconds):
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0.0, 'calls': 0}
+            self._stage_order.append(name)
+        self.stages[name]['seconds'] += seconds
+        self.stages[name]['calls'] += 1
+
+    def add_task(self, worker, kind, seconds, result_bytes=None,
+                 task_bytes=None):
+        '''
+        records a task that took seconds in process worker (e.g. its pid) and
+        the sizes of its pickled result and of the pickled task, if known
+        '''
+        if kind not in self.latency: self.latency[kind] = LatencyHistogram()
+        self.latency[kind].add(seconds)
+        if worker not in self.workers:
+            self.workers[worker] = {'tasks': 0, 'busy_seconds': 0.0}
+        self.workers[worker]['tasks'] += 1
+        self.workers[worker]['busy_seconds'] += seconds
+        if result_bytes is not None:
+            self.ipc['results'] += 1
+            self.ipc['result_bytes'] += result_bytes
+        if task_bytes is not None:
+            self.ipc['tasks'] += 1
+            self.ipc['task_bytes'] += task_bytes
+
+    def to_dict(self):
+        wall = time.time() - self.started
+        stages = [dict(name=name, **self.stages[name]) for
+                  name in self._stage_order]
+        accounted = sum(stage['seconds'] for stage in stages)
+        window = self.pool_seconds
+        workers = {}
+        for worker, usage in self.workers.iteritems():
+            workers[str(worker)] = dict(usage)
+            if window:
+                workers[str(worker)]['utilization'] = \
+                    usage['busy_seconds'] / window
+        result = {'wall_seconds': wall, 'stages': stages,
+                  'unaccounted_seconds': max(wall - accounted, 0.0),
+                  'latency': dict((kind, histogram.to_dict()) for
+                                  kind, histogram in
+                                  self.latency.iteritems()),
+                  'ipc': dict(self.ipc), 'workers': workers,
+                  'counts': dict(self.counts)}
+        num_workers = self.num_workers or len(self.workers)
+        if window and num_workers > 0:
+            busy = sum(usage['busy_seconds'] for usage in
+                       self.workers.itervalues())
+            result['pool_seconds'] = window
+            result['utilization'] = busy / (window * num_workers)
+        return result
+
+    def write_json(self, filename, **extra):
+        '''writes the statistics (and any extra items) to a JSON file'''
+        result = self.to_dict()
+        result.update(extra)
+        fh = open(filename, 'w')
+        try:
+            json.dump(result, fh, indent=1, sort_keys=True)
+            fh.write('\n')
+        finally:
+            fh.close()
+
+def profile_path(profile_dir, label):
+    '''returns the path of the cProfile dump for a process (label, e.g. main)'''
+    return os.path.join(profile_dir, '%s.prof' % label)
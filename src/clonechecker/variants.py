@@ -0,0 +1,189 @@
+'''extracts SNVs and indels from CloneAlignments and writes them as VCF or TSV'''
+import re
+import numpy
+from cogent import DNA
+from clonechecker.TabFile import TabFile
+
+VCF_COLUMNS = ['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']
+SUMMARY_COLUMNS = ['clone', 'reference', 'chrom', 'start', 'end', 'status',
+                   'snvs', 'insertions', 'deletions', 'variants']
+
+# read_bed_file names references 'name (chr:start-end)'
+_LOCATION_RE = re.compile(r'\(([^\s:()]+):([0-9]+)-([0-9]+)\)$')
+_UNSAFE_RE = re.compile(r'[\s;=,]+')
+# _CAN_MATCH[ref_base, clone_base] is True if the bases could be the same
+# (see cogent's canMatch, which decides has_mismatches): N and the other
+# ambiguity codes match every base they stand for
+_CAN_MATCH = numpy.zeros((256, 256), dtype=bool)
+for _ref_base, _clone_base in DNA.Matches:
+    _CAN_MATCH[ord(_ref_base), ord(_clone_base)] = True
+
+def reference_location(ref_name):
+    '''
+    returns (chrom, start) for a reference named by read_bed_file, where start
+    is the 0-based genomic position of the first base of the reference, or
+    (None, 0) if the name does not contain coordinates
+    '''
+    m = _LOCATION_RE.search(ref_name)
+    if m is None: return None, 0
+    return m.group(1), int(m.group(2))
+
+def _runs(mask):
+    '''returns (starts, ends) of the runs of True in a boolean array'''
+    edges = numpy.diff(numpy.concatenate(([0], mask.view(numpy.int8), [0])))
+    return numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)
+
+def find_variants(aln, gap='-'):
+    '''
+    compares the aligned clone and reference of a CloneAlignment in one
+    vectorized pass
+
+    returns a list of (ref_pos, ref_allele, alt_allele, kind), sorted by
+    ref_pos, where ref_pos is the 0-based position in the reference and kind
+    is 'SNV', 'INS' or 'DEL'. As in VCF, indel alleles start with the
+    reference base before the indel (ref_pos is the position of that base).
+    columns where the bases could match (an N or other ambiguity code that
+    stands for the other base) are not SNVs, nor are mismatches in
+    aln.masked_positions (low-quality clone bases)
+    '''
+    aligned_clone = str(aln.Seqs[0])
+    aligned_ref = str(aln.Seqs[1])
+    clone = numpy.frombuffer(aligned_clone, dtype=numpy.uint8)
+    ref = numpy.frombuffer(aligned_ref, dtype=numpy.uint8)
+    clone_gap = clone == ord(gap)
+    ref_gap = ref == ord(gap)
+    # reference position of each column (for inserted bases, the position of
+    # the reference base before them)
+    ref_pos = aln.first_ref_pos + numpy.cumsum(~ref_gap) - 1
+    snvs = numpy.flatnonzero(~clone_gap & ~ref_gap & ~_CAN_MATCH[ref, clone])
+    masked = getattr(aln, 'masked_positions', ())
+    if len(masked) > 0:
+        # low-quality mismatches ignored by the alignment are not variants
+        clone_pos = aln.first_clone_pos + numpy.cumsum(~clone_gap) - 1
+        snvs = snvs[~numpy.in1d(clone_pos[snvs], masked)]
+    variants = [(int(ref_pos[i]), aligned_ref[i], aligned_clone[i], 'SNV')
+                for i in snvs]
+    ins_starts, ins_ends = _runs(ref_gap)
+    del_starts, del_ends = _runs(clone_gap)
+    starts = numpy.concatenate((ins_starts, del_starts))
+    ends = numpy.concatenate((ins_ends, del_ends))
+    is_insertion = numpy.arange(len(starts)) < len(ins_starts)
+    # the anchor of an indel is the last reference base before it. indels
+    # at the start of the alignment have none, and are left out
+    ref_columns = numpy.flatnonzero(~ref_gap)
+    num_before = numpy.searchsorted(ref_columns, starts)
+    keep = num_before > 0
+    anchors = ref_columns[num_before[keep] - 1]
+    for start, end, anchor, insertion in zip(starts[keep], ends[keep],
+                                             anchors, is_insertion[keep]):
+        anchor_base = aligned_ref[anchor]
+        if insertion:
+            variants.append((int(ref_pos[anchor]), anchor_base,
+                             anchor_base + aligned_clone[start:end], 'INS'))
+        else:
+            variants.append((int(ref_pos[anchor]),
+                             anchor_base + aligned_ref[start:end], anchor_base,
+                             'DEL'))
+    variants.sort()
+    return variants
+
+def _safe(name):
+    '''makes a name safe to use as a VCF INFO value'''
+    return _UNSAFE_RE.sub('_', name)
+
+class VcfWriter(object):
+    '''
+    Usage: vcf = VcfWriter('variants.vcf')
+           vcf.write_alignment(aln)
+           vcf.close()
+
+    writes the variants in CloneAlignments as VCF records. Records are kept
+    until close, which writes the header, with a ##contig line for every
+    chromosome, and then the records sorted by chromosome and position.
+
+    References named by read_bed_file are placed at their genomic position.
+    Other references are used as the chromosome, with positions within the
+    reference. The clone and reference names are given in the INFO column.
+    '''
+
+    def __init__(self, filename, source='checkmyclones'):
+        self._file_pointer = open(filename, 'w')
+        self._source = source
+        # chrom -> length (None for genomic chromosomes, whose length is
+        # not known)
+        self._contigs = {}
+        self._records = []
+
+    def write(self, s):
+        '''writes a string directly to the file'''
+        self._file_pointer.write(s)
+
+    def write_alignment(self, aln, variants=None):
+        '''
+        adds one record per variant in a CloneAlignment
+        (variants are found with find_variants unless they are given)
+        '''
+        if variants is None: variants = find_variants(aln)
+        ref_name = aln.Reference.Name
+        chrom, start = reference_location(ref_name)
+        if chrom is None:
+            chrom = _safe(ref_name)
+            self._contigs[chrom] = len(aln.Reference)
+        else: self._contigs.setdefault(chrom, None)
+        info_base = 'CLONE=%s;REFERENCE=%s' % (_safe(aln.Clone.Name),
+                                               _safe(ref_name))
+        for ref_pos, ref_allele, alt_allele, kind in variants:
+            row = [chrom, start + ref_pos + 1, '.', ref_allele, alt_allele,
+                   '.', 'PASS', '%s;TYPE=%s' % (info_base, kind)]
+            self._records.append(row)
+
+    def close(self):
+        '''writes the header and the sorted records, and closes the file'''
+        self.write('##fileformat=VCFv4.2\n')
+        self.write('##source=%s\n' % self._source)
+        for chrom in sorted(self._contigs):
+            length = self._contigs[chrom]
+            if length is None: self.write('##contig=<ID=%s>\n' % chrom)
+            else: self.write('##contig=<ID=%s,length=%d>\n' % (chrom, length))
+        self.write('##INFO=<ID=CLONE,Number=1,Type=String,Description="Clone">\n')
+        self.write('##INFO=<ID=REFERENCE,Number=1,Type=String,Description="Reference sequence">\n')
+        self.write('##INFO=<ID=TYPE,Number=1,Type=String,Description="SNV, INS or DEL">\n')
+        self.write('\t'.join(VCF_COLUMNS) + '\n')
+        self._records.sort(key=lambda row: (row[0], row[1]))
+        for row in self._records:
+            self.write('\t'.join([str(x) for x in row]) + '\n')
+        self._records = []
+        self._file_pointer.close()
+
+class VariantSummary(TabFile):
+    '''
+    Usage: summary = VariantSummary('variants.tsv')
+           summary.write_alignment(aln)
+           summary.close()
+
+    A TabFile with one row per CloneAlignment, giving the matched region, the
+    number of SNVs, insertions and deletions, and the variants themselves as
+    chrom:pos:ref>alt (1-based positions, as in VCF)
+    '''
+
+    def __init__(self, filename):
+        super(VariantSummary, self).__init__(filename, 'w')
+        self.set_column_names(SUMMARY_COLUMNS)
+        self.write_column_names()
+
+    def write_alignment(self, aln, variants=None):
+        '''writes the row for a CloneAlignment'''
+        if variants is None: variants = find_variants(aln)
+        ref_name = aln.Reference.Name
+        chrom, start = reference_location(ref_name)
+        if chrom is None: chrom = ref_name
+        kinds = [kind for ref_pos, ref_allele, alt_allele, kind in variants]
+        if aln.is_match(): status = 'perfect'
+        else: status = 'mutated'
+        described = ['%s:%d:%s>%s' % (chrom, start + ref_pos + 1, ref_allele,
+                                      alt_allele) for
+                     ref_pos, ref_allele, alt_allele, kind in variants]
+        self.write_row([aln.Clone.Name, ref_name, chrom,
+                        start + aln.first_ref_pos, start + aln.last_ref_pos,
+                        status, kinds.count('SNV'), kinds.count('INS'),
+                        kinds.count('DEL'), ','.join(described) or '.'])
@@ -0,0 +1,92 @@
+'''checks BedTable against the rows that BedFile reads'''
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy
+from clonechecker.bedtable import BedTable, concatenate
+from clonechecker.TabFile import BedFile
+from clonechecker.bgzf import compress_file
+
+def random_lines(rng, num_lines, ragged=False):
+    '''returns BED lines, with a varying number of columns if ragged'''
+    lines = ['track name=test']
+    for i in xrange(num_lines):
+        start = rng.randint(0, 10000)
+        fields = ['chr%s' % rng.choice('12X'), str(start),
+                  str(start + rng.randint(1, 500)), 'peak%d' % i, '0', '+']
+        if ragged: fields = fields[:rng.choice([3, 4, 6])]
+        lines.append('\t'.join(fields))
+        if rng.random() < 0.05: lines.append('# comment %d' % i)
+    return lines
+
+class BedTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rng = random.Random(13)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, lines, name='test.bed'):
+        filename = os.path.join(self.tmpdir, name)
+        fh = open(filename, 'w')
+        fh.write(''.join(line + '\n' for line in lines))
+        fh.close()
+        return filename
+
+    def bed_rows(self, filename):
+        '''returns (chrom, start, end, name) of each row, read by BedFile'''
+        return [(row[0], int(row[1]), int(row[2]),
+                 row[3] if len(row) > 3 else '') for row in BedFile(filename)]
+
+    def test_from_file(self):
+        for ragged in False, True:
+            filename = self.write(random_lines(self.rng, 3000, ragged))
+            table = BedTable.from_file(filename)
+            self.assertEqual(list(table), self.bed_rows(filename))
+            self.assertEqual(table.chroms, sorted(table.chroms))
+
+    def test_empty(self):
+        table = BedTable.from_file(self.write(['track name=empty']))
+        self.assertEqual(len(table), 0)
+        self.assertEqual(list(table), [])
+
+    def test_selection(self):
+        filename = self.write(random_lines(self.rng, 1000, ragged=True))
+        table = BedTable.from_file(filename)
+        rows = self.bed_rows(filename)
+        long_rows = table[table.lengths() > 250]
+        self.assertEqual(list(long_rows), [row for row in rows
+                                           if row[2] - row[1] > 250])
+        self.assertEqual(list(table[10:20]), rows[10:20])
+        idx = numpy.array([5, 3, 900])
+        self.assertEqual(list(table[idx]), [rows[i] for i in idx])
+        self.assertEqual(table.names(), [row[3] for row in rows])
+        self.assertEqual(table.regions(), [row[:3] for row in rows])
+        self.assertEqual(list(table[table.chrom_mask(['chrX'])]),
+                         [row for row in rows if row[0] == 'chrX'])
+        self.assertEqual(list(table.sort()),
+                         sorted(rows, key=lambda row: row[:3]))
+
+    def test_concatenate(self):
+        rows = self.bed_rows(self.write(random_lines(self.rng, 500)))
+        tables = [BedTable.from_columns(*zip(*rows[i:i + 100]))
+                  for i in xrange(0, len(rows), 100)]
+        # the pieces have different chromosome lists
+        tables.append(BedTable.from_columns(['chrY'], [1], [2], ['y']))
+        self.assertEqual(list(concatenate(tables)), rows + [('chrY', 1, 2, 'y')])
+
+    def test_from_region(self):
+        lines = random_lines(self.rng, 3000)
+        filename = self.write(lines)
+        compressed = filename + '.gz'
+        compress_file(filename, compressed)
+        rows = self.bed_rows(filename)
+        table = BedTable.from_region(compressed, 'chr2', 2000, 2500)
+        self.assertEqual(list(table), [row for row in rows if row[0] == 'chr2'
+                                       and row[1] < 2500 and row[2] > 2000])
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,68 @@
+'''checks that the best-hit score bounds never undercut the aligned score'''
+import random
+import unittest
+from clonechecker import smithwaterman
+from clonechecker.besthit import ScoreBound, search_best_hits
+from clonechecker.kmers import KmerIndex
+from test_smithwaterman import random_dna, mutate, EDGE_CASES
+
+def sw_score(seq1, seq2):
+    return smithwaterman.fill(seq1, seq2)[0]
+
+class ScoreBoundTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(25)
+        self.references = [random_dna(self.rng, self.rng.randint(10, 80))
+                           for i in xrange(30)]
+        self.references += [reference for clone, reference in EDGE_CASES]
+
+    def clones(self, count):
+        for i in xrange(count):
+            if i % 3 == 2:
+                yield random_dna(self.rng, self.rng.randint(0, 100))
+            else:
+                reference = self.rng.choice(self.references[:30])
+                yield random_dna(self.rng, self.rng.randint(0, 15)) + \
+                      mutate(self.rng, reference) + \
+                      random_dna(self.rng, self.rng.randint(0, 15))
+        for clone, reference in EDGE_CASES: yield clone
+
+    def test_upper_bounds(self):
+        for k in 2, 4, 12:
+            index = KmerIndex(self.references, k=k)
+            bound = ScoreBound(self.references, k=k)
+            for clone in self.clones(40):
+                votes = index.vote(clone)
+                candidates = [(ref_idx, votes.get(ref_idx, (0, None))[0])
+                              for ref_idx in xrange(len(self.references))]
+                bounds = bound.upper_bounds(clone, candidates)
+                without_hits = bound.upper_bounds(clone,
+                        [(ref_idx, None) for ref_idx, hits in candidates])
+                for ref_idx, upper, loose in zip(xrange(len(candidates)),
+                                                 bounds, without_hits):
+                    score = sw_score(clone, self.references[ref_idx])
+                    self.assertTrue(score <= upper <= loose,
+                                    (clone, self.references[ref_idx], k))
+
+    def test_search_best_hits(self):
+        bound = ScoreBound(self.references)
+        for clone in self.clones(20):
+            candidates = [(ref_idx, None) for ref_idx in
+                          xrange(len(self.references))]
+            scores = [sw_score(clone, reference) for reference in
+                      self.references]
+            aligned = []
+            def align(ref_idx):
+                aligned.append(ref_idx)
+                return scores[ref_idx], ref_idx
+            best, num_aligned, num_skipped = search_best_hits(candidates,
+                    bound.upper_bounds(clone, candidates), align)
+            best_score = max(scores)
+            self.assertEqual(sorted(best), [ref_idx for ref_idx, score in
+                                            enumerate(scores)
+                                            if score == best_score])
+            self.assertEqual(num_aligned, len(aligned))
+            self.assertEqual(num_aligned + num_skipped, len(candidates))
+
+if __name__ == '__main__': unittest.main()
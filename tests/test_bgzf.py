@@ -0,0 +1,111 @@
+'''checks BGZF reading and writing, virtual offsets and RegionIndex.fetch'''
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from clonechecker import bgzf
+
+def random_bed(rng, num_lines):
+    '''returns the lines of an unsorted BED file with a few comments'''
+    lines = ['# a comment\n', 'track name=test\n']
+    for i in xrange(num_lines):
+        start = rng.randint(0, 100000)
+        lines.append('chr%d\t%d\t%d\tname%d\n' % (rng.randint(1, 3), start,
+                                               start + rng.randint(1, 2000),
+                                               i))
+    return lines
+
+class BgzfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rng = random.Random(14)
+        # spans several blocks
+        self.lines = random_bed(self.rng, 20000)
+        self.text = ''.join(self.lines)
+        self.plain = os.path.join(self.tmpdir, 'regions.bed')
+        self.compressed = self.plain + '.gz'
+        fh = open(self.plain, 'w')
+        fh.write(self.text)
+        fh.close()
+        bgzf.compress_file(self.plain, self.compressed)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        self.assertTrue(bgzf.is_bgzf(self.compressed))
+        self.assertFalse(bgzf.is_bgzf(self.plain))
+        # any gzip reader can read it
+        self.assertEqual(gzip.open(self.compressed).read(), self.text)
+        for processes in None, 2:
+            fh = bgzf.BgzfReader(self.compressed, processes=processes)
+            self.assertEqual(list(fh), self.lines)
+            fh.close()
+        fh = bgzf.BgzfReader(self.compressed)
+        self.assertEqual(fh.read(), self.text)
+        fh.close()
+
+    def test_virtual_offsets(self):
+        for processes in None, 2:
+            fh = bgzf.BgzfReader(self.compressed, processes=processes)
+            offsets = []
+            while True:
+                offset = fh.tell()
+                line = fh.readline()
+                if line == '': break
+                offsets.append(offset)
+            self.assertEqual(len(offsets), len(self.lines))
+            for i in self.rng.sample(xrange(len(offsets)), 200):
+                fh.seek(offsets[i])
+                self.assertEqual(fh.readline(), self.lines[i])
+                self.assertEqual(fh.read(100),
+                                 ''.join(self.lines[i + 1:])[:100])
+            fh.close()
+
+    def test_readlines(self):
+        fh = bgzf.BgzfReader(self.compressed)
+        lines = []
+        while True:
+            chunk = fh.readlines(10000)
+            if len(chunk) == 0: break
+            lines.extend(chunk)
+        fh.close()
+        self.assertEqual(lines, self.lines)
+
+    def brute_force_fetch(self, chrom, start, end):
+        hits = []
+        for line in self.lines:
+            fields = line.split('\t')
+            if fields[0] == chrom and fields[1].isdigit() and \
+                    int(fields[1]) < end and int(fields[2]) > start:
+                hits.append(line)
+        return hits
+
+    def test_fetch(self):
+        index = bgzf.RegionIndex(self.compressed)
+        self.assertTrue(os.path.exists(self.compressed + bgzf.INDEX_SUFFIX))
+        # and once more from the saved index
+        for index in index, bgzf.RegionIndex(self.compressed):
+            for i in xrange(100):
+                chrom = 'chr%d' % self.rng.randint(1, 4)
+                start = self.rng.randint(0, 105000)
+                end = start + self.rng.randint(1, 5000)
+                self.assertEqual(list(index.fetch(chrom, start, end)),
+                                 self.brute_force_fetch(chrom, start, end))
+            index.close()
+
+    def test_index_not_saved(self):
+        # an index that cannot be written is simply not saved
+        index_filename = self.compressed + bgzf.INDEX_SUFFIX
+        os.mkdir(index_filename)
+        os.utime(index_filename, (0, 0))
+        index = bgzf.RegionIndex(self.compressed)
+        self.assertEqual(list(index.fetch('chr1', 0, 1000)),
+                         self.brute_force_fetch('chr1', 0, 1000))
+        index.close()
+        self.assertTrue(os.path.isdir(index_filename))
+
+if __name__ == '__main__': unittest.main()
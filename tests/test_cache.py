@@ -0,0 +1,88 @@
+'''checks the alignment cache and the alignment records it stores'''
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy
+from cogent import DNA
+from clonechecker.align import align_clone_to_ref, alignment_from_record, \
+                              CloneAlignment, AlignmentError
+from clonechecker.cache import AlignmentCache, alignment_key, sequence_digest
+from clonechecker.quality import QUALITY_KEY
+from test_smithwaterman import random_pairs, EDGE_CASES
+
+class AlignmentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = AlignmentCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_keys(self):
+        seq = DNA.makeSequence('ACGT')
+        with_quality = DNA.makeSequence('ACGT', Info={QUALITY_KEY:
+                numpy.array([30, 30, 30, 2], dtype=numpy.uint8)})
+        self.assertNotEqual(sequence_digest(seq),
+                            sequence_digest(with_quality))
+        keys = set([alignment_key('a', 'b'), alignment_key('a', 'b', True),
+                    alignment_key('b', 'a'), alignment_key('a', 'b', False, 5),
+                    alignment_key('a', 'b', False, 'numpy')])
+        self.assertEqual(len(keys), 5)
+
+    def test_dict(self):
+        key = alignment_key('a', 'b')
+        self.assertFalse(key in self.cache)
+        self.assertRaises(KeyError, self.cache.__getitem__, key)
+        self.cache[key] = {'ops': '4='}
+        self.cache[alignment_key('a', 'c')] = None
+        self.assertTrue(key in self.cache)
+        self.assertEqual(self.cache[key], {'ops': '4='})
+        self.assertEqual(self.cache[alignment_key('a', 'c')], None)
+        # another process sees the same records
+        self.assertEqual(AlignmentCache(self.cache.directory)[key],
+                         {'ops': '4='})
+
+    def test_evict(self):
+        keys = [alignment_key(str(i), 'ref') for i in xrange(10)]
+        now = time.time()
+        for i, key in enumerate(keys):
+            self.cache[key] = {'ops': '%d=' % i}
+            # written one minute apart, oldest first
+            os.utime(self.cache._path(key), (now - 600 + 60 * i,) * 2)
+        # reading a record makes it the most recently used
+        self.cache[keys[0]]
+        record_size = self.cache.size() // len(keys)
+        self.cache.max_size = 4 * record_size
+        self.assertEqual(self.cache.evict(), 6)
+        self.assertEqual([key for key in keys if key in self.cache],
+                         [keys[0]] + keys[7:])
+        self.assertEqual(self.cache.evict(), 0)
+
+class AlignmentRecordTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for i, (clone, reference) in enumerate(list(random_pairs(60, seed=5)) +
+                                               EDGE_CASES):
+            clone = DNA.makeSequence(clone, Name='clone')
+            if i % 2:
+                clone.Info[QUALITY_KEY] = numpy.arange(len(clone),
+                                                       dtype=numpy.uint8)
+            reference = DNA.makeSequence(reference, Name='reference')
+            try:
+                aln = align_clone_to_ref(clone, reference, aligner='numpy',
+                                         mask_quality=20)
+            except AlignmentError:
+                continue
+            record = aln.to_record()
+            rebuilt = alignment_from_record(clone, reference, record)
+            self.assertEqual(map(str, rebuilt.Seqs), map(str, aln.Seqs))
+            self.assertEqual(rebuilt.Names, aln.Names)
+            for field in CloneAlignment.RECORD_FIELDS:
+                self.assertEqual(getattr(rebuilt, field), getattr(aln, field))
+            self.assertEqual(rebuilt.is_match(), aln.is_match())
+            self.assertEqual(rebuilt.score(), aln.score())
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,143 @@
+'''checks how scripts/checkmyclones.py plans and runs its tasks'''
+import imp
+import os
+import random
+import sys
+import unittest
+from collections import defaultdict
+from logging import WARNING
+from pickle import loads
+from StringIO import StringIO
+from cogent import DNA
+from clonechecker.align import align_clone_to_ref
+from clonechecker.exact import ExactMatcher
+from clonechecker.kmers import KmerIndex
+
+checkmyclones = imp.load_source('checkmyclones',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                     'scripts', 'checkmyclones.py'))
+
+CONTEXT = {'logging_level': WARNING, 'cache_dir': None, 'profile': None,
+           'stats_json': None, 'aligner': 'numpy', 'band': None,
+           'mask_quality': None, 'min_seed_hits': 0, 'kmer_size': 12}
+
+def random_dna(rng, length):
+    return ''.join(rng.choice('ACGT') for i in xrange(length))
+
+def rc(s):
+    return str(DNA.makeSequence(s).rc())
+
+class PlanTasksTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(6)
+        refs = [random_dna(rng, 40) for i in xrange(4)]
+        self.refs = [DNA.makeSequence(ref, Name='ref%d' % i) for i, ref in
+                     enumerate(refs)]
+        # clone0 has ref0 forward and ref2 reverse complemented, clone1 has
+        # a mutated ref1 and nothing exact
+        mutated = refs[1][:20] + 'A' + refs[1][21:]
+        if mutated == refs[1]: mutated = refs[1][:20] + 'C' + refs[1][21:]
+        self.clones = [DNA.makeSequence(random_dna(rng, 10) + refs[0] +
+                                        random_dna(rng, 5) + rc(refs[2]) +
+                                        random_dna(rng, 10), Name='clone0'),
+                       DNA.makeSequence(random_dna(rng, 10) + mutated +
+                                        random_dna(rng, 10), Name='clone1')]
+
+    def plan(self, **kwargs):
+        pending = {}
+        counts = defaultdict(int)
+        tasks = list(checkmyclones.plan_tasks(self.clones, self.refs, pending,
+                                              counts, **kwargs))
+        self.assertEqual(sum(pending.values()), len(tasks))
+        return tasks, counts
+
+    def test_only_exact_pairs_skip_alignment(self):
+        kmer_index = KmerIndex(self.refs, k=12)
+        for kwargs in ({}, {'rc': True}, {'forward': False, 'rc': True},
+                       {'rc': True, 'kmer_index': kmer_index,
+                        'min_seed_hits': 10}):
+            plain, plain_counts = self.plan(**kwargs)
+            exact, counts = self.plan(exact_matcher=ExactMatcher(self.refs),
+                                      **kwargs)
+            # the same pairs, in the same order
+            self.assertEqual([task[:3] for task in exact],
+                             [task[:3] for task in plain])
+            self.assertTrue(all(task[4] is None for task in plain))
+            exact_pairs = [task[:3] for task in exact if task[4] is not None]
+            expected = []
+            if kwargs.get('forward', True): expected.append((0, False, 0))
+            if kwargs.get('rc'): expected.append((0, True, 2))
+            self.assertEqual(sorted(exact_pairs), sorted(expected))
+            self.assertEqual(counts['exact'], len(expected))
+            # the mutated clone is still aligned to its reference
+            self.assertTrue(any(task[0] == 1 and task[2] == 1
+                                for task in exact))
+
+    def test_best_hit(self):
+        tasks, counts = self.plan(rc=True, best_hit=True,
+                                  exact_matcher=ExactMatcher(self.refs))
+        candidates = tasks[1][2]
+        self.assertEqual(len(candidates), 2 * len(self.refs))
+        self.assertEqual([candidate[:2] for candidate in candidates
+                          if candidate[4] is not None],
+                         [(False, 0), (True, 2)])
+
+    def test_exact_tasks_match_alignment(self):
+        # an exact task gives the same alignment as aligning the pair
+        checkmyclones.init_worker(self.clones, self.refs, CONTEXT)
+        tasks, counts = self.plan(rc=True,
+                                  exact_matcher=ExactMatcher(self.refs))
+        for task in tasks:
+            if task[4] is None: continue
+            kind, result = checkmyclones.do_task(task)
+            self.assertEqual(kind, 'exact')
+            exact = loads(result[1][0])[1]
+            kind, result = checkmyclones.do_task(task[:4] + (None,))
+            self.assertEqual(kind, 'aligned')
+            aligned = loads(result[1][0])[1]
+            self.assertTrue(exact.is_match())
+            records = [exact.to_record(), aligned.to_record()]
+            for record in records:
+                record['masked_positions'] = list(record['masked_positions'])
+            self.assertEqual(records[0], records[1])
+            self.assertEqual(map(str, exact.Seqs), map(str, aligned.Seqs))
+
+class RecordingWriter(object):
+    '''a variant writer that keeps what it is given'''
+
+    def __init__(self):
+        self.written = []
+
+    def write_alignment(self, aln, variants):
+        self.written.append((aln.Reference.Name, variants))
+
+class ReportCloneTest(unittest.TestCase):
+
+    def report(self, alns):
+        writer = RecordingWriter()
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            checkmyclones.report_clone('clone', alns, [], [writer])
+        finally:
+            sys.stdout = stdout
+        return writer.written
+
+    def test_gapped_alignments_are_written(self):
+        rng = random.Random(9)
+        ref = random_dna(rng, 60)
+        clone = DNA.makeSequence(ref[:30] + 'GG' + ref[30:], Name='clone')
+        gapped = align_clone_to_ref(clone, DNA.makeSequence(ref, Name='ref'),
+                                    aligner='numpy')
+        self.assertTrue(gapped.has_gaps and not gapped.is_truncated)
+        written = self.report([gapped])
+        self.assertEqual([(name, [variant[3] for variant in variants]) for
+                          name, variants in written], [('ref', ['INS'])])
+        # an alignment to part of a reference is not
+        partial = align_clone_to_ref(clone, DNA.makeSequence(ref + 'A' * 20,
+                                     Name='longer'), aligner='numpy')
+        self.assertTrue(partial.is_truncated)
+        self.assertEqual(self.report([partial]), [])
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,50 @@
+'''checks ExactMatcher against str.find on clones with planted references'''
+import random
+import unittest
+from cogent import DNA
+from clonechecker.exact import ExactMatcher
+
+def random_dna(rng, length):
+    return ''.join(rng.choice('ACGT') for i in xrange(length))
+
+def brute_force_find(references, s):
+    '''returns ref_idx -> first position of each reference that occurs in s'''
+    return dict((ref_idx, s.find(ref)) for ref_idx, ref in
+                enumerate(references) if len(ref) > 0 and ref in s)
+
+class ExactMatcherTest(unittest.TestCase):
+
+    def test_planted(self):
+        rng = random.Random(6)
+        # shorter than, as long as and longer than the 16-base prefix,
+        # including two that are identical and one inside another
+        references = [random_dna(rng, length) for length in
+                      [4, 6, 6, 11, 15, 16, 17, 24, 40, 100, 250]]
+        references.append(references[8])
+        references.append(references[9][30:52])
+        references.append('')
+        matcher = ExactMatcher(references)
+        self.assertEqual(len(matcher), len(references))
+        for i in xrange(300):
+            clone = random_dna(rng, rng.randint(0, 50))
+            for j in xrange(rng.randint(0, 3)):
+                ref = rng.choice(references)
+                if rng.random() < 0.5:
+                    ref = str(DNA.makeSequence(ref).rc())
+                pos = rng.randint(0, len(clone))
+                clone = clone[:pos] + ref + clone[pos:]
+            clone = DNA.makeSequence(clone)
+            for query in clone, clone.rc():
+                self.assertEqual(matcher.find(query),
+                                 brute_force_find(references, str(query)))
+
+    def test_overlapping_and_repeated(self):
+        matcher = ExactMatcher(['ACGTACGTACGTACGTAC', 'ACGTAC', 'TTTT'])
+        self.assertEqual(matcher.find('GGACGTACGTACGTACGTACGTACGTAC'),
+                         {0: 2, 1: 2})
+        self.assertEqual(matcher.find('TTTTTT'), {2: 0})
+        self.assertEqual(matcher.find(''), {})
+        # matching is case-sensitive
+        self.assertEqual(matcher.find('acgtac'), {})
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,65 @@
+'''checks write_indexed_fasta and IndexedFasta'''
+import os
+import random
+import shutil
+import stat
+import tempfile
+import unittest
+from clonechecker.fasta import IndexedFasta, write_indexed_fasta, index_path
+
+class IndexedFastaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'regions.fa')
+        rng = random.Random(11)
+        self.records = [('region%d (chr1:%d-%d)' % (i, i, i + length),
+                         ''.join(rng.choice('ACGTN') for j in xrange(length)))
+                        for i, length in enumerate([0, 1, 59, 60, 61, 120,
+                                                    1000])]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        for line_length in 60, 7:
+            write_indexed_fasta(self.filename, self.records,
+                                line_length=line_length)
+            fasta = IndexedFasta(self.filename)
+            self.assertEqual(fasta.names(),
+                             [name for name, seq in self.records])
+            self.assertEqual(len(fasta), len(self.records))
+            for name, seq in self.records:
+                self.assertTrue(name in fasta)
+                self.assertEqual(fasta.sequence_size(name), len(seq))
+                self.assertEqual(fasta[name], seq)
+                for start, end in (0, 1), (5, 70), (59, 61), (-3, 2000), \
+                                  (10, 10), (30, 5):
+                    self.assertEqual(fasta.fetch(name, start, end),
+                                     seq[max(0, start):end])
+            fasta.close()
+            self.assertFalse('region9' in IndexedFasta(self.filename))
+
+    def test_samtools_layout(self):
+        # the index is laid out as samtools faidx would write it
+        write_indexed_fasta(self.filename, [('a', 'ACGT' * 20), ('b', 'T')])
+        self.assertEqual(open(self.filename).read(),
+                         '>a\n' + 'ACGT' * 15 + '\n' + 'ACGT' * 5 + '\n' +
+                         '>b\nT\n')
+        self.assertEqual(open(index_path(self.filename)).read(),
+                         'a\t80\t3\t60\t61\nb\t1\t88\t60\t61\n')
+
+    def test_permissions(self):
+        # files are created as open would create them, not private to the
+        # user like a temporary file
+        umask = os.umask(022)
+        try:
+            write_indexed_fasta(self.filename, self.records)
+        finally:
+            os.umask(umask)
+        for filename in self.filename, index_path(self.filename):
+            self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0644)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['regions.fa', 'regions.fa.fai'])
+
+if __name__ == '__main__': unittest.main()
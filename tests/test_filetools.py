@@ -0,0 +1,73 @@
+'''checks that load_seq_files reads clone directories in order'''
+import os
+import shutil
+import tempfile
+import unittest
+from clonechecker.filetools import load_seq_files, find_seq_files
+from clonechecker.quality import get_quality
+
+FILES = {
+    'a.fa': '>a1\nACGT\nAC\n>a2\nGGGG\n',
+    'b.fastq': '@b1\nACGTA\n+\nIIII#\n',
+    'c.seq': 'acgt\nacgt\n',
+    # gives c.seq its qualities
+    'c.qual': '10 20 30 40 10 20 30 40\n',
+    '.hidden.fa': '>hidden\nAAAA\n',
+    'sub/d.fa': '>d1\nTTTT\n',
+    'sub/deeper/e.fa': '>e1\nCCCC\n',
+    # a quality character below '!', which can't be read
+    'sub/f.fastq': '@f1\nACGT\n+\nII\x01I\n',
+}
+
+class LoadSeqFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name, text in FILES.items():
+            path = os.path.join(self.tmpdir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fh = open(path, 'w')
+            fh.write(text)
+            fh.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_find_seq_files(self):
+        self.assertEqual(list(find_seq_files(self.tmpdir)),
+                         [self.path(name) for name in 'a.fa', 'b.fastq',
+                          'c.seq', 'sub/d.fa', 'sub/f.fastq',
+                          'sub/deeper/e.fa'])
+        self.assertEqual(list(find_seq_files(self.tmpdir, recursive=False)),
+                         [])
+        self.assertEqual(list(find_seq_files([self.path('sub/*.fa'),
+                                              self.path('*.fa')])),
+                         [self.path('sub/d.fa'), self.path('a.fa')])
+
+    def test_load(self):
+        expected = [('a1 (%s)' % self.path('a.fa'), 'ACGTAC'),
+                    ('a2 (%s)' % self.path('a.fa'), 'GGGG'),
+                    ('b1 (%s)' % self.path('b.fastq'), 'ACGTA'),
+                    ('c.seq (%s)' % self.path('c.seq'), 'ACGTACGT'),
+                    ('d1 (%s)' % self.path('sub/d.fa'), 'TTTT'),
+                    ('e1 (%s)' % self.path('sub/deeper/e.fa'), 'CCCC')]
+        for processes in None, 2:
+            for packed in False, True:
+                seqs, stats = load_seq_files(self.tmpdir, processes=processes,
+                                             packed=packed)
+                self.assertEqual([(seq.Name, str(seq).upper())
+                                  for seq in seqs], expected)
+                self.assertEqual(stats.files, 5)
+                self.assertEqual(stats.failed, [self.path('sub/f.fastq')])
+                if packed: continue
+                self.assertEqual(get_quality(seqs[2]).tolist(),
+                                 [40, 40, 40, 40, 2])
+                self.assertEqual(get_quality(seqs[3]).tolist(),
+                                 [10, 20, 30, 40] * 2)
+                self.assertEqual(get_quality(seqs[0]), None)
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,129 @@
+'''checks IntervalIndex queries against brute-force scans of random intervals'''
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy
+from clonechecker.bedtable import BedTable
+from clonechecker.intervals import IntervalIndex, INDEX_SUFFIX
+
+CHROMS = ['chr1', 'chr2', 'chrX']
+
+def random_table(rng, num_rows):
+    '''returns a BedTable of random (often overlapping and nested) intervals'''
+    chroms, starts, ends, names = [], [], [], []
+    for i in xrange(num_rows):
+        start = rng.randint(0, 5000)
+        chroms.append(rng.choice(CHROMS))
+        starts.append(start)
+        ends.append(start + rng.choice([1, rng.randint(1, 50),
+                                        rng.randint(1, 1000)]))
+        names.append('peak%d' % i)
+    return BedTable.from_columns(chroms, starts, ends, names)
+
+def random_queries(rng, num_queries):
+    '''yields (chrom, start, end), including chromosomes without intervals'''
+    for i in xrange(num_queries):
+        start = rng.randint(-10, 5100)
+        yield (rng.choice(CHROMS + ['chrY']), start,
+               start + rng.randint(1, 300))
+
+def brute_force(table, test):
+    '''returns the rows of table for which test(chrom, start, end) is true'''
+    return [i for i, (chrom, start, end, name) in enumerate(table)
+            if test(chrom, start, end)]
+
+def distance(start, end, pos):
+    '''returns the distance in bases between [start, end) and pos'''
+    if pos < start: return start - pos
+    if pos >= end: return pos - end + 1
+    return 0
+
+class IntervalIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(15)
+        self.table = random_table(self.rng, 500)
+        self.index = IntervalIndex(self.table)
+
+    def check_queries(self, index):
+        for q_chrom, q_start, q_end in random_queries(self.rng, 300):
+            self.assertEqual(index.overlap(q_chrom, q_start, q_end).tolist(),
+                brute_force(self.table, lambda chrom, start, end:
+                    chrom == q_chrom and start < q_end and end > q_start))
+            self.assertEqual(index.contained(q_chrom, q_start, q_end).tolist(),
+                brute_force(self.table, lambda chrom, start, end:
+                    chrom == q_chrom and start >= q_start and end <= q_end))
+            self.assertEqual(
+                index.containing(q_chrom, q_start, q_end).tolist(),
+                brute_force(self.table, lambda chrom, start, end:
+                    chrom == q_chrom and start <= q_start and end >= q_end))
+
+    def test_queries(self):
+        self.check_queries(self.index)
+
+    def test_whole_table_queries(self):
+        queries = BedTable.from_columns(*zip(*random_queries(self.rng, 300)))
+        overlaps = self.index.overlaps_any(queries)
+        contained = self.index.contained_in_any(queries)
+        for i, (q_chrom, q_start, q_end, name) in enumerate(queries):
+            self.assertEqual(overlaps[i], len(brute_force(self.table,
+                lambda chrom, start, end: chrom == q_chrom and
+                    start < q_end and end > q_start)) > 0)
+            self.assertEqual(contained[i], len(brute_force(self.table,
+                lambda chrom, start, end: chrom == q_chrom and
+                    start <= q_start and end >= q_end)) > 0)
+
+    def test_nearest(self):
+        chroms = [self.rng.choice(CHROMS + ['chrY']) for i in xrange(500)]
+        positions = [self.rng.randint(-10, 6100) for i in xrange(500)]
+        rows, distances = self.index.nearest(chroms, positions)
+        for q_chrom, pos, row, dist in zip(chroms, positions, rows, distances):
+            candidates = [distance(start, end, pos) for chrom, start, end,
+                          name in self.table if chrom == q_chrom]
+            if len(candidates) == 0:
+                self.assertEqual((row, dist), (-1, -1))
+                continue
+            self.assertEqual(dist, min(candidates))
+            chrom, start, end, name = self.table[row]
+            self.assertEqual((chrom, distance(start, end, pos)),
+                             (q_chrom, dist))
+
+    def test_save_load(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'peaks.iix.npz')
+            self.index.save(filename)
+            index = IntervalIndex.load(filename)
+            self.assertEqual(index.table.regions(), self.table.regions())
+            self.assertEqual(index.table.names(), self.table.names())
+            self.check_queries(index)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_for_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'peaks.bed')
+            fh = open(filename, 'w')
+            for chrom, start, end, name in self.table:
+                fh.write('%s\t%d\t%d\t%s\n' % (chrom, start, end, name))
+            fh.close()
+            index = IntervalIndex.for_file(filename)
+            self.assertTrue(os.path.exists(filename + INDEX_SUFFIX))
+            self.check_queries(index)
+            # and again from the saved index
+            self.check_queries(IntervalIndex.for_file(filename))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_empty(self):
+        index = IntervalIndex(BedTable.from_columns([], [], []))
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.overlap('chr1', 0, 100).tolist(), [])
+        rows, distances = index.nearest(['chr1'], [10])
+        self.assertEqual((rows.tolist(), distances.tolist()), ([-1], [-1]))
+        self.assertFalse(numpy.any(index.overlaps_any(self.table)))
+
+if __name__ == '__main__': unittest.main()
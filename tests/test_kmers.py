@@ -0,0 +1,129 @@
+'''checks that KmerIndex finds the references planted in clones'''
+import random
+import unittest
+from collections import defaultdict
+from cogent import DNA
+from clonechecker.kmers import KmerIndex
+
+def random_dna(rng, length):
+    return ''.join(rng.choice('ACGT') for i in xrange(length))
+
+def substitute(rng, seq, count):
+    '''returns seq with count random substitutions'''
+    seq = list(seq)
+    for pos in rng.sample(xrange(len(seq)), count):
+        seq[pos] = rng.choice([base for base in 'ACGT' if base != seq[pos]])
+    return ''.join(seq)
+
+def rc(s):
+    return str(DNA.makeSequence(s).rc())
+
+def brute_force_votes(references, query, k):
+    '''returns ref_idx -> number of (query k-mer, reference k-mer) matches'''
+    votes = defaultdict(int)
+    for ref_idx, ref in enumerate(references):
+        for i in xrange(len(query) - k + 1):
+            kmer = query[i:i + k]
+            if 'N' in kmer: continue
+            for j in xrange(len(ref) - k + 1):
+                if ref[j:j + k] == kmer: votes[ref_idx] += 1
+    return dict(votes)
+
+class KmerIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(1)
+        self.references = [random_dna(self.rng, self.rng.randint(40, 300))
+                           for i in xrange(50)]
+        self.index = KmerIndex(self.references)
+
+    def test_recall(self):
+        # every planted reference with up to 3 substitutions (so at least
+        # 40 - 3 * 12 = 4 seeds) is a candidate, on its planted diagonal
+        for i in xrange(200):
+            ref_idx = self.rng.randrange(len(self.references))
+            ref = substitute(self.rng, self.references[ref_idx],
+                             self.rng.randint(0, 3))
+            offset = self.rng.randint(0, 50)
+            clone = random_dna(self.rng, offset) + ref + \
+                    random_dna(self.rng, self.rng.randint(0, 50))
+            candidates = dict((idx, (hits, diagonal)) for idx, hits, diagonal
+                              in self.index.candidates(clone))
+            self.assertTrue(ref_idx in candidates)
+            self.assertEqual(candidates[ref_idx][1], offset)
+
+    def test_votes(self):
+        for i in xrange(20):
+            clone = random_dna(self.rng, 30) + \
+                    self.rng.choice(self.references)[10:60] + \
+                    'NN' + random_dna(self.rng, 30)
+            votes = self.index.vote(clone)
+            self.assertEqual(dict((ref_idx, hits) for ref_idx, (hits,
+                                  diagonal) in votes.iteritems()),
+                             brute_force_votes(self.references, clone, 12))
+            self.assertEqual(sorted(ref_idx for ref_idx, hits, diagonal in
+                                    self.index.candidates(clone, 5)),
+                             sorted(ref_idx for ref_idx, (hits, diagonal) in
+                                    votes.iteritems() if hits >= 5))
+
+    def test_unseedable(self):
+        # too short, or broken up by Ns, to ever reach min_hits seeds
+        references = self.references[:3] + ['ACGTACGTAC',
+                                             'ACGTACGTACGTNACGTACGTACG']
+        index = KmerIndex(references)
+        self.assertEqual(index.unseedable(2), [3, 4])
+        self.assertEqual(index.unseedable(1), [3])
+        clone = random_dna(self.rng, 100)
+        self.assertEqual(sorted(ref_idx for ref_idx, hits, diagonal in
+                                index.candidates(clone, 2)), [3, 4])
+
+class OrientationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(7)
+        self.references = [random_dna(self.rng, self.rng.randint(40, 300))
+                           for i in xrange(50)]
+        self.index = KmerIndex(self.references)
+
+    def plant(self, *refs):
+        clone = random_dna(self.rng, self.rng.randint(0, 50))
+        for ref in refs:
+            clone += ref + random_dna(self.rng, self.rng.randint(0, 50))
+        return clone
+
+    def test_stranded_vote(self):
+        for i in xrange(20):
+            ref = self.rng.choice(self.references)
+            clone = self.plant(ref[:60], rc(self.rng.choice(self.references)))
+            self.assertEqual(self.index.stranded_vote(clone),
+                             (self.index.vote(clone),
+                              self.index.vote(rc(clone))))
+
+    def test_one_strand(self):
+        for i in xrange(50):
+            ref_idx = self.rng.randrange(len(self.references))
+            reverse = self.rng.random() < 0.5
+            ref = self.references[ref_idx]
+            clone = self.plant(rc(ref) if reverse else ref)
+            candidates, confidence = self.index.oriented_candidates(clone)
+            self.assertEqual([candidate[1] for candidate in candidates
+                              if candidate[0] == ref_idx], [reverse])
+            # the planted reference is the best candidate
+            self.assertEqual(candidates[0][:2], (ref_idx, reverse))
+            self.assertTrue(confidence > 0.9)
+
+    def test_both_strands(self):
+        for i in xrange(50):
+            ref_idx = self.rng.randrange(len(self.references))
+            ref = self.references[ref_idx]
+            clone = self.plant(ref, rc(ref))
+            candidates, confidence = self.index.oriented_candidates(clone)
+            self.assertEqual([candidate[1] for candidate in candidates
+                              if candidate[0] == ref_idx], [False, True])
+            self.assertTrue(0.4 < confidence < 0.6)
+
+    def test_no_candidates(self):
+        self.assertEqual(self.index.oriented_candidates('ACGT' * 3),
+                         ([], None))
+
+if __name__ == '__main__': unittest.main()
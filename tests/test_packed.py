@@ -0,0 +1,79 @@
+'''checks PackedSequence against plain strings and cogent sequences'''
+import cPickle
+import pickle
+import random
+import unittest
+import numpy
+from cogent import DNA
+from clonechecker.packed import PackedSequence
+
+def random_seq(rng, length):
+    '''returns random bases, mostly ACGT with some N and other IUPAC codes'''
+    return ''.join(rng.choice('ACGT' * 10 + 'NNRYKMSWBDHV-?')
+                   for i in xrange(length))
+
+class PackedSequenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(21)
+        self.seqs = [random_seq(self.rng, length) for length in
+                     range(10) + [63, 64, 65, 200]]
+
+    def test_str(self):
+        for s in self.seqs:
+            self.assertEqual(str(PackedSequence.from_string(s)), s)
+            self.assertEqual(str(PackedSequence.from_string(s.lower())), s)
+        self.assertRaises(ValueError, PackedSequence.from_string, 'ACGTJ')
+
+    def test_rc(self):
+        for s in self.seqs:
+            seq = PackedSequence.from_string(s)
+            self.assertEqual(str(seq.rc()), str(DNA.makeSequence(s).rc()))
+            self.assertEqual(str(seq.rc().rc()), s)
+
+    def test_slicing(self):
+        for s in self.seqs:
+            seq = PackedSequence.from_string(s)
+            for i in xrange(30):
+                start = self.rng.randint(-len(s) - 2, len(s) + 2)
+                stop = self.rng.randint(-len(s) - 2, len(s) + 2)
+                step = self.rng.choice([1, 1, 2, -1, -3])
+                self.assertEqual(str(seq[start:stop:step]), s[start:stop:step])
+                # slices of slices, and their reverse complements
+                part = seq[start:stop]
+                self.assertEqual(str(part[1:-1]), s[start:stop][1:-1])
+                self.assertEqual(str(part.rc()),
+                                 str(DNA.makeSequence(s[start:stop]).rc()))
+            for i in xrange(-len(s), len(s)):
+                self.assertEqual(seq[i], s[i])
+            self.assertRaises(IndexError, seq.__getitem__, len(s))
+
+    def test_quality(self):
+        s = self.seqs[-1]
+        quality = numpy.arange(len(s), dtype=numpy.uint8)
+        seq = PackedSequence.from_string(s, quality=quality)
+        self.assertEqual(seq[10:20].Info['quality'].tolist(), range(10, 20))
+        self.assertEqual(seq.rc().Info['quality'].tolist(),
+                         range(len(s))[::-1])
+
+    def test_pickle_keeps_mask(self):
+        for s in self.seqs:
+            seq = PackedSequence.from_string(s, Name='clone',
+                    quality=numpy.zeros(len(s), dtype=numpy.uint8))
+            for part in seq, seq[3:], seq[5:-2], seq.rc()[1:]:
+                for module in pickle, cPickle:
+                    copy = module.loads(module.dumps(part, 2))
+                    self.assertEqual(str(copy), str(part))
+                    self.assertEqual(copy.Name, 'clone')
+                    self.assertEqual(len(copy.Info['quality']), len(part))
+                    # only the bases of the slice are kept
+                    self.assertTrue(copy.nbytes() <= part.compact().nbytes())
+
+    def test_cogent(self):
+        s = self.seqs[-1]
+        seq = PackedSequence.from_string(s, Name='clone')
+        cogent_seq = seq.to_cogent()
+        self.assertEqual((str(cogent_seq), cogent_seq.Name), (s, 'clone'))
+        self.assertEqual(str(PackedSequence.from_seq(cogent_seq)), s)
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,105 @@
+'''checks Mott trimming and the masking of low-quality mismatches'''
+import random
+import unittest
+import numpy
+from cogent import DNA
+from clonechecker.packed import PackedSequence
+from clonechecker.quality import mott_trim, trim_seqs, masked_mismatches, \
+                                 get_quality, QUALITY_KEY
+
+def brute_force_mott(quality, cutoff):
+    '''
+    returns the (start, end) with the highest total score, the earliest end
+    and then the latest start, as mott_trim does
+    '''
+    scores = cutoff - 10.0 ** (-numpy.asarray(quality, dtype=float) / 10.0)
+    sums = numpy.concatenate(([0.0], numpy.cumsum(scores)))
+    best, best_start, best_end = 0.0, 0, 0
+    for end in xrange(len(quality) + 1):
+        for start in xrange(end + 1):
+            if sums[end] - sums[start] > best:
+                best, best_start, best_end = sums[end] - sums[start], \
+                                             start, end
+            elif sums[end] - sums[start] == best and best > 0 and \
+                    end == best_end:
+                best_start = start
+    return best_start, best_end
+
+def make_seq(name, s, quality):
+    return DNA.makeSequence(s, Name=name, Info={QUALITY_KEY: quality})
+
+class MottTrimTest(unittest.TestCase):
+
+    def test_brute_force(self):
+        rng = random.Random(20)
+        for i in xrange(300):
+            length = rng.randint(0, 40)
+            # a good middle with noisy ends, or anything at all
+            quality = [rng.choice([rng.randint(0, 15), rng.randint(20, 40)])
+                       for j in xrange(length)]
+            for cutoff in 0.05, 0.2:
+                self.assertEqual(mott_trim(quality, cutoff),
+                                 brute_force_mott(quality, cutoff))
+
+    def test_edge_cases(self):
+        self.assertEqual(mott_trim([]), (0, 0))
+        self.assertEqual(mott_trim([0, 1, 2]), (0, 0))
+        self.assertEqual(mott_trim([40] * 10), (0, 10))
+        self.assertEqual(mott_trim([2, 2, 40, 40, 40, 2]), (2, 5))
+
+class TrimSeqsTest(unittest.TestCase):
+
+    def test_trim_seqs(self):
+        quality = numpy.array([2, 3, 40, 40, 40, 40, 5], dtype=numpy.uint8)
+        seqs = [make_seq('trimmed', 'ACGTACG', quality),
+                PackedSequence.from_string('ACGTACG', Name='packed',
+                                           quality=quality),
+                make_seq('good', 'ACG', numpy.array([40, 40, 40],
+                                                    dtype=numpy.uint8)),
+                DNA.makeSequence('ACGT', Name='no quality'),
+                make_seq('bad', 'AC', numpy.array([1, 1], dtype=numpy.uint8))]
+        trimmed, trims = trim_seqs(seqs)
+        self.assertEqual([(seq.Name, str(seq)) for seq in trimmed],
+                         [('trimmed', 'GTAC'), ('packed', 'GTAC'),
+                          ('good', 'ACG'), ('no quality', 'ACGT')])
+        self.assertEqual(trims, [('trimmed', 2, 1, 4), ('packed', 2, 1, 4),
+                                 ('bad', 0, 2, 0)])
+        for seq in trimmed[:2]:
+            self.assertEqual(get_quality(seq).tolist(), [40] * 4)
+        # the original qualities are left alone
+        self.assertEqual(get_quality(seqs[0]).tolist(), quality.tolist())
+
+class MaskedMismatchesTest(unittest.TestCase):
+
+    def test_brute_force(self):
+        rng = random.Random(20)
+        for i in xrange(200):
+            length = rng.randint(1, 30)
+            aligned_clone = ''.join(rng.choice('ACGT-') for j in xrange(length))
+            aligned_ref = ''.join(rng.choice('ACGT-') for j in xrange(length))
+            first_clone_pos = rng.randint(0, 5)
+            clone_len = first_clone_pos + length - aligned_clone.count('-')
+            quality = numpy.array([rng.randint(0, 40) for j in
+                                   xrange(clone_len)], dtype=numpy.uint8)
+            clone = make_seq('clone', 'A' * clone_len, quality)
+            expected = ([], [])
+            clone_pos = first_clone_pos
+            for column, (c, r) in enumerate(zip(aligned_clone, aligned_ref)):
+                if c == '-': continue
+                if r != '-' and c != r and quality[clone_pos] < 20:
+                    expected[0].append(column)
+                    expected[1].append(clone_pos)
+                clone_pos += 1
+            self.assertEqual(masked_mismatches(clone, aligned_clone,
+                                               aligned_ref, first_clone_pos,
+                                               20), expected)
+
+    def test_no_quality(self):
+        clone = DNA.makeSequence('ACGT', Name='clone')
+        self.assertEqual(masked_mismatches(clone, 'ACGT', 'TTTT', 0, 20),
+                         ([], []))
+        clone = make_seq('clone', 'ACGT', numpy.zeros(4, dtype=numpy.uint8))
+        self.assertEqual(masked_mismatches(clone, 'ACGT', 'TTTT', 0, None),
+                         ([], []))
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,153 @@
+'''
+checks that the numpy Smith-Waterman aligner (clonechecker.smithwaterman)
+finds the same alignments as cogent's sw_align
+'''
+import random
+import unittest
+from cogent import DNA
+from cogent.align.algorithm import sw_align, SmithWatermanMatrix
+from clonechecker import smithwaterman
+from clonechecker.align import align_clone_to_ref, edit_ops, AlignmentError
+from clonechecker.packed import PackedSequence
+
+FLAGS = ('first_clone_pos', 'last_clone_pos', 'first_ref_pos',
+         'last_ref_pos', 'reference_len', 'is_truncated', 'has_gaps',
+         'has_mismatches', 'ops')
+
+def cogent_local_align(seq1, seq2):
+    '''
+    aligns seq1 and seq2 with cogent and returns the same
+    (aligned, score, coords, ops) as smithwaterman.local_align
+    '''
+    matrix = SmithWatermanMatrix(seq1, seq2)
+    aligned = matrix.alignment()
+    score, end_2, end_1 = matrix.MaxScore
+    aligned_1 = str(aligned[0])
+    aligned_2 = str(aligned[1])
+    start_1 = end_1 - len(aligned_1) + aligned_1.count('-')
+    start_2 = end_2 - len(aligned_2) + aligned_2.count('-')
+    return aligned, score, (start_1, end_1, start_2, end_2), \
+           edit_ops(aligned_1, aligned_2)
+
+def random_dna(rng, length, alphabet='ACGT'):
+    return ''.join(rng.choice(alphabet) for i in xrange(length))
+
+def mutate(rng, seq):
+    '''returns seq with a few random substitutions, insertions and deletions'''
+    seq = list(seq)
+    for i in xrange(rng.randint(0, 4)):
+        pos = rng.randrange(len(seq))
+        kind = rng.choice('SID')
+        if kind == 'S': seq[pos] = rng.choice('ACGTN')
+        elif kind == 'I': seq[pos:pos] = random_dna(rng, rng.randint(1, 4))
+        else: del seq[pos:pos + rng.randint(1, 4)]
+    return ''.join(seq)
+
+def random_pairs(count, seed=0):
+    '''yields (clone, reference) strings: related pairs, and unrelated ones'''
+    rng = random.Random(seed)
+    for i in xrange(count):
+        reference = random_dna(rng, rng.randint(10, 60))
+        if i % 4 == 3:
+            clone = random_dna(rng, rng.randint(1, 60))
+        else:
+            clone = random_dna(rng, rng.randint(0, 15)) + \
+                    mutate(rng, reference) + random_dna(rng, rng.randint(0, 15))
+        yield clone, reference
+
+EDGE_CASES = [('ACGT', 'ACGT'), ('A', 'A'), ('A', 'C'), ('AAAA', 'AA'),
+              ('ACGTN', 'ACGTA'), ('NNNN', 'ACGT'), ('ACNNGT', 'ACGT'),
+              ('ACGTACGT', 'TGCATGCA'), ('GATTACA' * 3, 'GATTACA'),
+              ('CCCCGATTACAGG', 'GATTTTTTACA')]
+
+class LocalAlignTest(unittest.TestCase):
+
+    def assertSameAlignment(self, clone, reference):
+        clone = DNA.makeSequence(clone, Name='clone')
+        reference = DNA.makeSequence(reference, Name='reference')
+        expected = cogent_local_align(clone, reference)
+        aligned, score, coords, ops = smithwaterman.local_align(clone,
+                                                                reference)
+        msg = '%s vs %s' % (clone, reference)
+        self.assertEqual(score, expected[1], msg)
+        self.assertEqual(coords, expected[2], msg)
+        self.assertEqual(ops, expected[3], msg)
+        self.assertEqual(map(str, aligned), map(str, expected[0]), msg)
+        self.assertEqual((aligned, score), sw_align(clone, reference,
+                                                    return_score=True))
+
+    def test_random_pairs(self):
+        for clone, reference in random_pairs(100):
+            self.assertSameAlignment(clone, reference)
+
+    def test_edge_cases(self):
+        for clone, reference in EDGE_CASES:
+            self.assertSameAlignment(clone, reference)
+            self.assertSameAlignment(reference, clone)
+
+    def test_empty(self):
+        for clone, reference in (('', 'ACGT'), ('ACGT', ''), ('', '')):
+            self.assertSameAlignment(clone, reference)
+            aligned, score, coords, ops = smithwaterman.local_align(
+                    DNA.makeSequence(clone), DNA.makeSequence(reference))
+            self.assertEqual((score, coords, ops), (0, (0, 0, 0, 0), ''))
+
+    def test_wide_band(self):
+        # a band at least as wide as the indels finds the unbanded alignment
+        rng = random.Random(1)
+        reference = random_dna(rng, 60)
+        clone = 'TTTT' + reference[:30] + 'GGG' + reference[30:]
+        expected = smithwaterman.local_align(clone, reference)
+        self.assertEqual(smithwaterman.local_align(clone, reference, band=3,
+                                                   diagonal=4), expected)
+
+    def test_narrow_band(self):
+        # a band narrower than an insertion cannot follow the alignment
+        # across it, so it finds a lower-scoring alignment on one side
+        rng = random.Random(2)
+        reference = random_dna(rng, 60)
+        clone = reference[:40] + 'GGGGGG' + reference[40:]
+        unbanded = smithwaterman.local_align(clone, reference)
+        aligned, score, coords, ops = smithwaterman.local_align(clone,
+                                                reference, band=2, diagonal=0)
+        self.assertTrue(score < unbanded[1])
+        self.assertEqual((score, coords, ops), (40, (0, 40, 0, 40), '40='))
+        start_1, end_1, start_2, end_2 = coords
+        self.assertEqual(str(aligned[0]), clone[start_1:end_1])
+        self.assertEqual(str(aligned[1]), reference[start_2:end_2])
+
+class CloneAlignmentTest(unittest.TestCase):
+
+    def assertSameFlags(self, clone, reference):
+        clone = DNA.makeSequence(clone, Name='clone')
+        reference = DNA.makeSequence(reference, Name='reference')
+        for seqs in ((clone, reference),
+                     (PackedSequence.from_string(str(clone), Name='clone'),
+                      PackedSequence.from_string(str(reference),
+                                                 Name='reference'))):
+            try:
+                expected = align_clone_to_ref(*seqs, aligner='cogent')
+            except AlignmentError:
+                self.assertRaises(AlignmentError, align_clone_to_ref, *seqs,
+                                  aligner='numpy')
+                continue
+            aln = align_clone_to_ref(*seqs, aligner='numpy')
+            for flag in FLAGS:
+                self.assertEqual(getattr(aln, flag), getattr(expected, flag),
+                                 '%s of %s vs %s' % (flag, clone, reference))
+            self.assertEqual(aln.score(), expected.score())
+            self.assertEqual(map(str, aln.Seqs), map(str, expected.Seqs))
+
+    def test_random_pairs(self):
+        for clone, reference in random_pairs(50, seed=3):
+            self.assertSameFlags(clone, reference)
+
+    def test_edge_cases(self):
+        for clone, reference in EDGE_CASES:
+            self.assertSameFlags(clone, reference)
+
+    def test_empty(self):
+        for clone, reference in (('', 'ACGT'), ('ACGT', ''), ('NNNN', 'ACGT')):
+            self.assertSameFlags(clone, reference)
+
+if __name__ == '__main__': unittest.main()
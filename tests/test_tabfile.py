@@ -0,0 +1,300 @@
+'''
+checks how TabFile recognizes comments, process_table, mergesort,
+join_tab_files (in particular the padding of rows without a match) and
+shift_peaks
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import random
+from StringIO import StringIO
+from clonechecker import TabFile as tabfile
+from clonechecker.TabFile import TabFile, BedFile, join_tab_files, shift_peaks
+
+BED_LINES = ['# made by hand', 'track name=test', 'chr1 10 20 a', '',
+             'chr2\t5\t6\tb', 'browser position chr1', 'chr1 1 2 c']
+BED_ROWS = [['chr1', '10', '20', 'a'], ['chr2', '5', '6', 'b'],
+            ['chr1', '1', '2', 'c']]
+
+def write_lines(filename, lines):
+    fh = open(filename, 'w')
+    fh.write(''.join(line + '\n' for line in lines))
+    fh.close()
+    return filename
+
+class CommentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, lines):
+        return write_lines(os.path.join(self.tmpdir, 'test.bed'), lines)
+
+    def test_comments(self):
+        filename = self.write(BED_LINES)
+        for streaming in False, True:
+            bed = BedFile(filename, streaming=streaming)
+            self.assertEqual(list(bed), BED_ROWS)
+            self.assertEqual(bed.comment_line_numbers(), [1, 2, 4, 6])
+            self.assertEqual(bed.get_track_line(), 'track name=test\n')
+        # without the keywords, only # and blank lines are comments
+        tab_file = TabFile(filename)
+        self.assertEqual(len(list(tab_file)), 5)
+        self.assertEqual(tab_file.comment_line_numbers(), [1, 4])
+
+    def test_streaming_knows_only_what_was_read(self):
+        bed = BedFile(self.write(BED_LINES), streaming=True)
+        self.assertEqual(bed.comment_line_numbers(), [])
+        rows = iter(bed)
+        rows.next()
+        self.assertEqual(bed.comment_line_numbers(), [1, 2])
+        self.assertEqual(list(rows), BED_ROWS[1:])
+        self.assertEqual(bed.comment_line_numbers(), [1, 2, 4, 6])
+
+    def test_column_names(self):
+        lines = ['# comment', 'chrom start end', 'chr1 1 2']
+        for streaming in False, True:
+            tab_file = TabFile(self.write(lines), column_names=True,
+                               streaming=streaming)
+            self.assertEqual(list(tab_file), [['chr1', '1', '2']])
+            self.assertEqual(tab_file.get_column_names(),
+                             ['chrom', 'start', 'end'])
+            self.assertEqual(tab_file.comment_line_numbers(), [1, 2])
+        # also together with comment keywords
+        bed = BedFile(self.write(BED_LINES), column_names=True)
+        self.assertEqual(bed.get_column_names(), BED_ROWS[0])
+        self.assertEqual(list(bed), BED_ROWS[1:])
+
+    def test_streams(self):
+        bed = BedFile(StringIO(''.join(line + '\n' for line in BED_LINES)))
+        self.assertTrue(bed.streaming)
+        self.assertEqual(list(bed), BED_ROWS)
+        output = StringIO()
+        tab_file = TabFile(output, 'w')
+        tab_file.write_row(['a', 1])
+        tab_file.close()
+        self.assertEqual(output.getvalue(), 'a\t1' + os.linesep)
+
+    def test_data_chunks(self):
+        # chunks without comments are taken whole, the rest line by line
+        rng = random.Random(12)
+        lines = []
+        for i in xrange(3000):
+            if rng.random() < 0.01: lines.append('track name=%d' % i)
+            elif rng.random() < 0.01: lines.append('')
+            else: lines.append('chr1\t%d\t%d' % (i, i + 1))
+        filename = self.write(lines)
+        expected = [line + '\n' for line in lines
+                    if line != '' and not line.startswith('track')]
+        for streaming in False, True:
+            bed = BedFile(filename, streaming=streaming)
+            chunks = list(bed._iter_data_chunks(size_hint=500))
+            self.assertTrue(len(chunks) > 1)
+            self.assertEqual(sum(chunks, []), expected)
+            self.assertEqual(len(bed.comment_line_contents()),
+                             len(lines) - len(expected))
+
+def widen(row):
+    '''process_table function for ProcessTableTest (workers must pickle it)'''
+    return [row[0], int(row[1]) - 10, int(row[2]) + 10] + row[3:]
+
+class ProcessTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = random.Random(18)
+        lines = ['track name=test', 'chrom\tstart\tend\tname']
+        for i in xrange(5000):
+            start = rng.randint(100, 10000)
+            lines.append('chr1\t%d\t%d\tpeak%d' % (start, start + 50, i))
+            if rng.random() < 0.02: lines.append('browser hide all')
+        self.filename = write_lines(os.path.join(self.tmpdir, 'peaks.bed'),
+                                    lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def process(self, name, **kwargs):
+        output = os.path.join(self.tmpdir, name)
+        bed = BedFile(self.filename, column_names=True)
+        bed.process_table(output, widen, **kwargs)
+        return open(output).read()
+
+    def test_parallel_same_as_serial(self):
+        serial = self.process('serial.bed')
+        self.assertEqual(serial.count('browser hide all'),
+                         open(self.filename).read().count('browser hide all'))
+        self.assertEqual(self.process('parallel.bed', processes=2,
+                                      chunk_size=2000), serial)
+        # with new column names, in place of the old ones
+        serial = self.process('serial.bed', column_names=['c', 's', 'e', 'n'])
+        self.assertTrue('c\ts\te\tn' in serial)
+        self.assertFalse('chrom\tstart' in serial)
+        self.assertEqual(self.process('parallel.bed', processes=3,
+                                      chunk_size=5000,
+                                      column_names=['c', 's', 'e', 'n']),
+                         serial)
+
+class MergesortTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.run_dir = os.path.join(self.tmpdir, 'runs')
+        os.mkdir(self.run_dir)
+        rng = random.Random(16)
+        self.comments = ['# sorted by test', '# second comment']
+        # few distinct keys, so there are many ties to keep in order
+        self.rows = [['chr%d' % rng.randint(1, 12), str(rng.randint(0, 50)),
+                      'row%d' % i] for i in xrange(3000)]
+        self.filename = write_lines(os.path.join(self.tmpdir, 'rows.txt'),
+                                    self.comments[:1] +
+                                    ['\t'.join(row) for row in self.rows] +
+                                    self.comments[1:])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def sort(self, n, numerical=False, **kwargs):
+        '''sorts the test file, returns (comments, rows) of the output'''
+        output = os.path.join(self.tmpdir, 'sorted.txt')
+        TabFile(self.filename).mergesort(output, n, numerical=numerical,
+                                         tmpdir=self.run_dir, **kwargs)
+        # the runs are cleaned up
+        self.assertEqual(os.listdir(self.run_dir), [])
+        lines = [line.rstrip('\n') for line in open(output)]
+        comments = [line for line in lines if line.startswith('#')]
+        return comments, [line.split('\t') for line in lines
+                          if not line.startswith('#')]
+
+    def check(self, n, numerical, key):
+        # sorted() is stable, as mergesort should be
+        expected = (self.comments, sorted(self.rows, key=key))
+        self.assertEqual(self.sort(n, numerical), expected)
+        # out of core, in many runs
+        self.assertEqual(self.sort(n, numerical, memory=20000), expected)
+
+    def test_string_column(self):
+        self.check(0, False, lambda row: row[0])
+
+    def test_numerical_column(self):
+        self.check(1, True, lambda row: int(row[1]))
+
+    def test_several_columns(self):
+        self.check([0, 1], [False, True], lambda row: (row[0], int(row[1])))
+
+    def test_merge_passes(self):
+        # more runs than can be merged at once
+        max_merge_runs = tabfile.MAX_MERGE_RUNS
+        tabfile.MAX_MERGE_RUNS = 3
+        try:
+            self.assertEqual(self.sort(1, True, memory=5000),
+                             (self.comments, sorted(self.rows,
+                                             key=lambda row: int(row[1]))))
+        finally:
+            tabfile.MAX_MERGE_RUNS = max_merge_runs
+
+class JoinTabFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def tab_file(self, name, lines, **kwargs):
+        filename = os.path.join(self.tmpdir, name)
+        fh = open(filename, 'w')
+        fh.write(''.join(line + '\n' for line in lines))
+        fh.close()
+        return TabFile(filename, **kwargs)
+
+    def join(self, left_lines, right_lines, how, method, **kwargs):
+        '''joins two files on their first column, returns the output rows'''
+        output = os.path.join(self.tmpdir, 'joined.txt')
+        join_tab_files(self.tab_file('left.txt', left_lines, **kwargs),
+                       self.tab_file('right.txt', right_lines, **kwargs),
+                       output, 0, how=how, method=method)
+        return [line.rstrip('\r\n').split('\t') for line in open(output)]
+
+    def test_left_join_unmatched_first(self):
+        # the unmatched row comes before any right row has been seen
+        for method in 'merge', 'hash':
+            self.assertEqual(self.join(['a 1', 'b 2'], ['b R2'], 'left',
+                                       method),
+                             [['a', '1', '.', '.'], ['b', '2', 'b', 'R2']])
+
+    def test_outer_join_missing_left_first(self):
+        self.assertEqual(self.join(['b 2'], ['a R1', 'b R2'], 'outer',
+                                   'merge'),
+                         [['.', '.', 'a', 'R1'], ['b', '2', 'b', 'R2']])
+        self.assertEqual(self.join(['b 2'], ['a R1', 'b R2'], 'outer',
+                                   'hash'),
+                         [['b', '2', 'b', 'R2'], ['.', '.', 'a', 'R1']])
+
+    def test_no_matches(self):
+        # no pair has both rows, so neither width can be learned from a pair
+        self.assertEqual(self.join(['a 1 x'], ['b R2'], 'outer', 'merge'),
+                         [['a', '1', 'x', '.', '.'],
+                          ['.', '.', '.', 'b', 'R2']])
+
+    def test_column_names(self):
+        self.assertEqual(self.join(['key value', 'a 1', 'b 2'],
+                                   ['key other', 'b R2'], 'left', 'merge',
+                                   column_names=True),
+                         [['key', 'value', 'key', 'other'],
+                          ['a', '1', '.', '.'], ['b', '2', 'b', 'R2']])
+
+    def test_empty_right(self):
+        self.assertEqual(self.join(['a 1'], [], 'left', 'merge'),
+                         [['a', '1']])
+
+    def test_inner_join(self):
+        for method in 'merge', 'hash':
+            self.assertEqual(self.join(['a 1', 'b 2', 'b 3'],
+                                       ['b R2', 'c R3'], 'inner', method),
+                             [['b', '2', 'b', 'R2'], ['b', '3', 'b', 'R2']])
+
+def shift_peaks_by_row(lines, peak_lengths):
+    '''shifts BED lines one at a time, as shift_peaks used to'''
+    shifted = []
+    for line in lines:
+        if line.startswith('#') or line.startswith('track'): continue
+        peak = line.split('\t')
+        peak_start, peak_end = int(peak[1]), int(peak[2])
+        peak_shift = peak_lengths * (peak_end - peak_start)
+        peak[1] = str(max(peak_start - peak_shift, 0))
+        peak[2] = str(peak_end - peak_shift)
+        shifted.append('\t'.join(peak))
+    return shifted
+
+class ShiftPeaksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_same_as_row_by_row(self):
+        rng = random.Random(15)
+        lines = ['track name=peaks', '# a comment']
+        for i in xrange(5000):
+            start = rng.randint(0, 100000)
+            lines.append('chr%d\t%d\t%d\tpeak%d\t%d\t+' % (rng.randint(1, 3),
+                         start, start + rng.randint(1, 500), i,
+                         rng.randint(0, 1000)))
+        filename = os.path.join(self.tmpdir, 'peaks.bed')
+        fh = open(filename, 'w')
+        fh.write(''.join(line + '\n' for line in lines))
+        fh.close()
+        for peak_lengths in 2, -1, 0:
+            shift_peaks(filename, peak_lengths)
+            shifted = os.path.join(self.tmpdir, 'peaks_shifted.bed')
+            self.assertEqual([line.rstrip('\r\n') for line in open(shifted)],
+                             shift_peaks_by_row(lines, peak_lengths))
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,116 @@
+'''checks TwoBitGenome against twobitreader on a generated .2bit file'''
+import os
+import random
+import re
+import shutil
+import struct
+import tempfile
+import unittest
+import twobitreader
+from clonechecker.twobit import TwoBitGenome, TWOBIT_SIGNATURE
+
+def write_twobit(filename, seqs):
+    '''
+    writes (name, sequence) pairs to a .2bit file. N runs become N blocks
+    and lower case runs become mask blocks
+    '''
+    codes = {'T': 0, 'C': 1, 'A': 2, 'G': 3, 'N': 0}
+    header = struct.pack('<IIII', TWOBIT_SIGNATURE, 0, len(seqs), 0)
+    index_size = sum(1 + len(name) + 4 for name, seq in seqs)
+    offset = len(header) + index_size
+    index = []
+    records = []
+    for name, seq in seqs:
+        index.append(struct.pack('<B', len(name)) + name +
+                     struct.pack('<I', offset))
+        blocks = []
+        for pattern in 'N+', '[a-z]+':
+            runs = [(m.start(), m.end() - m.start()) for m in
+                    re.finditer(pattern, seq)]
+            blocks.append(struct.pack('<I', len(runs)) +
+                          ''.join(struct.pack('<I', start)
+                                  for start, size in runs) +
+                          ''.join(struct.pack('<I', size)
+                                  for start, size in runs))
+        padded = seq.upper() + 'T' * (-len(seq) % 4)
+        dna = ''.join(chr(codes[padded[i]] << 6 | codes[padded[i + 1]] << 4 |
+                          codes[padded[i + 2]] << 2 | codes[padded[i + 3]])
+                      for i in xrange(0, len(padded), 4))
+        record = struct.pack('<I', len(seq)) + blocks[0] + blocks[1] + \
+                 struct.pack('<I', 0) + dna
+        records.append(record)
+        offset += len(record)
+    fh = open(filename, 'wb')
+    fh.write(header + ''.join(index) + ''.join(records))
+    fh.close()
+
+def random_chrom(rng, length):
+    '''returns random bases with some N runs and some masked runs'''
+    bases = [rng.choice('ACGT') for i in xrange(length)]
+    for i in xrange(length // 200):
+        start = rng.randrange(length)
+        size = rng.randint(1, 40)
+        if rng.random() < 0.3:
+            bases[start:start + size] = ['N'] * len(bases[start:start + size])
+        else:
+            bases[start:start + size] = [b.lower() for b in
+                                         bases[start:start + size]]
+    return ''.join(bases)
+
+class TwoBitGenomeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rng = random.Random(10)
+        self.seqs = [('chr1', random_chrom(self.rng, 5003)),
+                     ('chr2', random_chrom(self.rng, 2000)),
+                     ('chrM', random_chrom(self.rng, 17))]
+        self.filename = os.path.join(self.tmpdir, 'genome.2bit')
+        write_twobit(self.filename, self.seqs)
+        self.genome = TwoBitGenome(self.filename)
+        self.reader = twobitreader.TwoBitFile(self.filename)
+
+    def tearDown(self):
+        self.genome.close()
+        shutil.rmtree(self.tmpdir)
+
+    def random_regions(self, num_regions):
+        regions = []
+        for i in xrange(num_regions):
+            name, seq = self.rng.choice(self.seqs)
+            start = self.rng.randint(0, len(seq))
+            regions.append((name, start,
+                            self.rng.randint(start, min(len(seq),
+                                                        start + 300))))
+        return regions
+
+    def test_header(self):
+        self.assertEqual(self.genome.names(), [name for name, seq in self.seqs])
+        for name, seq in self.seqs:
+            self.assertEqual(self.genome.sequence_size(name), len(seq))
+
+    def test_fetch(self):
+        for name, seq in self.seqs:
+            self.assertEqual(self.genome.fetch(name, 0, len(seq)), seq)
+            self.assertEqual(self.genome.fetch(name, 0, len(seq)),
+                             self.reader[name][0:len(seq)])
+        for name, start, end in self.random_regions(300):
+            self.assertEqual(self.genome.fetch(name, start, end),
+                             self.reader[name][start:end])
+
+    def test_fetch_regions(self):
+        # many regions overlap or touch, so most are merged into one read
+        regions = self.random_regions(500)
+        expected = [self.reader[name][start:end] for name, start, end in
+                    regions]
+        self.assertEqual(self.genome.fetch_regions(regions), expected)
+        # and without merging anything
+        self.genome.max_span = 0
+        self.assertEqual(self.genome.fetch_regions(regions), expected)
+        self.assertEqual(self.genome.fetch_regions([]), [])
+
+    def test_errors(self):
+        self.assertRaises(KeyError, self.genome.fetch, 'chr3', 0, 10)
+        self.assertRaises(ValueError, self.genome.fetch, 'chrM', 10, 18)
+
+if __name__ == '__main__': unittest.main()
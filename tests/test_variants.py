@@ -0,0 +1,169 @@
+'''checks find_variants and the VCF and TSV files written from it'''
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy
+from cogent import DNA
+from clonechecker.align import align_clone_to_ref
+from clonechecker.quality import QUALITY_KEY
+from clonechecker.variants import find_variants, VcfWriter, \
+                                  VariantSummary, SUMMARY_COLUMNS
+
+def random_dna(rng, length):
+    return ''.join(rng.choice('ACGT') for i in xrange(length))
+
+def align(clone, reference, ref_name='ref', quality=None):
+    clone = DNA.makeSequence(clone, Name='clone')
+    if quality is not None:
+        clone.Info[QUALITY_KEY] = numpy.array(quality, dtype=numpy.uint8)
+    reference = DNA.makeSequence(reference, Name=ref_name)
+    return align_clone_to_ref(clone, reference, aligner='numpy',
+                              mask_quality=20)
+
+def apply_variants(reference, variants):
+    '''rebuilds the clone from the reference and its variants'''
+    seq = reference
+    for ref_pos, ref_allele, alt_allele, kind in reversed(variants):
+        assert seq[ref_pos:ref_pos + len(ref_allele)] == ref_allele
+        seq = seq[:ref_pos] + alt_allele + seq[ref_pos + len(ref_allele):]
+    return seq
+
+class FindVariantsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(9)
+        self.reference = random_dna(self.rng, 60)
+
+    def test_kinds(self):
+        ref = self.reference
+        snv = 'A' if ref[30] != 'A' else 'C'
+        clone = ref[:30] + snv + ref[31:]
+        self.assertEqual(find_variants(align(clone, ref)),
+                         [(30, ref[30], snv, 'SNV')])
+        clone = ref[:30] + 'GG' + ref[30:]
+        self.assertEqual(find_variants(align(clone, ref)),
+                         [(29, ref[29], ref[29] + 'GG', 'INS')])
+        clone = ref[:30] + ref[33:]
+        variants = find_variants(align(clone, ref))
+        self.assertEqual([(kind, len(ref_allele)) for ref_pos, ref_allele,
+                          alt_allele, kind in variants], [('DEL', 4)])
+        self.assertEqual(apply_variants(ref, variants), clone)
+
+    def test_ambiguous_bases(self):
+        # an N or other ambiguity code that could be the reference base is
+        # not a variant, as it is not a mismatch for has_mismatches
+        ref = self.reference
+        could_be = {'A': 'R', 'G': 'R', 'C': 'Y', 'T': 'Y'}
+        clone = ref[:20] + 'N' + ref[21:40] + could_be[ref[40]] + ref[41:]
+        aln = align(clone, ref)
+        self.assertFalse(aln.has_mismatches)
+        self.assertEqual(find_variants(aln), [])
+        # one that cannot is
+        cannot_be = {'A': 'Y', 'G': 'Y', 'C': 'R', 'T': 'R'}
+        clone = ref[:40] + cannot_be[ref[40]] + ref[41:]
+        aln = align(clone, ref)
+        self.assertTrue(aln.has_mismatches)
+        self.assertEqual(find_variants(aln),
+                         [(40, ref[40], cannot_be[ref[40]], 'SNV')])
+
+    def test_masked(self):
+        ref = self.reference
+        snv = 'A' if ref[30] != 'A' else 'C'
+        clone = ref[:30] + snv + ref[31:]
+        quality = [40] * len(clone)
+        quality[30] = 5
+        aln = align(clone, ref, quality=quality)
+        self.assertEqual(list(aln.masked_positions), [30])
+        self.assertEqual(find_variants(aln), [])
+
+    def test_rebuild(self):
+        # substitutions and indels away from the ends give back the clone
+        for i in xrange(100):
+            ref = random_dna(self.rng, 80)
+            clone = list(ref)
+            for pos in sorted(self.rng.sample(xrange(10, 70), 3),
+                              reverse=True):
+                kind = self.rng.choice('SID')
+                if kind == 'S': clone[pos] = self.rng.choice('ACGT')
+                elif kind == 'I': clone[pos:pos] = random_dna(self.rng, 2)
+                else: del clone[pos]
+            clone = ''.join(clone)
+            aln = align(clone, ref)
+            variants = find_variants(aln)
+            self.assertEqual(variants, sorted(variants))
+            # local alignments start and end with a match, so the variants
+            # turn the aligned part of the reference into the aligned clone
+            first = aln.first_ref_pos
+            shifted = [(variant[0] - first,) + variant[1:] for variant in
+                       variants]
+            self.assertEqual(apply_variants(ref[first:aln.last_ref_pos],
+                                            shifted),
+                             str(aln.Seqs[0]).replace('-', ''))
+
+class VariantWritersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = random.Random(9)
+        self.references = [random_dna(rng, 40) for i in xrange(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def alignments(self):
+        ref0, ref1, ref2 = self.references
+        mutate = lambda ref, pos: ref[:pos] + \
+                 ('A' if ref[pos] != 'A' else 'C') + ref[pos + 1:]
+        # written out of order: the genomic reference on chr2 first, then a
+        # later position on chr1 before an earlier one
+        return [align(mutate(ref2, 5), ref2, 'r2 (chr2:100-140)'),
+                align(mutate(ref0, 30), ref0, 'r0 (chr1:1000-1040)'),
+                align(mutate(mutate(ref1, 20), 10), ref1,
+                      'r1 (chr1:500-540)'),
+                align(ref0, ref0, 'plain ref')]
+
+    def test_vcf(self):
+        filename = os.path.join(self.tmpdir, 'variants.vcf')
+        vcf = VcfWriter(filename)
+        for aln in self.alignments(): vcf.write_alignment(aln)
+        vcf.close()
+        lines = open(filename).read().splitlines()
+        header = [line for line in lines if line.startswith('##')]
+        self.assertEqual(lines[:len(header)], header)
+        self.assertEqual([line for line in header if
+                          line.startswith('##contig')],
+                         ['##contig=<ID=chr1>', '##contig=<ID=chr2>',
+                          '##contig=<ID=plain_ref,length=40>'])
+        self.assertTrue(lines[len(header)].startswith('#CHROM'))
+        records = [line.split('\t') for line in lines[len(header) + 1:]]
+        self.assertEqual([(chrom, int(pos)) for chrom, pos in
+                          [record[:2] for record in records]],
+                         [('chr1', 511), ('chr1', 521), ('chr1', 1031),
+                          ('chr2', 106)])
+        self.assertEqual(records[0][7],
+                         'CLONE=clone;REFERENCE=r1_(chr1:500-540);TYPE=SNV')
+        self.assertEqual(records[0][3], self.references[1][10])
+
+    def test_summary(self):
+        filename = os.path.join(self.tmpdir, 'variants.tsv')
+        summary = VariantSummary(filename)
+        for aln in self.alignments(): summary.write_alignment(aln)
+        summary.close()
+        lines = [line.rstrip('\n').split('\t') for line in open(filename)]
+        self.assertEqual(lines[0], SUMMARY_COLUMNS)
+        rows = [dict(zip(SUMMARY_COLUMNS, line)) for line in lines[1:]]
+        self.assertEqual([row['chrom'] for row in rows],
+                         ['chr2', 'chr1', 'chr1', 'plain ref'])
+        self.assertEqual([row['status'] for row in rows],
+                         ['mutated'] * 3 + ['perfect'])
+        self.assertEqual([row['snvs'] for row in rows], ['1', '1', '2', '0'])
+        self.assertEqual((rows[0]['start'], rows[0]['end']), ('100', '140'))
+        variants = find_variants(self.alignments()[2])
+        self.assertEqual(rows[2]['variants'],
+                         'chr1:511:%s>%s,chr1:521:%s>%s' % (variants[0][1:3] +
+                                                            variants[1][1:3]))
+        self.assertEqual(rows[3]['variants'], '.')
+
+if __name__ == '__main__': unittest.main()